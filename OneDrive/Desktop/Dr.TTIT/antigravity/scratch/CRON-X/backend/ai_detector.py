@@ -4,122 +4,365 @@ This module implements a machine learning-based anomaly detection system
 for identifying suspicious user activities.
 """
 
+import os
+import re
+import threading
 import numpy as np
+import joblib
+from dataclasses import dataclass, field, replace
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 from datetime import datetime
 import json
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from .behavior_features import as_trace
+    from .feature_schema import FEATURE_DTYPE, FEATURE_EXTRACTOR
+    from .ip_enrichment import ip_enricher
+    from .stream_sketches import TopTalkers, talker_features
+    from .window_counters import ActivityCounters, velocity_features
+except ImportError:  # Loaded as a top-level module by mcp_server.py
+    from behavior_features import as_trace
+    from feature_schema import FEATURE_DTYPE, FEATURE_EXTRACTOR
+    from ip_enrichment import ip_enricher
+    from stream_sketches import TopTalkers, talker_features
+    from window_counters import ActivityCounters, velocity_features
+
+# Columns of the feature vector, in order (defined in feature_schema.py).
+# Saved with every model artifact so a model is never loaded against a
+# different feature layout.
+FEATURE_NAMES = list(FEATURE_EXTRACTOR.names)
+
+# On-disk model artifacts: <MODEL_DIR>/anomaly_detector_v0001.joblib, ...
+ARTIFACT_FORMAT = 1
+MODEL_DIR = os.getenv(
+    "MODEL_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_artifacts")
+)
+MODEL_KEEP_VERSIONS = int(os.getenv("MODEL_KEEP_VERSIONS", "5"))
+_ARTIFACT_NAME = re.compile(r"^anomaly_detector_v(\d+)\.joblib$")
+
+@dataclass(frozen=True)
+class ModelVersion:
+    """
+    One fitted scaler + forest pair
+    
+    Never mutated after creation: retraining builds a new ModelVersion and
+    the registry swaps it in, so a prediction can never see a new scaler
+    paired with an old forest.
+    """
+    version: int
+    scaler: StandardScaler
+    model: IsolationForest
+    metadata: Dict = field(default_factory=dict)
+    
+    def to_state(self) -> Dict:
+        """Artifact contents: fitted model plus feature schema and metadata"""
+        return {
+            'format': ARTIFACT_FORMAT,
+            'version': self.version,
+            'feature_names': list(FEATURE_NAMES),
+            'feature_schema': FEATURE_EXTRACTOR.describe(),
+            'metadata': dict(self.metadata),
+            'scaler': self.scaler,
+            'model': self.model
+        }
+    
+    @classmethod
+    def from_state(cls, state: Dict) -> 'ModelVersion':
+        if state.get('format') != ARTIFACT_FORMAT:
+            raise ValueError(f"Unsupported model artifact format: {state.get('format')}")
+        if state.get('feature_names') != FEATURE_NAMES:
+            raise ValueError(
+                f"Model artifact was trained on features {state.get('feature_names')}, "
+                f"expected {FEATURE_NAMES}"
+            )
+        return cls(
+            version=state['version'],
+            scaler=state['scaler'],
+            model=state['model'],
+            metadata=state['metadata']
+        )
+
+class ModelRegistry:
+    def __init__(self, keep: int = MODEL_KEEP_VERSIONS):
+        """Recent model versions and the one currently serving"""
+        self.keep = keep
+        self._versions: Dict[int, ModelVersion] = {}
+        self._active: Optional[ModelVersion] = None
+        self._lock = threading.Lock()
+    
+    @property
+    def active(self) -> Optional[ModelVersion]:
+        """The serving version (read once per prediction; swapped atomically)"""
+        return self._active
+    
+    @property
+    def latest_version(self) -> int:
+        return max(self._versions, default=0)
+    
+    def next_version(self) -> int:
+        with self._lock:
+            return self.latest_version + 1
+    
+    def register(self, model_version: ModelVersion, activate: bool = True):
+        """Add a version and, by default, make it the serving one"""
+        with self._lock:
+            self._versions[model_version.version] = model_version
+            # Keep the newest versions plus whatever is serving
+            for version in sorted(self._versions)[:-self.keep]:
+                if self._active is None or version != self._active.version:
+                    del self._versions[version]
+            if activate:
+                self._active = model_version
+    
+    def activate(self, version: int) -> ModelVersion:
+        """Serve a previously registered version (e.g. roll back)"""
+        with self._lock:
+            if version not in self._versions:
+                raise KeyError(f"Model version {version} is not registered")
+            self._active = self._versions[version]
+            return self._active
+    
+    def list_versions(self) -> List[Dict]:
+        active_version = self._active.version if self._active else None
+        return [
+            {
+                'version': version,
+                'active': version == active_version,
+                'metadata': model_version.metadata
+            }
+            for version, model_version in sorted(self._versions.items())
+        ]
 
 class AnomalyDetector:
     def __init__(self):
         """Initialize the anomaly detection model"""
+        self.registry = ModelRegistry()
+        self._scratch = threading.local()  # Per-thread feature buffer for predict_batch
+    
+    @property
+    def is_trained(self) -> bool:
+        return self.registry.active is not None
+    
+    @property
+    def version(self) -> int:
+        """Version of the serving model; 0 = untrained (rule-based fallback)"""
+        active = self.registry.active
+        return active.version if active else 0
+    
+    @property
+    def metadata(self) -> Dict:
+        active = self.registry.active
+        return active.metadata if active else {}
+    
+    def _new_forest(self) -> IsolationForest:
         # Isolation Forest is excellent for anomaly detection
-        self.model = IsolationForest(
+        return IsolationForest(
             contamination=0.1,  # Expected proportion of anomalies
             random_state=42,
             n_estimators=100
         )
-        self.scaler = StandardScaler()
-        self.is_trained = False
         
     def extract_features(self, log_data: Dict) -> np.ndarray:
         """
         Extract features from log data for AI analysis
         
-        Features:
-        - Login hour (0-23)
-        - Day of week (0-6)
-        - Cursor movement speed (if available)
-        - Keystroke speed (if available)
-        - Session duration
-        - Number of API calls
-        - Geographic anomaly score (IP-based)
+        Returns a (1, n_features) float32 row; the columns are listed in
+        feature_schema.FEATURE_SCHEMA (time, behavior, network, gateway
+        velocity counters and sketches, raw-trace kinematics).
         """
-        features = []
-        
-        # Time-based features
-        timestamp = log_data.get('timestamp', datetime.now().timestamp())
-        dt = datetime.fromtimestamp(timestamp)
-        hour = dt.hour
-        day_of_week = dt.weekday()
-        
-        features.append(hour)
-        features.append(day_of_week)
-        
-        # Behavioral features
-        cursor_speed = log_data.get('cursor_speed', 0)
-        keystroke_speed = log_data.get('keystroke_speed', 300)
-        session_duration = log_data.get('session_duration', 0)
-        api_calls = log_data.get('api_calls_count', 0)
-        
-        features.append(cursor_speed)
-        features.append(keystroke_speed)
-        features.append(session_duration)
-        features.append(api_calls)
-        
-        # Geographic anomaly (simplified - IP range)
-        ip = log_data.get('ip', '0.0.0.0')
-        ip_parts = ip.split('.')
-        ip_score = int(ip_parts[0]) if ip_parts else 0
-        features.append(ip_score)
-        
-        return np.array(features).reshape(1, -1)
+        return self.extract_feature_matrix([log_data])
+    
+    def extract_feature_matrix(self, logs: List[Dict], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Build one (n_logs, n_features) float32 matrix for a batch of logs (into out if given)"""
+        return FEATURE_EXTRACTOR.extract(logs, out)
+    
+    def _feature_buffer(self, n_rows: int) -> np.ndarray:
+        """This thread's reusable feature buffer with at least n_rows rows"""
+        buffer = getattr(self._scratch, 'buffer', None)
+        if buffer is None or len(buffer) < n_rows:
+            buffer = np.empty((max(n_rows, 64), FEATURE_EXTRACTOR.n_features), dtype=FEATURE_DTYPE)
+            self._scratch.buffer = buffer
+        return buffer
     
-    def train(self, training_logs: List[Dict]):
-        """Train the model on normal user behavior"""
+    def fit_version(self, training_logs: List[Dict]) -> Optional[ModelVersion]:
+        """
+        Fit a new scaler and forest without touching the serving model
+        
+        Returns the new (not yet active) ModelVersion, or None if there
+        is not enough training data.
+        """
         if len(training_logs) < 10:
             print("Warning: Not enough training data")
-            return False
+            return None
             
         # Extract features from all training logs
-        feature_matrix = np.vstack([
-            self.extract_features(log).flatten() 
-            for log in training_logs
-        ])
+        feature_matrix = self.extract_feature_matrix(training_logs)
         
         # Normalize features
-        self.scaler.fit(feature_matrix)
-        normalized_features = self.scaler.transform(feature_matrix)
+        scaler = StandardScaler()
+        normalized_features = scaler.fit_transform(feature_matrix)
         
         # Train the model
-        self.model.fit(normalized_features)
-        self.is_trained = True
+        model = self._new_forest()
+        model.fit(normalized_features)
         
         print(f"Model trained on {len(training_logs)} samples")
+        return ModelVersion(
+            version=self.registry.next_version(),
+            scaler=scaler,
+            model=model,
+            metadata={
+                'trained_at': datetime.now().isoformat(),
+                'n_samples': len(training_logs),
+                'n_estimators': model.n_estimators,
+                'contamination': model.contamination
+            }
+        )
+    
+    def train(self, training_logs: List[Dict]) -> bool:
+        """Train a new model version on normal user behavior and swap it in"""
+        model_version = self.fit_version(training_logs)
+        if model_version is None:
+            return False
+        self.registry.register(model_version)
         return True
     
-    def predict(self, log_data: Dict) -> Tuple[bool, float, str]:
+    def train_and_save(self, training_logs: List[Dict], directory: str = MODEL_DIR) -> Optional[ModelVersion]:
+        """Fit a new version, persist it as an artifact, then swap it in"""
+        model_version = self.fit_version(training_logs)
+        if model_version is None:
+            return None
+        model_version, _ = self.save_artifact(model_version, directory)
+        self.registry.register(model_version)
+        return model_version
+    
+    def predict(self, log_data: Dict) -> Tuple[bool, float, str, int]:
         """
         Predict if a log entry is anomalous
         
         Returns:
-            Tuple of (is_anomaly, confidence_score, reason)
+            Tuple of (is_anomaly, confidence_score, reason, model_version)
+        """
+        return self.predict_batch([log_data])[0]
+    
+    def predict_batch(self, logs: List[Dict]) -> List[Tuple[bool, float, str, int]]:
+        """
+        Predict a batch of log entries in one pass
+        
+        The scaler and score_samples each run once over the whole feature
+        matrix instead of once per row. The -1/1 label is derived from the
+        same scores (score below the forest's offset_ = anomaly), which is
+        exactly what model.predict does, so the trees are only walked once.
+        
+        The serving version is read once, so the whole batch is scored by
+        one version even if a new one is swapped in meanwhile.
+        
+        Returns:
+            List of (is_anomaly, confidence_score, reason, model_version)
+            in input order; model_version is 0 for the rule-based fallback
         """
-        if not self.is_trained:
+        if not logs:
+            return []
+        
+        active = self.registry.active
+        if active is None:
             # Use rule-based detection if model not trained
-            return self._rule_based_detection(log_data)
+            return [self._rule_based_detection(log) + (0,) for log in logs]
         
-        # Extract and normalize features
-        features = self.extract_features(log_data)
-        normalized = self.scaler.transform(features)
+        # Only used within this call, so the thread's buffer can be reused
+        features = self.extract_feature_matrix(logs, out=self._feature_buffer(len(logs)))
+        return self._score(active, features)
+    
+    def predict_batch_with_features(self, logs: List[Dict]) -> Tuple[List[Tuple[bool, float, str, int]], np.ndarray]:
+        """
+        predict_batch plus the feature matrix it scored
         
-        # Get prediction (-1 = anomaly, 1 = normal)
-        prediction = self.model.predict(normalized)[0]
+        The matrix is a new array the caller may keep, so later stages
+        (entity baselines, streaming training) need not extract the
+        features, trace kinematics included, a second time.
+        """
+        features = self.extract_feature_matrix(logs)
+        active = self.registry.active
+        if active is None:
+            return [self._rule_based_detection(log) + (0,) for log in logs], features
+        return self._score(active, features), features
+    
+    def _score(self, active: ModelVersion, features: np.ndarray) -> List[Tuple[bool, float, str, int]]:
+        """Score a feature matrix with one model version"""
+        normalized = active.scaler.transform(features)
         
-        # Get anomaly score (lower = more anomalous)
-        score = self.model.score_samples(normalized)[0]
+        # Anomaly score (lower = more anomalous)
+        scores = active.model.score_samples(normalized)
+        is_anomaly = scores < active.model.offset_
         
         # Convert to probability (0-1, higher = more anomalous)
         # Isolation Forest scores are negative, so we transform them
-        anomaly_probability = 1 / (1 + np.exp(score * 2))
+        anomaly_probabilities = 1 / (1 + np.exp(scores * 2))
+        reasons = FEATURE_EXTRACTOR.reasons(features)
         
-        is_anomaly = prediction == -1
+        return [
+            (bool(is_anomaly[i]), float(anomaly_probabilities[i]), reasons[i], active.version)
+            for i in range(len(features))
+        ]
+    
+    def get_state(self) -> Optional[Dict]:
+        """Artifact contents of the serving model (None if untrained), e.g. for worker processes"""
+        active = self.registry.active
+        return active.to_state() if active else None
+    
+    def set_state(self, state: Optional[Dict]):
+        """Register and serve a model from get_state() / an artifact"""
+        if state is not None:
+            self.registry.register(ModelVersion.from_state(state))
+    
+    def load(self, path: str, mmap_mode: Optional[str] = None):
+        """
+        Load an artifact and serve it
         
-        # Determine reason
-        reason = self._get_anomaly_reason(log_data, features)
+        With mmap_mode="r" the model's numpy arrays are memory-mapped
+        read-only, so many worker processes share one copy in the page cache.
+        """
+        self.set_state(joblib.load(path, mmap_mode=mmap_mode))
+    
+    def save_artifact(
+        self,
+        model_version: Optional[ModelVersion] = None,
+        directory: str = MODEL_DIR
+    ) -> Tuple[ModelVersion, str]:
+        """
+        Save a model version (default: the serving one) as an artifact
         
-        return is_anomaly, anomaly_probability, reason
+        Versions are claimed with an exclusive hard link, so concurrent
+        writers never overwrite each other. If another process already
+        saved this version number, the model is saved under the next free
+        one. Returns the (possibly renumbered) version and artifact path.
+        """
+        model_version = model_version or self.registry.active
+        if model_version is None:
+            raise ValueError("No trained model to save")
+        
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, f".anomaly_detector.{os.getpid()}.tmp")
+        
+        while True:
+            latest = latest_artifact(directory)
+            version = max(model_version.version, (latest[0] if latest else 0) + 1)
+            model_version = replace(model_version, version=version)
+            joblib.dump(model_version.to_state(), tmp_path)
+            path = artifact_path(version, directory)
+            try:
+                os.link(tmp_path, path)
+                break
+            except FileExistsError:
+                continue  # Another process took this version - try the next one
+            finally:
+                os.remove(tmp_path)
+        
+        prune_artifacts(directory)
+        return model_version, path
     
     def _rule_based_detection(self, log_data: Dict) -> Tuple[bool, float, str]:
         """Fallback rule-based detection when ML model not trained"""
@@ -149,60 +392,263 @@ class AnomalyDetector:
         if log_data.get('failed_logins', 0) > 3:
             anomalies.append("Multiple failed login attempts")
             score += 0.5
-        
+
+        # Check for a login from a network or country the user never used
+        if log_data.get('asn_new_for_user') or log_data.get('country_new_for_user'):
+            anomalies.append("Login from a new network for this user")
+            score += 0.3
+
         is_anomaly = score > 0.5
         reason = "; ".join(anomalies) if anomalies else "Normal behavior"
         
         return is_anomaly, min(score, 1.0), reason
+
+def normalize_log_data(log_data: Dict) -> Dict:
+    """Pick the fields the model uses from a raw log, fill in defaults and enrich the IP (no side effects)"""
+    timestamp = log_data.get('timestamp')
+    return ip_enricher.enrich({
+        'timestamp': timestamp if timestamp is not None else datetime.now().timestamp(),
+        'user_id': log_data.get('user_id'),
+        'session_id': log_data.get('session_id'),
+        'ip': log_data.get('ip') or '0.0.0.0',
+        'cursor_speed': log_data.get('cursor_speed') or 0,
+        'keystroke_speed': log_data.get('keystroke_speed') or 300,
+        'session_duration': log_data.get('session_duration') or 0,
+        'api_calls_count': log_data.get('api_calls_count') or 0,
+        'failed_logins': log_data.get('failed_logins') or 0,
+        'cohort': log_data.get('cohort'),
+        'asn': log_data.get('asn'),
+        'cursor_trace': as_trace(log_data.get('cursor_trace')),
+        'keystroke_times': log_data.get('keystroke_times') or None,
+        'network_history': log_data.get('network_history'),
+        **velocity_features(log_data.get('velocity')),
+        **talker_features(log_data.get('talkers'))
+    })
+
+def classify_prediction(is_anomaly: bool, confidence: float, reason: str, model_version: int = 0) -> Dict:
+    """
+    Map a raw model output to severity and recommended action
     
-    def _get_anomaly_reason(self, log_data: Dict, features: np.ndarray) -> str:
-        """Generate human-readable reason for anomaly"""
-        reasons = []
-        
-        hour = int(features[0, 0])
-        keystroke_speed = features[0, 3]
-        cursor_speed = features[0, 2]
-        
-        if 2 <= hour <= 5:
-            reasons.append(f"Login at {hour}:00 (unusual hour)")
-        
-        if keystroke_speed < 100:
-            reasons.append("Abnormally slow typing")
-        elif keystroke_speed > 600:
-            reasons.append("Abnormally fast typing (possible bot)")
-        
-        if cursor_speed > 1000:
-            reasons.append("Erratic cursor movements")
-        
-        if not reasons:
-            reasons.append("Statistical anomaly in behavior pattern")
-        
-        return "; ".join(reasons)
+    Shared by the MCP server and the in-process inference transport so
+    both produce identical predictions.
+    """
+    # Determine severity based on confidence
+    if confidence > 0.8:
+        severity = "high"
+    elif confidence > 0.5:
+        severity = "medium"
+    else:
+        severity = "low"
+    
+    # Determine recommended action
+    if severity == "high":
+        action = "block_ip"
+    elif severity == "medium":
+        action = "alert"
+    else:
+        action = "monitor"
+    
+    return {
+        "is_anomaly": bool(is_anomaly),
+        "confidence": round(float(confidence), 3),
+        "reason": reason,
+        "severity": severity,
+        "recommended_action": action,
+        "model_version": model_version
+    }
+
+def artifact_path(version: int, directory: str = MODEL_DIR) -> str:
+    return os.path.join(directory, f"anomaly_detector_v{version:04d}.joblib")
+
+def list_artifacts(directory: str = MODEL_DIR) -> List[Tuple[int, str]]:
+    """(version, path) of every saved artifact, oldest first"""
+    if not os.path.isdir(directory):
+        return []
+    artifacts = []
+    for name in os.listdir(directory):
+        match = _ARTIFACT_NAME.match(name)
+        if match:
+            artifacts.append((int(match.group(1)), os.path.join(directory, name)))
+    return sorted(artifacts)
+
+def latest_artifact(directory: str = MODEL_DIR) -> Optional[Tuple[int, str]]:
+    """(version, path) of the newest artifact, or None"""
+    artifacts = list_artifacts(directory)
+    return artifacts[-1] if artifacts else None
+
+def prune_artifacts(directory: str = MODEL_DIR, keep: int = MODEL_KEEP_VERSIONS):
+    """Delete all but the newest `keep` artifacts"""
+    for _, path in list_artifacts(directory)[:-keep]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
 
 # Global instance
 detector = AnomalyDetector()
 
-def initialize_with_sample_data():
-    """Initialize the model with sample normal behavior data"""
+def predict_logs(logs: List[Dict]) -> List[Tuple[bool, float, str, int]]:
+    """Score logs with the global detector (picklable entry point for worker pools)"""
+    return detector.predict_batch(logs)
+
+def predict_logs_with_features(logs: List[Dict]) -> Tuple[List[Tuple[bool, float, str, int]], np.ndarray]:
+    """predict_logs plus the scored feature matrix (picklable entry point for worker pools)"""
+    return detector.predict_batch_with_features(logs)
+
+def serving_artifact(directory: str = MODEL_DIR):
+    """
+    What a worker process needs to serve the active model (None if untrained)
+
+    The artifact path when the active version was saved, so workers
+    memory-map it instead of each receiving a pickled copy; otherwise
+    (never saved, or pruned) its state.
+    """
+    active = detector.registry.active
+    if active is None:
+        return None
+    path = artifact_path(active.version, directory)
+    return path if os.path.exists(path) else active.to_state()
+
+def load_detector_artifact(artifact):
+    """Worker-process initializer: serve serving_artifact()'s path (memory-mapped) or state"""
+    if isinstance(artifact, str):
+        detector.load(artifact, mmap_mode="r")
+    else:
+        detector.set_state(artifact)
+
+def _sample_cursor_trace(n_points: int = 120) -> Dict[str, List[int]]:
+    """Human-like cursor trace: uneven sampling, wandering heading, occasional pauses"""
+    dt = np.random.randint(10, 40, n_points)
+    dt[np.random.rand(n_points) < 0.08] += np.random.randint(200, 800)
+    dt[0] = 0
+    heading = np.cumsum(np.random.normal(0, 0.5, n_points))
+    step = np.random.gamma(2.0, 3.0, n_points) * (dt < 200)
+    return {
+        't': np.cumsum(dt).tolist(),
+        'x': (400 + np.cumsum(step * np.cos(heading))).astype(int).tolist(),
+        'y': (300 + np.cumsum(step * np.sin(heading))).astype(int).tolist()
+    }
+
+def _sample_keystroke_times(n_keys: int = 40) -> List[float]:
+    """Human typing: ~180 ms between keys with natural jitter"""
+    return np.cumsum(np.clip(np.random.normal(180, 60, n_keys), 40, None)).tolist()
+
+def _sample_gateway_events(n_users: int = 60) -> List[Dict]:
+    """
+    A synthetic office day (9 AM - 6 PM) of gateway events, oldest first
+
+    A third of the users share one of two office NAT / VPN exits, so several
+    users on one IP within a minute is normal; the rest have an IP each,
+    spread over several networks.
+    Now and then a login is preceded by a mistyped password.
+    """
+    day = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0).timestamp()
+    events = []
+    for user in range(n_users):
+        home = ("192.168.1", "192.0.2", "198.51.100", "203.0.113", "185.60.7")[user % 5]
+        ip = f"203.0.113.{250 + user % 2}" if user % 3 == 0 else f"{home}.{user + 1}"
+        for session in range(np.random.randint(1, 4)):
+            t = day + np.random.uniform(0, 8.5 * 3600)
+            base = {'user_id': f"user_{user}", 'session_id': f"sess_{user}_{session}", 'ip': ip}
+            if np.random.rand() < 0.05:
+                events.append({**base, 'timestamp': t, 'event_type': 'failed_login'})
+                t += np.random.uniform(5, 30)
+            events.append({**base, 'timestamp': t, 'event_type': 'login'})
+            for _ in range(np.random.randint(5, 60)):
+                t += np.random.exponential(45)
+                events.append({**base, 'timestamp': t, 'event_type': 'api_call'})
+    return sorted(events, key=lambda event: event['timestamp'])
+
+def _sample_velocities(events: List[Dict]) -> List[Dict[str, int]]:
+    """Velocity blocks of events replayed through the gateway's window counters"""
+    counters = ActivityCounters()
+    return [counters.record(event, now=event['timestamp']) for event in events]
+
+def _sample_talkers(events: List[Dict]) -> List[Dict[str, float]]:
+    """Talkers blocks of events replayed through the gateway's stream sketches"""
+    talkers = TopTalkers(asn_of=ip_enricher.asn_label)
+    return [talkers.record(event, now=event['timestamp']) for event in events]
+
+def _sample_ip(i: int) -> str:
+    if i % 10 == 0:
+        return f"185.{np.random.randint(0, 256)}.{np.random.randint(0, 256)}.{np.random.randint(1, 255)}"
+    return f"{'192.168.1' if i % 3 else '203.0.113'}.{np.random.randint(1, 255)}"
+
+def _sample_network_history(i: int) -> Dict[str, int]:
+    """Gateway network history of known users who rarely switch networks, and countries even less"""
+    return {
+        'asn_new_for_user': int(i % 33 == 7),
+        'country_new_for_user': int(i % 50 == 7),
+        'user_asn_count': int(np.random.randint(1, 4))
+    }
+
+def initialize_with_sample_data(directory: Optional[str] = None):
+    """Train the model on generated sample normal behavior data (saved to directory if given)"""
     # Generate sample normal user behavior for training
     sample_logs = []
+    # Gateway counters and sketches come from replaying a synthetic day, so
+    # they are distributed like the ones served in production
+    events = _sample_gateway_events()
+    velocities = _sample_velocities(events)
+    talkers = _sample_talkers(events)
+    picks = np.random.choice(len(events), 100, replace=False)
     
     for i in range(100):
         # Normal working hours (9 AM - 6 PM)
         hour = np.random.randint(9, 18)
         timestamp = datetime.now().replace(hour=hour).timestamp()
         
-        sample_logs.append({
+        log = normalize_log_data({
             'timestamp': timestamp,
             'cursor_speed': np.random.randint(50, 200),
             'keystroke_speed': np.random.randint(250, 400),
             'session_duration': np.random.randint(300, 7200),
             'api_calls_count': np.random.randint(10, 100),
-            'ip': f"192.168.1.{np.random.randint(1, 255)}",
-            'failed_logins': 0
+            # Office network, the documentation ranges of the sample IP table
+            # and now and then a public IP missing from the table
+            'ip': _sample_ip(i),
+            'failed_logins': 0,
+            # Not every client sends raw traces
+            'cursor_trace': _sample_cursor_trace() if i % 2 else None,
+            'keystroke_times': _sample_keystroke_times() if i % 2 else None,
+            'velocity': velocities[picks[i]],
+            'talkers': talkers[picks[i]],
+            'network_history': _sample_network_history(i)
         })
+        sample_logs.append(log)
     
-    detector.train(sample_logs)
+    if directory:
+        detector.train_and_save(sample_logs, directory)
+    else:
+        detector.train(sample_logs)
 
-# Initialize on import
-initialize_with_sample_data()
+def initialize_detector(directory: str = MODEL_DIR, train_if_missing: bool = True) -> str:
+    """
+    Prepare the global detector for serving (called explicitly at startup)
+    
+    Loads the newest artifact from directory, memory-mapped read-only.
+    If there is none (or it has a different feature layout) and
+    train_if_missing is set, trains on sample data and saves the
+    result as the next version. Otherwise the detector stays
+    untrained and predictions use the rule-based fallback.
+    
+    Returns "ready" (already trained in this process), "loaded",
+    "trained" or "untrained".
+    """
+    if detector.is_trained:
+        return "ready"
+    
+    latest = latest_artifact(directory)
+    if latest:
+        try:
+            detector.load(latest[1], mmap_mode="r")
+            return "loaded"
+        except ValueError as e:
+            # e.g. saved before the feature layout changed - retrain below
+            print(f"Ignoring model artifact v{latest[0]}: {e}")
+    
+    if train_if_missing:
+        initialize_with_sample_data(directory)
+        return "trained"
+    
+    return "untrained"
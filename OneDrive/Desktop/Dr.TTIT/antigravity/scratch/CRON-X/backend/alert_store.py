@@ -0,0 +1,193 @@
+"""
+Alert Store
+Bounded, indexed in-memory store for alerts:
+- ring buffer of the newest `capacity` alerts, oldest evicted first
+- hash index on alert_id
+- secondary indexes on severity, status, user, IP and session
+- newest-first listing with cursor pagination
+
+Every alert gets a sequence number when it is added. Each secondary index
+maps a value to the ascending list of sequence numbers that carry it, so a
+filtered page only touches the matching alerts. Eviction always drops the
+oldest sequence number, i.e. the front of its index lists: those entries
+are left in place (everything below the oldest live sequence number is
+ignored) and trimmed in one slice once they make up half of a list, so an
+eviction costs O(1) amortised instead of a shift of the whole list.
+"""
+
+import os
+from bisect import bisect_left, insort
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .models import Alert
+
+INDEXED_FIELDS = ("severity", "status", "user_id", "ip", "session_id")
+
+
+class AlertStore:
+    def __init__(self, capacity: int = 10000):
+        self.capacity = capacity
+        self._ring: List[Optional[Alert]] = [None] * capacity
+        self._next_seq = 0
+        self._by_id: Dict[str, int] = {}
+        self._indexes: Dict[str, Dict[str, List[int]]] = {field: {} for field in INDEXED_FIELDS}
+        self.evicted = 0  # Alerts pushed out by newer ones (still in persistent storage, if enabled)
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __iter__(self) -> Iterator[Alert]:
+        """Alerts newest first"""
+        for seq in range(self._next_seq - 1, self._oldest_seq - 1, -1):
+            alert = self._ring[seq % self.capacity]
+            if alert is not None:
+                yield alert
+
+    @property
+    def _oldest_seq(self) -> int:
+        return max(0, self._next_seq - self.capacity)
+
+    def add(self, alert: Alert) -> bool:
+        """Store a new alert, evicting the oldest one when full; False (nothing stored) if its id is taken"""
+        if alert.alert_id in self._by_id:
+            return False
+        if self._next_seq >= self.capacity and self._ring[self._next_seq % self.capacity] is not None:
+            self._evict(self._next_seq - self.capacity, oldest=True)
+            self.evicted += 1
+
+        seq = self._next_seq
+        self._next_seq += 1
+        self._ring[seq % self.capacity] = alert
+        self._by_id[alert.alert_id] = seq
+        for field in INDEXED_FIELDS:
+            # New sequence numbers are always the largest - append keeps order
+            self._indexes[field].setdefault(getattr(alert, field), []).append(seq)
+        return True
+
+    def _evict(self, seq: int, oldest: bool = False):
+        alert = self._ring[seq % self.capacity]
+        if alert is None:
+            return
+        self._ring[seq % self.capacity] = None
+        del self._by_id[alert.alert_id]
+        for field in INDEXED_FIELDS:
+            if oldest:
+                self._trim(field, getattr(alert, field), seq + 1)
+            else:
+                self._unindex(field, getattr(alert, field), seq)
+
+    def _trim(self, field: str, value: str, live_from: int):
+        """Forget the sequence numbers below live_from in one index list, lazily"""
+        seqs = self._indexes[field].get(value)
+        if not seqs:
+            return
+        dead = bisect_left(seqs, live_from)
+        if dead == len(seqs):
+            del self._indexes[field][value]
+        elif 2 * dead >= len(seqs):
+            del seqs[:dead]
+
+    def _live(self, seqs: List[int]) -> int:
+        """Index of the first live sequence number in an index list"""
+        return bisect_left(seqs, self._oldest_seq)
+
+    def _unindex(self, field: str, value: str, seq: int):
+        seqs = self._indexes[field].get(value)
+        if not seqs:
+            return
+        i = bisect_left(seqs, seq)
+        if i < len(seqs) and seqs[i] == seq:
+            del seqs[i]
+        if not seqs:
+            del self._indexes[field][value]
+
+    def remove(self, alert_id: str) -> Optional[Alert]:
+        """Drop an alert; its ring slot stays empty until overwritten"""
+        seq = self._by_id.get(alert_id)
+        if seq is None:
+            return None
+        alert = self._ring[seq % self.capacity]
+        self._evict(seq)
+        return alert
+
+    def oldest(self) -> Optional[Alert]:
+        """The oldest retained alert (None if empty)"""
+        for seq in range(self._oldest_seq, self._next_seq):
+            alert = self._ring[seq % self.capacity]
+            if alert is not None:
+                return alert
+        return None
+
+    def get(self, alert_id: str) -> Optional[Alert]:
+        seq = self._by_id.get(alert_id)
+        return None if seq is None else self._ring[seq % self.capacity]
+
+    def set_status(self, alert: Alert, status: str):
+        """Change an alert's status and keep the status index in sync"""
+        seq = self._by_id.get(alert.alert_id)
+        if seq is not None and alert.status != status:
+            self._unindex("status", alert.status, seq)
+            insort(self._indexes["status"].setdefault(status, []), seq)
+        alert.status = status
+
+    def query(
+        self,
+        limit: Optional[int] = 50,
+        cursor: Optional[str] = None,
+        **filters: Optional[str]
+    ) -> Tuple[List[Alert], Optional[str]]:
+        """
+        Newest-first page of alerts matching every given filter
+
+        filters are INDEXED_FIELDS (None values are ignored). cursor is the
+        opaque string returned with the previous page. Returns the alerts
+        and the cursor for the next page (None when there is no more).
+        """
+        filters = {field: value for field, value in filters.items() if value is not None}
+        unknown = set(filters) - set(INDEXED_FIELDS)
+        if unknown:
+            raise ValueError(f"Cannot filter alerts by: {', '.join(sorted(unknown))}")
+
+        before = self._next_seq
+        if cursor:
+            try:
+                before = min(int(cursor), before)
+            except ValueError:
+                raise ValueError(f"Invalid cursor: {cursor}")
+
+        if filters:
+            # Walk the most selective index, check the rest on the alert itself
+            candidates = min(
+                (self._indexes[field].get(value, []) for field, value in filters.items()),
+                key=len
+            )
+            seqs = (
+                candidates[i]
+                for i in range(bisect_left(candidates, before) - 1, self._live(candidates) - 1, -1)
+            )
+        else:
+            seqs = iter(range(before - 1, self._oldest_seq - 1, -1))
+
+        page: List[Alert] = []
+        last_seq = None
+        for seq in seqs:
+            alert = self._ring[seq % self.capacity]
+            if alert is None or any(getattr(alert, f) != v for f, v in filters.items()):
+                continue
+            if limit is not None and len(page) >= limit:
+                return page, str(last_seq)
+            page.append(alert)
+            last_seq = seq
+        return page, None
+
+    def recent(self, limit: Optional[int], **filters: Optional[str]) -> List[Alert]:
+        """Newest alerts matching filters (no pagination)"""
+        return self.query(limit=limit, **filters)[0]
+
+    def count_by(self, field: str) -> Dict[str, int]:
+        """Number of retained alerts per value of an indexed field"""
+        counts = {value: len(seqs) - self._live(seqs) for value, seqs in self._indexes[field].items()}
+        return {value: count for value, count in counts.items() if count}
+
+
+alert_store = AlertStore(capacity=int(os.getenv("ALERT_STORE_CAPACITY", "10000")))
@@ -0,0 +1,181 @@
+"""
+Micro-batching aggregator
+Collects concurrent log_activity calls over a short window and sends
+them to the AI model as one batch
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from .metrics import Histogram
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5.0,
+        max_concurrent_batches: int = 4
+    ):
+        """
+        Initialize the batcher
+
+        process_batch receives a list of items and must return one result
+        per item, in the same order. Up to max_concurrent_batches batches
+        may be in flight at once so a slow batch does not stall collection.
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_concurrent_batches = max_concurrent_batches
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._inflight: Set[asyncio.Task] = set()  # Dispatched batches (referenced so they are not collected)
+
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64, 128, 256, 512])
+        self.queue_wait_ms = Histogram([0.5, 1, 2, 5, 10, 20, 50, 100, 250])
+        self.batches_processed = 0
+        self.batch_errors = 0
+
+    async def submit(self, item: Any) -> Any:
+        """Queue one item and wait for its own result"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    def _ensure_started(self):
+        if self._worker is None or self._worker.done():
+            if self._worker is not None and not self._worker.cancelled() and self._worker.exception():
+                print(f"Batcher worker died: {self._worker.exception()!r} - restarting")
+            old_queue = self._queue
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._inflight = {task for task in self._inflight if not task.done()}
+            # Callers of this loop still waiting in the old queue move to the new one
+            loop = asyncio.get_running_loop()
+            while old_queue is not None and not old_queue.empty():
+                entry = old_queue.get_nowait()
+                if entry[1].get_loop() is loop and not entry[1].done():
+                    self._queue.put_nowait(entry)
+            self._worker = asyncio.create_task(self._run())
+
+    async def start(self):
+        """Start the background batching loop"""
+        self._ensure_started()
+
+    async def stop(self):
+        """Stop the background loop, wait for dispatched batches and cancel callers still in the queue"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+            self._inflight.clear()
+
+        while self._queue is not None and not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.cancel()
+
+    async def _collect(self, batch: List[Tuple[Any, asyncio.Future, float]]):
+        """Wait for one item, then gather more into batch until the window closes"""
+        batch.append(await self._queue.get())
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+
+        while len(batch) < self.max_batch_size:
+            # Drain whatever is already queued without yielding
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if len(batch) >= self.max_batch_size:
+                break
+
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+    async def _run(self):
+        # Bound once: a restart replaces self._slots, and batches dispatched
+        # by this worker must release the semaphore they acquired
+        slots = self._slots
+        while True:
+            batch = []
+            try:
+                await self._collect(batch)
+                await slots.acquire()
+            except asyncio.CancelledError:
+                # Items already taken off the queue would otherwise wait forever
+                for _, future, _ in batch:
+                    future.cancel()
+                raise
+
+            dispatched_at = time.perf_counter()
+            self.batch_sizes.observe(len(batch))
+            for _, _, enqueued_at in batch:
+                self.queue_wait_ms.observe((dispatched_at - enqueued_at) * 1000)
+
+            task = asyncio.create_task(self._dispatch(batch, slots))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: List[Tuple[Any, asyncio.Future, float]], slots: asyncio.Semaphore):
+        """Process one batch and resolve each caller's future with its own result"""
+        items = [item for item, _, _ in batch]
+        try:
+            results = await self.process_batch(items)
+            if len(results) != len(items):
+                raise RuntimeError(
+                    f"Batch returned {len(results)} results for {len(items)} items"
+                )
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            self.batch_errors += 1
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        except asyncio.CancelledError:
+            for _, future, _ in batch:
+                future.cancel()
+            raise
+        finally:
+            self.batches_processed += 1
+            slots.release()
+
+    def get_stats(self) -> Dict:
+        """Batch-size and queue-wait histograms for tuning the window"""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "max_concurrent_batches": self.max_concurrent_batches,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "batches_in_flight": len(self._inflight),
+            "batches_processed": self.batches_processed,
+            "batch_errors": self.batch_errors,
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot()
+        }
+
+
+def create_log_batcher(process_batch: Callable[[List[Dict]], Awaitable[List[Dict]]]) -> MicroBatcher:
+    """Create the log batcher from BATCH_MAX_SIZE / BATCH_MAX_WAIT_MS / BATCH_MAX_CONCURRENT"""
+    return MicroBatcher(
+        process_batch,
+        max_batch_size=int(os.getenv("BATCH_MAX_SIZE", "64")),
+        max_wait_ms=float(os.getenv("BATCH_MAX_WAIT_MS", "5")),
+        max_concurrent_batches=int(os.getenv("BATCH_MAX_CONCURRENT", "4"))
+    )
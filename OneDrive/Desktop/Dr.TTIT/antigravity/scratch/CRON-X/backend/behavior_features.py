@@ -0,0 +1,136 @@
+"""
+Behavioral Features
+Cursor kinematics and typing rhythm computed from raw traces for a whole
+batch of logs at once:
+- cursor velocity (mean, std), acceleration, jerk and curvature
+- cursor pauses (share of steps that are pauses, mean pause length)
+- keystroke inter-arrival time (mean, std)
+
+All traces of a batch are concatenated into flat arrays with a segment id
+per point; per-log statistics are then bincount reductions over segment
+ids, so the cost is a fixed number of NumPy calls per batch rather than
+Python work per point or per event. Logs without a trace get zeros.
+"""
+
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    from .cursor_trace import CursorTrace
+except ImportError:  # Loaded as a top-level module by mcp_server.py
+    from cursor_trace import CursorTrace
+
+BEHAVIOR_FEATURE_NAMES = [
+    "cursor_velocity_mean",   # px/s
+    "cursor_velocity_std",
+    "cursor_accel_mean",      # |px/s^2|
+    "cursor_jerk_mean",       # |px/s^3|
+    "cursor_curvature_mean",  # radians turned per step
+    "cursor_pause_ratio",     # share of steps that are pauses
+    "cursor_pause_mean_ms",
+    "key_interval_mean_ms",
+    "key_interval_std_ms"
+]
+
+# A step slower than this, or with no movement, counts as a pause
+PAUSE_MS = 200
+
+
+def as_trace(value: Any) -> Optional[CursorTrace]:
+    """A CursorTrace from any accepted wire form (points, columnar, delta); None if empty"""
+    if value is None:
+        return None
+    trace = CursorTrace.validate(value)
+    return trace if len(trace) else None
+
+
+def _segments(lengths: np.ndarray) -> np.ndarray:
+    """Segment id of every element of the concatenated arrays"""
+    return np.repeat(np.arange(len(lengths)), lengths)
+
+
+def _mean(segment: np.ndarray, values: np.ndarray, n: int) -> np.ndarray:
+    counts = np.bincount(segment, minlength=n)
+    sums = np.bincount(segment, weights=values, minlength=n)
+    return np.divide(sums, counts, out=np.zeros(n), where=counts > 0)
+
+
+def _mean_std(segment: np.ndarray, values: np.ndarray, n: int):
+    mean = _mean(segment, values, n)
+    square = _mean(segment, values * values, n)
+    return mean, np.sqrt(np.maximum(square - mean * mean, 0.0))
+
+
+def cursor_features(traces: Sequence[Optional[CursorTrace]]) -> np.ndarray:
+    """(n, 7) cursor columns of BEHAVIOR_FEATURE_NAMES"""
+    n = len(traces)
+    out = np.zeros((n, 7))
+    present = [i for i, trace in enumerate(traces) if trace is not None and len(trace) > 1]
+    if not present:
+        return out
+
+    data = np.concatenate([traces[i].data for i in present], axis=1).astype(np.float64)
+    lengths = np.array([len(traces[i]) for i in present])
+    point_segment = np.asarray(present)[_segments(lengths)]
+
+    # Steps between consecutive points of the same trace
+    same = point_segment[1:] == point_segment[:-1]
+    segment = point_segment[1:][same]
+    dt = np.maximum(np.diff(data[0])[same], 1.0) / 1000.0  # seconds
+    dx = np.diff(data[1])[same]
+    dy = np.diff(data[2])[same]
+    distance = np.hypot(dx, dy)
+    velocity = distance / dt
+
+    out[:, 0], out[:, 1] = _mean_std(segment, velocity, n)
+
+    # Higher derivatives need consecutive steps of the same trace
+    chained = segment[1:] == segment[:-1]
+    step_dt = (dt[1:] + dt[:-1]) / 2
+    accel = np.diff(velocity) / step_dt
+    out[:, 2] = _mean(segment[1:][chained], np.abs(accel[chained]), n)
+
+    chained2 = chained[1:] & chained[:-1]
+    jerk = np.diff(accel) / step_dt[1:]
+    out[:, 3] = _mean(segment[2:][chained2], np.abs(jerk[chained2]), n)
+
+    # Turning angle between consecutive moving steps, wrapped to [0, pi]
+    heading = np.arctan2(dy, dx)
+    moving = chained & (distance[1:] > 0) & (distance[:-1] > 0)
+    turn = np.abs((np.diff(heading) + np.pi) % (2 * np.pi) - np.pi)
+    out[:, 4] = _mean(segment[1:][moving], turn[moving], n)
+
+    pause = (dt * 1000 >= PAUSE_MS) | (distance == 0)
+    out[:, 5] = _mean(segment, pause.astype(np.float64), n)
+    out[:, 6] = _mean(segment[pause], dt[pause] * 1000, n)
+    return out
+
+
+def keystroke_features(key_times: Sequence[Optional[Sequence[float]]]) -> np.ndarray:
+    """(n, 2) key interval columns of BEHAVIOR_FEATURE_NAMES from keystroke times in ms"""
+    n = len(key_times)
+    out = np.zeros((n, 2))
+    present = [i for i, times in enumerate(key_times) if times is not None and len(times) > 1]
+    if not present:
+        return out
+
+    times = np.concatenate([np.asarray(key_times[i], dtype=np.float64) for i in present])
+    lengths = np.array([len(key_times[i]) for i in present])
+    point_segment = np.asarray(present)[_segments(lengths)]
+    same = point_segment[1:] == point_segment[:-1]
+    out[:, 0], out[:, 1] = _mean_std(point_segment[1:][same], np.diff(times)[same], n)
+    return out
+
+
+def has_raw_streams(logs: List[dict]) -> bool:
+    """Whether any log carries a cursor trace or keystroke times (all zeros otherwise)"""
+    return any(log.get('cursor_trace') is not None or log.get('keystroke_times') for log in logs)
+
+
+def behavior_feature_matrix(logs: List[dict]) -> np.ndarray:
+    """(n_logs, len(BEHAVIOR_FEATURE_NAMES)) from normalized logs' cursor_trace / keystroke_times"""
+    return np.hstack([
+        cursor_features([log.get('cursor_trace') for log in logs]),
+        keystroke_features([log.get('keystroke_times') for log in logs])
+    ])
@@ -0,0 +1,330 @@
+"""
+WebSocket Broadcaster
+Fans dashboard messages out to every connected client without letting one
+slow browser hold up the rest:
+- each message is serialised to JSON once, not once per client
+- every client has a bounded send queue drained by its own writer task
+- a client whose queue is full is handled by the slow-consumer policy:
+    drop_oldest  discard its oldest queued message (default)
+    drop_newest  discard the new message
+    disconnect   close the connection
+- clients may subscribe to a subset of alerts and to a compact projection:
+    {"type": "subscribe", "filters": {"severity": ["high"]}, "projection": "summary"}
+  without a subscription they receive every message in full
+
+Alert messages are also published on the alert bus so that dashboards
+connected to other worker processes receive them (see pubsub.py).
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+from .metrics import Histogram
+from .models import Alert
+from .pubsub import alert_bus
+
+SLOW_CLIENT_POLICIES = ("drop_oldest", "drop_newest", "disconnect")
+SUBSCRIPTION_FIELDS = ("severity", "status", "user_id", "ip")
+PROJECTIONS = ("full", "summary")
+
+
+class ClientConnection:
+    """One dashboard socket, its send queue and delivery statistics"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.id = next(self._ids)
+        self.websocket = websocket
+        self.queue: "asyncio.Queue[Tuple[str, float]]" = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.connected_at = time.time()
+        self.sent = 0
+        self.dropped = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.filters: Dict[str, Set[str]] = {}
+        self.projection = "full"
+
+    def wants(self, attributes: Optional[Dict[str, Any]]) -> bool:
+        """Whether a message with these attributes passes the client's filters"""
+        if not attributes:
+            return True
+        for field, allowed in self.filters.items():
+            value = attributes.get(field)
+            if value is None:
+                continue
+            values = value if isinstance(value, (set, frozenset, list, tuple)) else (value,)
+            if allowed.isdisjoint(values):
+                return False
+        return True
+
+    def get_stats(self) -> Dict:
+        return {
+            "id": self.id,
+            "client": f"{self.websocket.client.host}:{self.websocket.client.port}" if self.websocket.client else None,
+            "connected_seconds": round(time.time() - self.connected_at, 1),
+            "queue_depth": self.queue.qsize(),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "last_lag_ms": round(self.last_lag_ms, 3),
+            "max_lag_ms": round(self.max_lag_ms, 3),
+            "projection": self.projection,
+            "filters": {field: sorted(values) for field, values in self.filters.items()}
+        }
+
+
+class Broadcaster:
+    def __init__(self, queue_size: int = 256, slow_client_policy: str = "drop_oldest", send_timeout: float = 10.0):
+        """
+        Initialize the broadcaster
+
+        Each client may have up to queue_size messages waiting. A single
+        send taking longer than send_timeout seconds disconnects the client.
+        """
+        if slow_client_policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError(
+                f"Unknown slow client policy: {slow_client_policy} "
+                f"(expected one of {', '.join(SLOW_CLIENT_POLICIES)})"
+            )
+        self.queue_size = queue_size
+        self.slow_client_policy = slow_client_policy
+        self.send_timeout = send_timeout
+
+        self.clients: Dict[int, ClientConnection] = {}
+        self.messages = 0
+        self.disconnected_slow = 0
+        # Time from broadcast() to the frame being handed to the socket
+        self.lag_ms = Histogram([1, 5, 10, 50, 100, 250, 500, 1000, 5000])
+
+    async def connect(self, websocket: WebSocket) -> ClientConnection:
+        """Accept a socket and start its writer task"""
+        await websocket.accept()
+        client = ClientConnection(websocket, self.queue_size)
+        client.writer = asyncio.create_task(self._write(client))
+        self.clients[client.id] = client
+        return client
+
+    async def disconnect(self, client: ClientConnection, close: bool = False):
+        """Forget a client and stop its writer (optionally closing the socket)"""
+        if self.clients.pop(client.id, None) is None:
+            return
+        if client.writer is not None and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+        if close:
+            # In the background - a stuck socket must not stall the caller
+            asyncio.create_task(self._close(client.websocket))
+
+    @staticmethod
+    async def _close(websocket: WebSocket):
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+    async def _write(self, client: ClientConnection):
+        """Drain one client's queue; a failed or stuck send disconnects it"""
+        try:
+            while True:
+                payload, enqueued_at = await client.queue.get()
+                await asyncio.wait_for(client.websocket.send_text(payload), self.send_timeout)
+                lag = (time.perf_counter() - enqueued_at) * 1000
+                client.sent += 1
+                client.last_lag_ms = lag
+                client.max_lag_ms = max(client.max_lag_ms, lag)
+                self.lag_ms.observe(lag)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await self.disconnect(client, close=True)
+
+    def subscribe(self, client: ClientConnection, filters: Dict[str, Any], projection: str = "full"):
+        """
+        Replace a client's subscription
+
+        filters maps SUBSCRIPTION_FIELDS to a value or list of values;
+        an empty dict subscribes to everything.
+        """
+        unknown = set(filters) - set(SUBSCRIPTION_FIELDS)
+        if unknown:
+            raise ValueError(f"Cannot filter on: {', '.join(sorted(unknown))}")
+        if projection not in PROJECTIONS:
+            raise ValueError(f"Unknown projection: {projection} (expected one of {', '.join(PROJECTIONS)})")
+        client.filters = {
+            field: {str(v) for v in (value if isinstance(value, list) else [value])}
+            for field, value in filters.items() if value is not None
+        }
+        client.projection = projection
+
+    @staticmethod
+    def _encode(message: Dict) -> str:
+        # Same encoding as WebSocket.send_json
+        return json.dumps(message, separators=(",", ":"), ensure_ascii=False, default=str)
+
+    async def send(self, client: ClientConnection, message: Dict):
+        """Queue a message for one client"""
+        await self._enqueue(client, (self._encode(message), time.perf_counter()))
+
+    async def broadcast(
+        self,
+        message: Dict,
+        attributes: Optional[Dict[str, Any]] = None,
+        summary: Optional[Dict] = None
+    ):
+        """
+        Queue a message for every subscribed client; never waits on a socket
+
+        attributes (e.g. the alert's severity and status) are matched
+        against client filters. Clients with the summary projection get
+        summary instead of message when it is given. Each variant is
+        serialised at most once, and only if some client wants it.
+        """
+        enqueued_at = time.perf_counter()
+        payloads: Dict[str, str] = {}
+        self.messages += 1
+        for client in list(self.clients.values()):
+            if not client.wants(attributes):
+                continue
+            variant = "summary" if client.projection == "summary" and summary is not None else "full"
+            payload = payloads.get(variant)
+            if payload is None:
+                payload = payloads[variant] = self._encode(summary if variant == "summary" else message)
+            await self._enqueue(client, (payload, enqueued_at))
+
+    async def _enqueue(self, client: ClientConnection, item: Tuple[str, float]):
+        try:
+            client.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            await self._handle_slow_client(client, item)
+
+    async def _handle_slow_client(self, client: ClientConnection, item: Tuple[str, float]):
+        if self.slow_client_policy == "disconnect":
+            self.disconnected_slow += 1
+            await self.disconnect(client, close=True)
+            return
+        client.dropped += 1
+        if self.slow_client_policy == "drop_oldest":
+            client.queue.get_nowait()
+            client.queue.put_nowait(item)
+
+    async def close_all(self):
+        """Disconnect every client (called on app shutdown)"""
+        for client in list(self.clients.values()):
+            await self.disconnect(client, close=True)
+
+    def get_stats(self) -> Dict:
+        clients: List[Dict] = [client.get_stats() for client in self.clients.values()]
+        return {
+            "connections": len(clients),
+            "queue_size": self.queue_size,
+            "slow_client_policy": self.slow_client_policy,
+            "messages": self.messages,
+            "disconnected_slow": self.disconnected_slow,
+            "dropped": sum(client["dropped"] for client in clients),
+            "lag_ms": self.lag_ms.snapshot(),
+            "clients": clients
+        }
+
+
+def create_broadcaster() -> Broadcaster:
+    """Create the broadcaster from WS_QUEUE_SIZE / WS_SLOW_CLIENT_POLICY / WS_SEND_TIMEOUT"""
+    return Broadcaster(
+        queue_size=int(os.getenv("WS_QUEUE_SIZE", "256")),
+        slow_client_policy=os.getenv("WS_SLOW_CLIENT_POLICY", "drop_oldest").lower(),
+        send_timeout=float(os.getenv("WS_SEND_TIMEOUT", "10"))
+    )
+
+
+broadcaster = create_broadcaster()
+
+
+# ===== ALERT MESSAGES =====
+
+def alert_summary(alert: Alert) -> Dict:
+    """Compact alert projection: no events or cursor traces (fetch /api/alerts/{id} for those)"""
+    return {
+        "alert_id": alert.alert_id,
+        "created_ts": alert.created_ts,
+        "status": alert.status,
+        "severity": alert.severity,
+        "anomaly_score": alert.anomaly_score,
+        "suggested_action": alert.suggested_action,
+        "user_id": alert.user_id,
+        "session_id": alert.session_id,
+        "ip": alert.ip,
+        "short_text": alert.short_text,
+        "event_count": len(alert.events)
+    }
+
+def _alert_attributes(alert: Alert, *statuses: str) -> Dict[str, Any]:
+    return {
+        "severity": alert.severity,
+        "status": {alert.status, *statuses},
+        "user_id": alert.user_id,
+        "ip": alert.ip
+    }
+
+async def broadcast_alert_new(alert: Alert):
+    """Send a new alert to dashboards connected to this worker"""
+    await broadcaster.broadcast(
+        {"type": "alert_new", "alert": alert.dict()},
+        attributes=_alert_attributes(alert),
+        summary={"type": "alert_new", "alert": alert_summary(alert)}
+    )
+
+def alert_update_changes(alert: Alert, notes_from: int, audit_from: int) -> Dict[str, Any]:
+    """
+    The "changes" of an alert_update: its status plus only the notes and
+    audit entries appended since the lists had notes_from / audit_from items
+
+    Each list is sent as {"from": index, "entries": [...]}; receivers replace
+    everything from that index on, so a repeated update is harmless.
+    """
+    return {
+        "status": alert.status,
+        "notes": {"from": notes_from, "entries": [note.dict() for note in alert.notes[notes_from:]]},
+        "audit": {"from": audit_from, "entries": [entry.dict() for entry in alert.audit[audit_from:]]}
+    }
+
+async def broadcast_alert_update(alert: Alert, previous_status: str, changes: Dict[str, Any]):
+    """
+    Send an alert_update_changes() delta to this worker's dashboards
+
+    Clients merge "changes" into the alert they already hold. Clients
+    filtering on the previous status also get it, so they can drop the alert.
+    """
+    await broadcaster.broadcast(
+        {"type": "alert_update", "alert_id": alert.alert_id, "changes": changes},
+        attributes=_alert_attributes(alert, previous_status)
+    )
+
+async def publish_alert_new(alert: Alert):
+    """Send a new alert to subscribed dashboards on every worker"""
+    await broadcast_alert_new(alert)
+    await alert_bus.publish("alerts", {
+        "type": "alert_new",
+        "alert": alert.model_dump(context={"trace_format": "delta"})
+    })
+
+async def publish_alert_update(alert: Alert, previous_status: str, notes_from: int, audit_from: int):
+    """
+    Send an alert update to subscribed dashboards on every worker
+
+    notes_from / audit_from are the list lengths before this update; only
+    the entries appended after them are sent.
+    """
+    changes = alert_update_changes(alert, notes_from, audit_from)
+    await broadcast_alert_update(alert, previous_status, changes)
+    await alert_bus.publish("alerts", {
+        "type": "alert_update",
+        "previous_status": previous_status,
+        # Other workers only need the alert's identity and the delta, not its events or history
+        "alert": alert.dict(exclude={"events", "notes", "audit"}),
+        "changes": changes
+    })
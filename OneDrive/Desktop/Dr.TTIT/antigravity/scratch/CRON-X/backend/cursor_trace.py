@@ -0,0 +1,216 @@
+"""
+Cursor Trace
+Compact columnar storage for cursor traces: one read-only (3, n) int32
+array (t, x, y) instead of one pydantic object per point.
+
+A trace is accepted in any of these forms and is serialised as a list of
+{"t", "x", "y"} points unless a trace format is asked for:
+- points:   [{"t": 0, "x": 10, "y": 20}, ...]   (default, what the dashboard reads)
+- columnar: {"t": [...], "x": [...], "y": [...]}
+- delta:    base64 of the delta-encoded binary format below
+
+Binary format (little endian):
+    b"CT" version:u8 count:u32 width:u8 first:i32[3]
+    deltas:int<width*8>[3][count - 1]   (all t deltas, then x, then y)
+Consecutive points move a few pixels and milliseconds apart, so deltas
+usually fit in one byte: about 3 bytes per point.
+
+Traces are read-only once built, so each serialised form is computed at
+most once per trace however many dashboards or requests read it.
+"""
+
+import base64
+import struct
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+
+TRACE_FORMATS = ("points", "columnar", "delta")
+
+_MAGIC = b"CT"
+_VERSION = 1
+_HEADER = struct.Struct("<2sBIB3i")
+_WIDTHS = {1: np.int8, 2: np.int16, 4: np.int32}
+
+
+class CursorTrace:
+    """Columns t / x / y of one read-only (3, n) int32 array (t in ms from the start of the event)"""
+
+    __slots__ = ("data", "_cache")
+
+    def __init__(self, t: Iterable[int] = (), x: Iterable[int] = (), y: Iterable[int] = ()):
+        try:
+            data = np.array((t, x, y), dtype=np.int32)
+        except (TypeError, OverflowError) as e:
+            # Surfaced as a validation error rather than a server error
+            raise ValueError(f"Cursor trace columns need int32 values: {e!r}") from e
+        self._set(data)
+
+    def _set(self, data: np.ndarray):
+        if data.ndim != 2 or data.shape[0] != 3:
+            raise ValueError("Cursor trace columns must be one-dimensional and the same length")
+        data.flags.writeable = False
+        self.data = data
+        self._cache: Dict[str, Any] = {}
+
+    @classmethod
+    def _wrap(cls, data: np.ndarray) -> "CursorTrace":
+        trace = cls.__new__(cls)
+        trace._set(data)
+        return trace
+
+    @property
+    def t(self) -> np.ndarray:
+        return self.data[0]
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.data[1]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.data[2]
+
+    def __len__(self) -> int:
+        return self.data.shape[1]
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, CursorTrace):
+            return NotImplemented
+        return np.array_equal(self.data, other.data)
+
+    def __repr__(self) -> str:
+        return f"CursorTrace({len(self)} points)"
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes
+
+    # ===== CONVERSION =====
+
+    @classmethod
+    def from_points(cls, points: Iterable[Any]) -> "CursorTrace":
+        """Build from dicts or objects with t, x and y"""
+        points = list(points)
+        if not points:
+            return cls()
+        try:
+            if isinstance(points[0], dict):
+                rows = [(p["t"], p["x"], p["y"]) for p in points]
+            else:
+                rows = [(p.t, p.x, p.y) for p in points]
+            data = np.array(rows, dtype=np.int32)
+        except (KeyError, TypeError, AttributeError, OverflowError) as e:
+            # Surfaced as a validation error rather than a server error
+            raise ValueError(f"Cursor trace points need integer t, x and y: {e!r}") from e
+        return cls._wrap(data.T.copy())
+
+    def to_points(self) -> List[Dict[str, int]]:
+        t, x, y = self.data.tolist()
+        return [{"t": t, "x": x, "y": y} for t, x, y in zip(t, x, y)]
+
+    def to_columns(self) -> Dict[str, List[int]]:
+        t, x, y = self.data.tolist()
+        return {"t": t, "x": x, "y": y}
+
+    def to_bytes(self) -> bytes:
+        """Delta-encode all columns with the narrowest integer width that fits"""
+        count = len(self)
+        deltas = np.diff(self.data, axis=1)
+        width = 1
+        if deltas.size:
+            lo, hi = int(deltas.min()), int(deltas.max())
+            if lo < -32768 or hi > 32767:
+                width = 4
+            elif lo < -128 or hi > 127:
+                width = 2
+        firsts = self.data[:, 0].tolist() if count else [0, 0, 0]
+        header = _HEADER.pack(_MAGIC, _VERSION, count, width, *firsts)
+        return header + deltas.astype(f"<i{width}").tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CursorTrace":
+        try:
+            return cls._decode(data)
+        except (TypeError, OverflowError, struct.error) as e:
+            raise ValueError(f"Invalid cursor trace bytes: {e!r}") from e
+
+    @classmethod
+    def _decode(cls, data: bytes) -> "CursorTrace":
+        if len(data) < _HEADER.size:
+            raise ValueError("Cursor trace is truncated")
+        magic, version, count, width, *firsts = _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("Not a cursor trace (bad magic or version)")
+        if width not in _WIDTHS:
+            raise ValueError(f"Invalid delta width in cursor trace: {width}")
+        if count == 0:
+            return cls()
+        n = count - 1
+        deltas = np.frombuffer(data, dtype=f"<i{width}", count=3 * n, offset=_HEADER.size).reshape(3, n)
+        columns = np.empty((3, count), dtype=np.int32)
+        columns[:, 0] = firsts
+        np.cumsum(deltas, axis=1, dtype=np.int32, out=columns[:, 1:])
+        columns[:, 1:] += columns[:, :1]
+        return cls._wrap(columns)
+
+    def to_base64(self) -> str:
+        return base64.b64encode(self.to_bytes()).decode("ascii")
+
+    @classmethod
+    def from_base64(cls, text: str) -> "CursorTrace":
+        return cls.from_bytes(base64.b64decode(text))
+
+    def serialize(self, trace_format: str = "points") -> Any:
+        """The trace in one of TRACE_FORMATS (cached; do not modify the result)"""
+        value = self._cache.get(trace_format)
+        if value is None:
+            if trace_format == "columnar":
+                value = self.to_columns()
+            elif trace_format == "delta":
+                value = self.to_base64()
+            else:
+                value = self.to_points()
+            self._cache[trace_format] = value
+        return value
+
+    # ===== PYDANTIC =====
+
+    @classmethod
+    def validate(cls, value: Any) -> "CursorTrace":
+        """Accept a trace, a list of points, a columnar dict or a delta string"""
+        if isinstance(value, CursorTrace):
+            return value
+        if isinstance(value, str):
+            return cls.from_base64(value)
+        if isinstance(value, (bytes, bytearray)):
+            return cls.from_bytes(bytes(value))
+        if isinstance(value, dict):
+            return cls(value.get("t", ()), value.get("x", ()), value.get("y", ()))
+        if isinstance(value, (list, tuple)):
+            return cls.from_points(value)
+        raise ValueError(f"Cannot read a cursor trace from {type(value).__name__}")
+
+    @staticmethod
+    def _serialize(value: "CursorTrace", info) -> Any:
+        # model_dump(context={"trace_format": "delta"}) picks the compact forms
+        context = info.context or {}
+        return value.serialize(context.get("trace_format", "points"))
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source, handler):
+        from pydantic_core import core_schema
+
+        return core_schema.no_info_plain_validator_function(
+            cls.validate,
+            serialization=core_schema.plain_serializer_function_ser_schema(cls._serialize, info_arg=True)
+        )
+
+    @classmethod
+    def __get_pydantic_json_schema__(cls, schema, handler):
+        point = {
+            "type": "object",
+            "properties": {"t": {"type": "integer"}, "x": {"type": "integer"}, "y": {"type": "integer"}},
+            "required": ["t", "x", "y"]
+        }
+        return {"type": "array", "items": point}
@@ -4,41 +4,136 @@ Receives AI predictions from MCP and triggers appropriate actions
 """
 
 import asyncio
-from typing import Dict, List, Set
-from datetime import datetime, timedelta
-import httpx
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
+
+from .expiry_scheduler import ExpiryScheduler
+from .firewall_sync import create_firewall_sync
+from .ip_enrichment import ip_enricher
+from .persistence import AlertRepository, alert_repository
+from .prefix_set import PrefixSet, canonical_network
+from .stream_sketches import create_top_talkers
+from .inference_transport import (
+    InferenceTransport, TransportBusyError, TransportError, create_transport
+)
 
 class DecisionEngine:
-    def __init__(self, mcp_url: str = "http://localhost:8001"):
-        """Initialize Decision Engine"""
+    def __init__(
+        self,
+        mcp_url: str = "http://localhost:8001",
+        transport: Optional[InferenceTransport] = None,
+        repository: AlertRepository = alert_repository
+    ):
+        """Initialize Decision Engine (blocks and their deadlines are kept in repository)"""
         self.mcp_url = mcp_url
-        self.blocked_ips: Set[str] = set()
-        self.block_duration = {}  # IP -> unblock_time
+        self.repository = repository
+        # Blocked hosts and prefixes; enough blocked hosts in one /24 (IPv4)
+        # or /64 (IPv6) are merged into a block of that prefix
+        self.blocklist = PrefixSet(aggregate={
+            4: (int(os.getenv("BLOCK_AGGREGATE_V4_PREFIX", "24")), int(os.getenv("BLOCK_AGGREGATE_V4_HOSTS", "16"))),
+            6: (int(os.getenv("BLOCK_AGGREGATE_V6_PREFIX", "64")), int(os.getenv("BLOCK_AGGREGATE_V6_HOSTS", "4")))
+        })
+        # Blocklist entry -> unblock deadline, all expired by one background sweeper
+        self.block_expiry = ExpiryScheduler(
+            batch_size=int(os.getenv("BLOCK_EXPIRY_BATCH_SIZE", "1000")),
+            resolution=float(os.getenv("BLOCK_EXPIRY_RESOLUTION", "1.0"))
+        )
+        # Velocity rules over the gateway's window counters and distinct-user
+        # sketches: any counter at or above its limit blocks the IP whatever
+        # the model says (0 = off)
+        self.velocity_limits = {
+            "ip_failed_5m": (int(os.getenv("VELOCITY_BLOCK_IP_FAILED_5M", "20")), "{} failed logins from this IP in 5 minutes"),
+            "ip_users_5m": (int(os.getenv("VELOCITY_BLOCK_IP_USERS_5M", "10")), "{} different users from this IP in 5 minutes"),
+            "ip_events_1m": (int(os.getenv("VELOCITY_BLOCK_IP_EVENTS_1M", "600")), "{} events from this IP in 1 minute"),
+            "ip_distinct_users": (int(os.getenv("TALKER_BLOCK_IP_DISTINCT_USERS", "50")), "{} distinct users tried from this IP")
+        }
+        # Top IPs / ASNs / offenders and distinct users per IP (approximate,
+        # fixed memory), fed by the gateway and by execute_action
+        self.top_talkers = create_top_talkers(asn_of=ip_enricher.asn_label)
+        
+        # Blocklist changes reach the firewall (FIREWALL_BACKEND) in batches
+        self.firewall = create_firewall_sync()
         self.alert_callbacks = []
         
+        # How predictions are obtained: "http" (MCP server) or "inprocess"
+        self.transport = transport or create_transport(
+            os.getenv("MCP_TRANSPORT", "http").lower(), mcp_url
+        )
+    
+    async def start(self):
+        """
+        Open the inference transport, restore stored blocks, start block
+        expiry and resync the firewall (called on app startup, after the
+        repository is started)
+        """
+        await self.transport.start()
+        await self._restore_blocks()
+        self.block_expiry.start(self._expire_blocks)
+        await self.firewall.start(entry for entry, _ in self.block_expiry.items())
+    
+    async def _restore_blocks(self):
+        """Reload the blocks of previous runs that have not expired yet"""
+        stored = await asyncio.get_running_loop().run_in_executor(None, self.repository.load_blocks)
+        now = time.time()
+        restored = 0
+        for entry, deadline in stored:
+            if deadline <= now:
+                self.repository.delete_block(entry)
+                continue
+            try:
+                self._block(canonical_network(entry), deadline)
+                restored += 1
+            except ValueError:
+                self.repository.delete_block(entry)
+        if stored:
+            print(f"🚫 Restored {restored} active blocks")
+    
+    async def close(self):
+        """Close the inference transport, stop block expiry and flush the firewall (called on app shutdown)"""
+        await self.block_expiry.stop()
+        await self.firewall.stop()
+        await self.transport.close()
+    
     async def analyze_log(self, log_data: Dict) -> Dict:
         """
         Send log to MCP AI model for analysis
         Returns prediction and recommended action
         """
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.mcp_url}/mcp/infer",
-                    json=log_data,
-                    timeout=5.0
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    print(f"MCP Error: {response.status_code}")
-                    return self._fallback_analysis(log_data)
-                    
+            return await self.transport.infer(log_data)
+        except TransportError as e:
+            print(e)
+            return self._fallback_analysis(log_data)
         except Exception as e:
             print(f"MCP Connection Error: {e}")
             return self._fallback_analysis(log_data)
     
+    async def analyze_batch(self, logs: List[Dict]) -> List[Dict]:
+        """
+        Send a batch of logs to MCP in one request
+        Returns one prediction per log, in input order
+        """
+        if not logs:
+            return []
+        
+        try:
+            return await self.transport.infer_batch(logs)
+        except TransportBusyError as e:
+            # Model server is shedding load - don't retry each log individually
+            print(e)
+            return [self._fallback_analysis(log) for log in logs]
+        except TransportError as e:
+            print(e)
+            if len(logs) > 1:
+                # Score individually so one bad log cannot fail the batch
+                return list(await asyncio.gather(*[self.analyze_log(log) for log in logs]))
+            return [self._fallback_analysis(log) for log in logs]
+        except Exception as e:
+            print(f"MCP Connection Error: {e}")
+            return [self._fallback_analysis(log) for log in logs]
+    
     def _fallback_analysis(self, log_data: Dict) -> Dict:
         """Fallback rule-based analysis if MCP unavailable"""
         hour = datetime.fromtimestamp(log_data.get('timestamp', 0)).hour
@@ -58,7 +153,8 @@ class DecisionEngine:
             "confidence": confidence,
             "reason": reason,
             "severity": "high" if confidence > 0.6 else "low",
-            "recommended_action": "block_ip" if is_suspicious else "none"
+            "recommended_action": "block_ip" if is_suspicious else "none",
+            "model_version": 0
         }
     
     async def execute_action(self, prediction: Dict, log_data: Dict) -> Dict:
@@ -69,22 +165,39 @@ class DecisionEngine:
         - block_ip: Block the suspicious IP address
         - alert: Create alert but don't block
         - monitor: Just log for monitoring
+        
+        Velocity rules (log_data["velocity"] and log_data["talkers"], see
+        velocity_limits) can escalate any prediction to block_ip. Alerts
+        and blocks are counted per IP in top_talkers.
         """
         action = prediction.get("recommended_action", "none")
+        reason = prediction.get("reason")
         ip = log_data.get("ip")
         alert_data = None
         
+        velocity_reasons = self._velocity_reasons({**(log_data.get("velocity") or {}), **(log_data.get("talkers") or {})})
+        if velocity_reasons:
+            action = "block_ip"
+            reasons = reason.split("; ") if prediction.get("is_anomaly") and reason else []
+            reason = "; ".join(reasons + [text for text in velocity_reasons if text not in reasons])
+        
         if action == "block_ip" and ip:
             # Block the IP
-            await self.block_ip(ip, duration_minutes=30)
+            try:
+                entry = await self.block_ip(ip, duration_minutes=30)
+                action_taken = f"IP {ip} blocked for 30 minutes"
+                if entry != ip:
+                    action_taken += f" (as part of {entry})"
+            except ValueError:
+                action_taken = f"IP {ip} not blocked - invalid address"
             
             # Create high-severity alert
             alert_data = {
                 "severity": "high",
                 "user_id": log_data.get("user_id"),
                 "ip": ip,
-                "reason": prediction.get("reason"),
-                "action_taken": f"IP {ip} blocked for 30 minutes",
+                "reason": reason,
+                "action_taken": action_taken,
                 "confidence": prediction.get("confidence"),
                 "timestamp": log_data.get("timestamp")
             }
@@ -95,14 +208,15 @@ class DecisionEngine:
                 "severity": prediction.get("severity", "medium"),
                 "user_id": log_data.get("user_id"),
                 "ip": ip,
-                "reason": prediction.get("reason"),
+                "reason": reason,
                 "action_taken": "Alert created - manual review required",
                 "confidence": prediction.get("confidence"),
                 "timestamp": log_data.get("timestamp")
             }
         
-        # Trigger alert callbacks (send to dashboard)
+        # Count the offender and trigger alert callbacks (send to dashboard)
         if alert_data:
+            self.top_talkers.record_action(ip, action)
             for callback in self.alert_callbacks:
                 try:
                     await callback(alert_data)
@@ -111,37 +225,87 @@ class DecisionEngine:
         
         return {
             "action_executed": action,
-            "ip_blocked": ip in self.blocked_ips if ip else False,
+            "ip_blocked": self.is_ip_blocked(ip) if ip else False,
             "alert_created": alert_data is not None,
             "alert_data": alert_data
         }
     
-    async def block_ip(self, ip: str, duration_minutes: int = 30):
+    def _velocity_reasons(self, velocity: Optional[Dict]) -> List[str]:
+        """Why the window counters and distinct-user counts alone warrant a block (empty if they don't)"""
+        if not velocity:
+            return []
+        return [
+            text.format(velocity[name])
+            for name, (limit, text) in self.velocity_limits.items()
+            if limit > 0 and (velocity.get(name) or 0) >= limit
+        ]
+    
+    async def block_ip(self, ip: str, duration_minutes: int = 30) -> str:
         """
-        Block an IP address for specified duration
-        In production, this would integrate with firewall/iptables
+        Block an IP address or CIDR prefix for specified duration
+        The firewall backend picks the change up with its next batch
+        
+        Returns the blocklist entry that now covers it: the IP itself, a
+        prefix that already covered it, or the prefix it was aggregated
+        into. Raises ValueError for an invalid IP / CIDR.
         """
-        self.blocked_ips.add(ip)
-        unblock_time = datetime.now() + timedelta(minutes=duration_minutes)
-        self.block_duration[ip] = unblock_time
+        network = canonical_network(ip)
+        already_blocked = self.blocked_by(network)
+        entry, absorbed, deadline = self._block(network, time.time() + duration_minutes * 60)
         
-        print(f"🚫 BLOCKED IP: {ip} until {unblock_time.strftime('%H:%M:%S')}")
+        if absorbed:
+            print(f"🚫 BLOCKED PREFIX: {entry} ({len(absorbed)} blocks merged into it) until {datetime.fromtimestamp(deadline).strftime('%H:%M:%S')}")
+        elif already_blocked != entry:
+            print(f"🚫 BLOCKED IP: {entry} until {datetime.fromtimestamp(deadline).strftime('%H:%M:%S')}")
+        return entry
+    
+    def _block(self, network: str, deadline: float) -> Tuple[str, List[str], float]:
+        """Add a canonical entry until deadline; returns (covering entry, entries merged into it, its deadline)"""
+        entry, absorbed = self.blocklist.add(network)
+        # A prefix stays blocked as long as the longest block merged into it
+        for key in absorbed:
+            deadline = max(deadline, self.block_expiry.deadline(key) or 0)
+            self.block_expiry.cancel(key)
+            self.firewall.remove(key)
+            self.repository.delete_block(key)
         
-        # Schedule automatic unblock
-        asyncio.create_task(self._auto_unblock(ip, duration_minutes * 60))
-    
-    async def _auto_unblock(self, ip: str, seconds: int):
-        """Automatically unblock IP after duration"""
-        await asyncio.sleep(seconds)
-        if ip in self.blocked_ips:
-            self.blocked_ips.remove(ip)
-            if ip in self.block_duration:
-                del self.block_duration[ip]
-            print(f"✅ UNBLOCKED IP: {ip}")
+        # Re-blocking extends the existing block, never shortens it
+        deadline = self.block_expiry.schedule(entry, deadline)
+        self.firewall.add(entry)
+        self.repository.save_block(entry, deadline)
+        return entry, absorbed, deadline
+    
+    def unblock_ip(self, ip: str) -> bool:
+        """Lift a block (an IP or prefix exactly as listed) before it expires; False if not blocked"""
+        try:
+            entry = canonical_network(ip)
+        except ValueError:
+            return False
+        if not self.block_expiry.cancel(entry):
+            return False
+        self.blocklist.remove(entry)
+        self.firewall.remove(entry)
+        self.repository.delete_block(entry)
+        return True
+    
+    async def _expire_blocks(self, entries: List[str]):
+        """Called by the expiry sweeper with a batch of blocks that ran out"""
+        for entry in entries:
+            self.blocklist.remove(entry)
+            self.firewall.remove(entry)
+            self.repository.delete_block(entry)
+        if len(entries) == 1:
+            print(f"✅ UNBLOCKED IP: {entries[0]}")
+        else:
+            print(f"✅ UNBLOCKED {len(entries)} IPs")
+    
+    def blocked_by(self, ip: Optional[str]) -> Optional[str]:
+        """The blocklist entry (IP or prefix) covering an IP, or None - the pre-inference fast path"""
+        return self.blocklist.covering(ip) if isinstance(ip, str) else None
     
     def is_ip_blocked(self, ip: str) -> bool:
-        """Check if an IP is currently blocked"""
-        return ip in self.blocked_ips
+        """Check if an IP is currently blocked (directly or by a blocked prefix)"""
+        return self.blocked_by(ip) is not None
     
     def register_alert_callback(self, callback):
         """Register a callback function to be called when alerts are created"""
@@ -149,15 +313,15 @@ class DecisionEngine:
     
     async def get_blocked_ips(self) -> List[Dict]:
         """Get list of currently blocked IPs"""
-        blocked_list = []
-        for ip in self.blocked_ips:
-            unblock_time = self.block_duration.get(ip)
-            blocked_list.append({
+        now = time.time()
+        return [
+            {
                 "ip": ip,
-                "unblock_time": unblock_time.isoformat() if unblock_time else None,
-                "remaining_minutes": int((unblock_time - datetime.now()).total_seconds() / 60) if unblock_time else 0
-            })
-        return blocked_list
+                "unblock_time": datetime.fromtimestamp(deadline).isoformat(),
+                "remaining_minutes": max(int((deadline - now) / 60), 0)
+            }
+            for ip, deadline in self.block_expiry.items()
+        ]
 
 # Global instance
 decision_engine = DecisionEngine()
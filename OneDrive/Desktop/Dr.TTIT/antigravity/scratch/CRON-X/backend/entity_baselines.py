@@ -0,0 +1,307 @@
+"""
+Entity Baselines
+Per-user (and optionally per-cohort / per-ASN) behaviour baselines that sit
+in front of the global anomaly model:
+- each entity keeps a running mean/variance of its own feature vectors
+- once an entity has enough history its own baseline is consulted too:
+  a feature far from the entity's usual values is an anomaly even when the
+  global model finds it normal. With clear_global a warm baseline can also
+  clear a global anomaly, so a user who always works at 2 AM is compared
+  with themselves, not with everyone; by default it cannot.
+- cold entities fall back to the global model's prediction
+
+Deviations are measured in units of the entity's own standard deviation,
+floored at std_floor times the global scaler's deviation of that feature,
+so near-constant features (hour, binary network flags) can still deviate
+without a single off-value looking infinitely unusual.
+
+Baselines live in fixed-size numpy slabs with an LRU index, so memory stays
+flat however many users exist. Evicted baselines are written to SQLite and
+loaded back lazily the next time the entity is seen.
+
+Several processes (MCP workers, API workers with the in-process transport)
+may share one SQLite file, each seeing part of an entity's traffic. A
+process therefore never overwrites a stored baseline: it keeps what it
+learned since its last sync separately and merges that into the stored
+count / mean / M2 (Chan's parallel variance formula) in one transaction,
+then continues from the merged result. sync() does this for every changed
+baseline and is meant to run periodically, so each process also picks up
+what the others learned.
+"""
+
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def combine(
+    count_a: float, mean_a: np.ndarray, m2_a: np.ndarray,
+    count_b: float, mean_b: np.ndarray, m2_b: np.ndarray
+) -> Tuple[float, np.ndarray, np.ndarray]:
+    """Running statistics of two disjoint sets of samples combined (Chan et al.)"""
+    count = count_a + count_b
+    if not count_a or not count_b:
+        return (count, mean_b.copy(), m2_b.copy()) if count_b else (count, mean_a.copy(), m2_a.copy())
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (count_b / count)
+    m2 = m2_a + m2_b + delta * delta * (count_a * count_b / count)
+    return count, mean, m2
+
+
+class EntityBaselines:
+    def __init__(
+        self,
+        feature_names: Sequence[str],
+        keys: Sequence[str] = ("user_id",),
+        capacity: int = 100_000,
+        min_samples: int = 50,
+        z_threshold: float = 4.0,
+        std_floor: float = 0.25,
+        clear_global: bool = False,
+        path: Optional[str] = None,
+        sync_interval: float = 30.0
+    ):
+        """
+        Initialize the baseline tier
+
+        keys are log fields tried in order (e.g. user_id, then cohort, then
+        asn); the first warm baseline decides. At most capacity baselines
+        are held in memory. An entity is warm after min_samples events and
+        an event is anomalous when a feature is more than z_threshold
+        standard deviations from that entity's mean (the deviation is at
+        least std_floor times the global one). With clear_global a warm
+        baseline's "normal" also overrides a global anomaly. path is the SQLite
+        file evicted baselines spill to (None keeps them in memory only,
+        so evicted history is lost); owners call sync() every sync_interval
+        seconds.
+        """
+        self.feature_names = list(feature_names)
+        self.keys = list(keys)
+        self.capacity = capacity
+        self.min_samples = min_samples
+        self.z_threshold = z_threshold
+        self.std_floor = std_floor
+        self.clear_global = clear_global
+        self.path = path
+        self.sync_interval = sync_interval
+
+        n_features = len(self.feature_names)
+        self._count = np.zeros(capacity)
+        self._mean = np.zeros((capacity, n_features))
+        self._m2 = np.zeros((capacity, n_features))
+        # Learned by this process since the slot was last synced with disk
+        self._new_count = np.zeros(capacity)
+        self._new_mean = np.zeros((capacity, n_features))
+        self._new_m2 = np.zeros((capacity, n_features))
+        self._slots: "OrderedDict[str, int]" = OrderedDict()  # entity -> slot, LRU first
+        self._free = list(range(capacity - 1, -1, -1))
+        self._lock = threading.Lock()
+
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # Autocommit; merges run in explicit BEGIN IMMEDIATE transactions
+            self._db = sqlite3.connect(path, check_same_thread=False, timeout=5.0, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS baselines "
+                "(entity TEXT PRIMARY KEY, count REAL, mean BLOB, m2 BLOB)"
+            )
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_loads = 0
+        self.evictions = 0
+        self.merges = 0
+        self.entity_decisions = 0
+        self.global_kept = 0
+
+    def _slot(self, entity: str) -> int:
+        """Slot holding entity's baseline, loading or creating it on a miss"""
+        slot = self._slots.get(entity)
+        if slot is not None:
+            self._slots.move_to_end(entity)
+            self.hits += 1
+            return slot
+
+        self.misses += 1
+        if not self._free:
+            self._evict()
+        slot = self._free.pop()
+        self._slots[entity] = slot
+
+        stored = self._load(entity)
+        if stored:
+            self.disk_loads += 1
+            self._count[slot], self._mean[slot], self._m2[slot] = stored
+        else:
+            self._count[slot] = 0
+            self._mean[slot] = 0
+            self._m2[slot] = 0
+        self._new_count[slot] = 0
+        self._new_mean[slot] = 0
+        self._new_m2[slot] = 0
+        return slot
+
+    def _load(self, entity: str) -> Optional[Tuple[float, np.ndarray, np.ndarray]]:
+        """Stored (count, mean, m2) of an entity, None if absent or of an older feature layout"""
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT count, mean, m2 FROM baselines WHERE entity = ?", (entity,)
+        ).fetchone()
+        if row and len(row[1]) == self._mean[0].nbytes:
+            return row[0], np.frombuffer(row[1]), np.frombuffer(row[2])
+        return None
+
+    def _evict(self):
+        """Drop the least recently used baseline, merging it into the stored one"""
+        entity, slot = self._slots.popitem(last=False)
+        self._merge_all([(entity, slot)])
+        self._free.append(slot)
+        self.evictions += 1
+
+    def _merge_all(self, entries: List[Tuple[str, int]]):
+        """Merge the new samples of (entity, slot) pairs into the stored baselines in one transaction"""
+        entries = [(entity, slot) for entity, slot in entries if self._new_count[slot]]
+        if self._db is None or not entries:
+            return
+        self._db.execute("BEGIN IMMEDIATE")  # No other process merges in between our read and write
+        try:
+            for entity, slot in entries:
+                self._merge(entity, slot)
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def _merge(self, entity: str, slot: int):
+        stored = self._load(entity) or (0.0, np.zeros_like(self._mean[slot]), np.zeros_like(self._m2[slot]))
+        count, mean, m2 = combine(*stored, self._new_count[slot], self._new_mean[slot], self._new_m2[slot])
+        self._db.execute(
+            "INSERT OR REPLACE INTO baselines VALUES (?, ?, ?, ?)",
+            (entity, float(count), mean.tobytes(), m2.tobytes())
+        )
+        # Continue from everything every process has learned so far
+        self._count[slot], self._mean[slot], self._m2[slot] = count, mean, m2
+        self._new_count[slot] = 0
+        self._new_mean[slot] = 0
+        self._new_m2[slot] = 0
+        self.merges += 1
+
+    @staticmethod
+    def _welford(count: np.ndarray, mean: np.ndarray, m2: np.ndarray, slot: int, row: np.ndarray):
+        count[slot] += 1
+        delta = row - mean[slot]
+        mean[slot] += delta / count[slot]
+        m2[slot] += delta * (row - mean[slot])
+
+    def _update(self, slot: int, row: np.ndarray):
+        """Welford update of one baseline (and its not yet synced part) with one feature vector"""
+        self._welford(self._count, self._mean, self._m2, slot, row)
+        self._welford(self._new_count, self._new_mean, self._new_m2, slot, row)
+
+    def _score(self, slot: int, row: np.ndarray, floor: np.ndarray) -> Tuple[float, int]:
+        """Largest per-feature z-score against the baseline, and its feature index"""
+        std = np.maximum(np.sqrt(self._m2[slot] / self._count[slot]), floor)
+        z = np.abs(row - self._mean[slot]) / std
+        worst = int(z.argmax())
+        return float(z[worst]), worst
+
+    def apply(
+        self,
+        logs: List[Dict],
+        features: np.ndarray,
+        results: List[Tuple],
+        scale: Optional[np.ndarray] = None
+    ) -> List[Tuple]:
+        """
+        Re-decide global model results against per-entity baselines
+
+        features is the raw (unscaled) feature matrix of logs and scale the
+        global scaler's per-feature standard deviation (scaler.scale_;
+        None = 1 for every feature). Results keep the (is_anomaly,
+        confidence, reason, model_version) shape. Baselines learn from
+        every event while cold and afterwards only from events judged
+        normal, so an attacker cannot quickly shift a warm baseline.
+
+        Does blocking SQLite reads on a cache miss - call it off the event loop.
+        """
+        floor = self.std_floor * (np.ones(features.shape[1]) if scale is None else np.asarray(scale))
+        floor = np.where(floor > 0, floor, self.std_floor)
+        adjusted = []
+        with self._lock:
+            for log, row, result in zip(logs, features, results):
+                slots = [
+                    (key, self._slot(f"{key}:{log[key]}"))
+                    for key in self.keys if log.get(key)
+                ]
+
+                decided = None
+                for key, slot in slots:
+                    if self._count[slot] >= self.min_samples:
+                        z, worst = self._score(slot, row, floor)
+                        if z > self.z_threshold:
+                            reason = f"{self.feature_names[worst]} deviates from {key} baseline ({z:.1f} std)"
+                            if result[0]:
+                                reason = f"{result[2]}; {reason}"
+                            confidence = max(z / (z + self.z_threshold), result[1] if result[0] else 0.0)
+                            decided = (True, confidence, reason, result[3])
+                        elif result[0] and not self.clear_global:
+                            self.global_kept += 1  # A warm baseline may only add detections
+                        else:
+                            decided = (False, z / (z + self.z_threshold), "Consistent with entity baseline", result[3])
+                        self.entity_decisions += 1
+                        break
+                adjusted.append(decided or result)
+
+                is_anomaly = (decided or result)[0]
+                for _, slot in slots:
+                    if self._count[slot] < self.min_samples or not is_anomaly:
+                        self._update(slot, row)
+        return adjusted
+
+    def sync(self):
+        """Merge what every cached baseline learned since its last sync into disk (periodically and on shutdown)"""
+        if self._db is None:
+            return
+        with self._lock:
+            self._merge_all(list(self._slots.items()))
+
+    def get_stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "keys": self.keys,
+            "cached": len(self._slots),
+            "capacity": self.capacity,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "disk_loads": self.disk_loads,
+            "evictions": self.evictions,
+            "merges": self.merges,
+            "entity_decisions": self.entity_decisions,
+            "global_anomalies_kept": self.global_kept,
+            "clear_global": self.clear_global,
+            "persisted": self.path is not None
+        }
+
+
+def create_entity_baselines(feature_names: Sequence[str], model_dir: str) -> Optional[EntityBaselines]:
+    """Build the baseline tier from ENTITY_* settings, or None if ENTITY_BASELINES=false"""
+    if os.getenv("ENTITY_BASELINES", "true").lower() != "true":
+        return None
+    return EntityBaselines(
+        feature_names,
+        keys=[key.strip() for key in os.getenv("ENTITY_KEYS", "user_id").split(",") if key.strip()],
+        capacity=int(os.getenv("ENTITY_CACHE_SIZE", "100000")),
+        min_samples=int(os.getenv("ENTITY_MIN_SAMPLES", "50")),
+        z_threshold=float(os.getenv("ENTITY_Z_THRESHOLD", "4.0")),
+        std_floor=float(os.getenv("ENTITY_STD_FLOOR", "0.25")),
+        clear_global=os.getenv("ENTITY_CLEARS_GLOBAL", "false").lower() == "true",
+        path=os.getenv("ENTITY_BASELINE_PATH", os.path.join(model_dir, "entity_baselines.db")) or None,
+        sync_interval=float(os.getenv("ENTITY_SYNC_INTERVAL", "30"))
+    )
@@ -0,0 +1,143 @@
+"""
+Expiry Scheduler
+One deadline per key (e.g. a blocked IP) on a single min-heap, swept by one
+background task instead of a sleeping task per key:
+- scheduling or extending a deadline is O(log n); superseded heap entries
+  are skipped lazily when they surface and compacted away when they pile up
+- due keys are collected in batches of up to batch_size and handed to the
+  expiry callback together
+- the sweeper sleeps until the earliest deadline (at least `resolution`
+  seconds, so keys expiring close together are swept in one batch) and is
+  woken early when an earlier deadline is scheduled
+"""
+
+import asyncio
+import heapq
+import time
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+class ExpiryScheduler:
+    def __init__(self, batch_size: int = 1000, resolution: float = 1.0):
+        """Deadlines are epoch seconds (time.time())"""
+        self.batch_size = batch_size
+        self.resolution = resolution
+        self._deadlines: Dict[str, float] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.expired_total = 0
+        self.sweeps = 0
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._deadlines
+
+    def deadline(self, key: str) -> Optional[float]:
+        return self._deadlines.get(key)
+
+    def items(self) -> Iterator[Tuple[str, float]]:
+        """(key, deadline) pairs of every scheduled key"""
+        return iter(self._deadlines.items())
+
+    def schedule(self, key: str, deadline: float, extend_only: bool = True) -> float:
+        """
+        Set a key's deadline and return the one in effect
+
+        With extend_only (the default) an existing later deadline is kept,
+        so re-blocking never shortens a block.
+        """
+        current = self._deadlines.get(key)
+        if current is not None and extend_only and current >= deadline:
+            return current
+        self._deadlines[key] = deadline
+        earliest = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (deadline, key))
+        if len(self._heap) > 2 * len(self._deadlines) + 1024:
+            self._compact()
+        if self._wake and (earliest is None or deadline < earliest):
+            self._wake.set()
+        return deadline
+
+    def cancel(self, key: str) -> bool:
+        """Forget a key (its heap entry is dropped lazily)"""
+        return self._deadlines.pop(key, None) is not None
+
+    def _compact(self):
+        self._heap = [(deadline, key) for key, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
+
+    def _next_deadline(self) -> Optional[float]:
+        """Earliest live deadline, dropping superseded entries on the way"""
+        heap = self._heap
+        while heap:
+            deadline, key = heap[0]
+            if self._deadlines.get(key) == deadline:
+                return deadline
+            heapq.heappop(heap)
+        return None
+
+    def pop_expired(self, now: Optional[float] = None, limit: Optional[int] = None) -> List[str]:
+        """Remove and return up to limit (default batch_size) keys whose deadline has passed"""
+        now = time.time() if now is None else now
+        limit = self.batch_size if limit is None else limit
+        expired = []
+        heap = self._heap
+        while heap and heap[0][0] <= now and len(expired) < limit:
+            deadline, key = heapq.heappop(heap)
+            if self._deadlines.get(key) == deadline:
+                del self._deadlines[key]
+                expired.append(key)
+        self.expired_total += len(expired)
+        return expired
+
+    async def _run(self, on_expire: Callable[[List[str]], Awaitable[None]]):
+        while True:
+            next_deadline = self._next_deadline()
+            self._wake.clear()
+            timeout = None if next_deadline is None else max(next_deadline - time.time(), self.resolution)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+                continue  # Earlier deadline scheduled - recompute
+            except asyncio.TimeoutError:
+                pass
+
+            self.sweeps += 1
+            while True:
+                batch = self.pop_expired()
+                if not batch:
+                    break
+                try:
+                    await on_expire(batch)
+                except Exception as e:
+                    print(f"Expiry callback error: {e}")
+                if len(batch) < self.batch_size:
+                    break
+
+    def start(self, on_expire: Callable[[List[str]], Awaitable[None]]):
+        """Start the sweeper task; on_expire receives each batch of expired keys"""
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run(on_expire))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict:
+        next_deadline = self._next_deadline()
+        return {
+            "scheduled": len(self._deadlines),
+            "heap_entries": len(self._heap),
+            "next_expiry_in_seconds": round(next_deadline - time.time(), 1) if next_deadline else None,
+            "expired_total": self.expired_total,
+            "sweeps": self.sweeps
+        }
@@ -0,0 +1,220 @@
+"""
+Feature Schema
+Declarative description of the model's feature vector. FEATURE_SCHEMA
+names every column, where it comes from, its default and dtype;
+REASON_RULES describe the human-readable reasons in terms of those names.
+Both are compiled once into a FeatureExtractor that:
+- writes whole batches column by column into a float32 matrix (optionally
+  a caller's preallocated buffer), each column filled straight from the
+  logs with np.fromiter instead of building a Python row per log
+- derives hour and day of week from the epoch with integer arithmetic
+- evaluates reason rules as vectorised comparisons over the batch
+
+Feature kinds:
+    value     float(log[source]), default when missing or None
+    hour      local hour of log[source] (epoch seconds), 0-23
+    weekday   local day of week of log[source], Monday = 0
+    behavior  computed from raw traces by behavior_features
+
+Network features (ip_private, asn_new_for_user, ...) are plain values
+filled in by the IP enrichment stage of normalize_log_data (per-user
+novelty from the gateway's network_history block); velocity features
+(ip_events_1m, ip_failed_5m, ...) come from the gateway's window counters
+and talker features (ip_distinct_users, ...) from its stream sketches.
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    from .behavior_features import BEHAVIOR_FEATURE_NAMES, behavior_feature_matrix, has_raw_streams
+    from .window_counters import VELOCITY_FEATURE_NAMES
+except ImportError:  # Loaded as a top-level module by mcp_server.py
+    from behavior_features import BEHAVIOR_FEATURE_NAMES, behavior_feature_matrix, has_raw_streams
+    from window_counters import VELOCITY_FEATURE_NAMES
+
+FEATURE_KINDS = ("value", "hour", "weekday", "behavior")
+FEATURE_DTYPE = np.float32
+
+
+@dataclass(frozen=True)
+class Feature:
+    name: str
+    kind: str = "value"
+    source: Optional[str] = None  # Log field (defaults to name)
+    default: float = 0.0
+    dtype: str = "float32"  # Logical type; every column is stored as float32
+
+
+@dataclass(frozen=True)
+class ReasonRule:
+    """Reason text shown when every listed feature is strictly above / below its bound"""
+    text: str  # May reference feature values, e.g. "{login_hour:.0f}"
+    above: Dict[str, float] = field(default_factory=dict)
+    below: Dict[str, float] = field(default_factory=dict)
+
+
+FEATURE_SCHEMA = [
+    Feature("login_hour", kind="hour", source="timestamp", dtype="uint8"),
+    Feature("day_of_week", kind="weekday", source="timestamp", dtype="uint8"),
+    Feature("cursor_speed"),
+    Feature("keystroke_speed", default=300),
+    Feature("session_duration", dtype="int32"),
+    Feature("api_calls", source="api_calls_count", dtype="int32"),
+    Feature("ip_private", dtype="uint8"),
+    Feature("ip_unknown_network", dtype="uint8"),
+    Feature("asn_new_for_user", dtype="uint8"),
+    Feature("country_new_for_user", dtype="uint8"),
+    Feature("user_asn_count", dtype="int32"),
+    *(Feature(name, dtype="int32") for name in VELOCITY_FEATURE_NAMES),
+    Feature("ip_distinct_users", dtype="int32"),
+    Feature("ip_traffic_share"),
+    Feature("asn_traffic_share"),
+    *(Feature(name, kind="behavior") for name in BEHAVIOR_FEATURE_NAMES)
+]
+
+REASON_RULES = [
+    ReasonRule("Login at {login_hour:.0f}:00 (unusual hour)", above={"login_hour": 1.5}, below={"login_hour": 5.5}),
+    ReasonRule("Abnormally slow typing", below={"keystroke_speed": 100}),
+    ReasonRule("Abnormally fast typing (possible bot)", above={"keystroke_speed": 600}),
+    ReasonRule("Erratic cursor movements", above={"cursor_speed": 1000}),
+    ReasonRule("Login from a network (ASN) new for this user", above={"asn_new_for_user": 0.5}),
+    ReasonRule("Login from a country new for this user", above={"country_new_for_user": 0.5}),
+    ReasonRule("{ip_failed_5m:.0f} failed logins from this IP in 5 minutes", above={"ip_failed_5m": 9.5}),
+    ReasonRule("{ip_users_5m:.0f} different users from this IP in 5 minutes", above={"ip_users_5m": 4.5}),
+    ReasonRule("{ip_distinct_users:.0f} distinct users tried from this IP", above={"ip_distinct_users": 19.5}),
+    ReasonRule(
+        "Robotic cursor movement (straight lines, no pauses)",
+        above={"cursor_velocity_mean": 0},
+        below={"cursor_curvature_mean": 0.05, "cursor_pause_ratio": 1e-6}
+    ),
+    ReasonRule(
+        "Uniform keystroke timing (possible bot)",
+        above={"key_interval_mean_ms": 0},
+        below={"key_interval_std_ms": 5}
+    )
+]
+DEFAULT_REASON = "Statistical anomaly in behavior pattern"
+
+
+class FeatureExtractor:
+    def __init__(self, schema: Sequence[Feature], rules: Sequence[ReasonRule]):
+        """Compile a schema and its reason rules"""
+        self.schema = list(schema)
+        self.names = [feature.name for feature in self.schema]
+        index = {name: i for i, name in enumerate(self.names)}
+        for feature in self.schema:
+            if feature.kind not in FEATURE_KINDS:
+                raise ValueError(f"Unknown feature kind for {feature.name}: {feature.kind}")
+
+        def columns(kind: str):
+            return [(i, f.source or f.name, f.default) for i, f in enumerate(self.schema) if f.kind == kind]
+
+        # Every column except the behavior block is written straight into
+        # the output matrix, one pass over the batch per column
+        self._hour_cols = [(i, source) for i, source, _ in columns("hour")]
+        self._weekday_cols = [(i, source) for i, source, _ in columns("weekday")]
+        self._value_cols = columns("value")
+        behavior = {f.name: i for i, f in enumerate(self.schema) if f.kind == "behavior"}
+        self._behavior = np.array([behavior[name] for name in BEHAVIOR_FEATURE_NAMES if name in behavior], dtype=int)
+        self._behavior_used = [name in behavior for name in BEHAVIOR_FEATURE_NAMES]
+        self._offset_cache = (None, 0)  # (epoch hour, UTC offset in seconds)
+
+        self.rules = list(rules)
+        self._rules = []
+        for rule in self.rules:
+            for name in (*rule.above, *rule.below):
+                if name not in index:
+                    raise ValueError(f"Reason rule refers to unknown feature: {name}")
+            self._rules.append((
+                np.array([index[name] for name in rule.above], dtype=int),
+                np.array(list(rule.above.values()), dtype=FEATURE_DTYPE),
+                np.array([index[name] for name in rule.below], dtype=int),
+                np.array(list(rule.below.values()), dtype=FEATURE_DTYPE),
+                "{" in rule.text
+            ))
+
+    @property
+    def n_features(self) -> int:
+        return len(self.schema)
+
+    def extract(self, logs: List[Dict], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Fill a (len(logs), n_features) float32 matrix
+
+        out, if given, is a preallocated float32 buffer with at least
+        len(logs) rows; the filled leading rows are returned as a view.
+        """
+        n = len(logs)
+        if out is None:
+            out = np.empty((n, self.n_features), dtype=FEATURE_DTYPE)
+        else:
+            out = out[:n]
+        if n == 0:
+            return out
+
+        if self._hour_cols or self._weekday_cols:
+            now = time.time()
+            for i, source in self._hour_cols:
+                out[:, i] = self._local_seconds_column(logs, source, now) // 3600 % 24
+            for i, source in self._weekday_cols:
+                # 1970-01-01 was a Thursday (Monday = 0)
+                out[:, i] = (self._local_seconds_column(logs, source, now) // 86400 + 3) % 7
+        for i, source, default in self._value_cols:
+            out[:, i] = np.fromiter(
+                (default if value is None else value for value in (log.get(source) for log in logs)),
+                dtype=FEATURE_DTYPE, count=n
+            )
+
+        if len(self._behavior):
+            if has_raw_streams(logs):
+                out[:, self._behavior] = behavior_feature_matrix(logs)[:, self._behavior_used]
+            else:
+                out[:, self._behavior] = 0
+        return out
+
+    def _local_seconds_column(self, logs: List[Dict], source: str, now: float) -> np.ndarray:
+        """Local epoch seconds of log[source] for every log, as an int64 column"""
+        return np.fromiter(
+            (self._local_seconds(log.get(source), now) for log in logs),
+            dtype=np.int64, count=len(logs)
+        )
+
+    def _local_seconds(self, timestamp: Optional[float], now: float) -> int:
+        """Epoch seconds shifted to local time; the UTC offset is looked up once per hour"""
+        seconds = int(timestamp if timestamp is not None else now)
+        epoch_hour, offset = self._offset_cache
+        if seconds // 3600 != epoch_hour:
+            # DST changes happen on the hour, so the offset holds for the whole hour
+            offset = time.localtime(seconds).tm_gmtoff
+            self._offset_cache = (seconds // 3600, offset)
+        return seconds + offset
+
+    def reasons(self, features: np.ndarray) -> List[str]:
+        """Reason text for every row of a feature matrix"""
+        n = len(features)
+        matched: List[List[str]] = [[] for _ in range(n)]
+        for rule, (above_idx, above, below_idx, below, formatted) in zip(self.rules, self._rules):
+            mask = np.ones(n, dtype=bool)
+            if len(above_idx):
+                mask &= (features[:, above_idx] > above).all(axis=1)
+            if len(below_idx):
+                mask &= (features[:, below_idx] < below).all(axis=1)
+            for i in np.flatnonzero(mask):
+                text = rule.text
+                if formatted:
+                    text = text.format(**dict(zip(self.names, features[i].tolist())))
+                matched[i].append(text)
+        return ["; ".join(texts) if texts else DEFAULT_REASON for texts in matched]
+
+    def describe(self) -> List[Dict]:
+        return [
+            {"name": f.name, "kind": f.kind, "source": f.source or f.name, "default": f.default, "dtype": f.dtype}
+            for f in self.schema
+        ]
+
+
+FEATURE_EXTRACTOR = FeatureExtractor(FEATURE_SCHEMA, REASON_RULES)
@@ -0,0 +1,269 @@
+"""
+Firewall Sync
+Pushes the blocklist to an enforcement backend in batched, diffed set
+updates instead of one rule change per IP:
+- block / unblock calls only mark an entry as wanted or unwanted; a flush
+  every FIREWALL_SYNC_INTERVAL seconds diffs that against what the backend
+  already holds and sends the additions and removals as one batch, so a
+  block that is lifted before the next flush never reaches the firewall
+- a failed batch is retried on the next flush
+- resync() replaces the backend's whole set with the current blocklist;
+  it runs at startup (so entries left over from a previous run are
+  removed) and is retried on every flush until it succeeds
+
+Backends:
+- none:     no enforcement (the in-process blocklist still drops traffic)
+- nftables: writes nft scripts for named sets (blocked_v4 / blocked_v6 with
+  interval flags) to a file, or to a named pipe read by something like
+  `while true; do nft -f /run/cronx-nft.fifo; done`. A file is appended to,
+  so it doubles as a log of every update for testing. The resync also
+  (re)creates an `input` chain (hook input, priority -10) in the same table
+  that drops traffic from both sets. Blocklist entries never overlap (a
+  prefix replaces the entries inside it, removed in the same script before
+  it is added), as an interval set without auto-merge requires.
+"""
+
+import asyncio
+import errno
+import os
+import stat
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional, Set
+
+
+class FirewallBackend(ABC):
+    """Interface implemented by every enforcement backend"""
+
+    name = "base"
+
+    @abstractmethod
+    async def apply(self, add: List[str], remove: List[str]):
+        """Add and remove set entries (IPs or CIDRs) in one batch; raise to have it retried"""
+
+    @abstractmethod
+    async def replace(self, entries: List[str]):
+        """Make the backend's set exactly `entries` (and install whatever enforces it)"""
+
+    async def close(self):
+        """Release resources"""
+
+
+class NullFirewall(FirewallBackend):
+    name = "none"
+
+    async def apply(self, add: List[str], remove: List[str]):
+        pass
+
+    async def replace(self, entries: List[str]):
+        pass
+
+
+class NftablesScriptBackend(FirewallBackend):
+    """nftables set updates written as `nft -f` scripts to a file or named pipe"""
+
+    name = "nftables"
+
+    def __init__(self, path: str, table: str = "cronx", family: str = "inet", chunk_size: int = 1000):
+        self.path = path
+        self.table = table
+        self.family = family
+        self.chunk_size = chunk_size
+        self.scripts_written = 0
+
+    def _set_name(self, entry: str) -> str:
+        return "blocked_v6" if ":" in entry else "blocked_v4"
+
+    def _elements(self, verb: str, entries: Iterable[str]) -> List[str]:
+        by_set: Dict[str, List[str]] = {}
+        for entry in entries:
+            by_set.setdefault(self._set_name(entry), []).append(entry)
+        lines = []
+        for set_name, elements in sorted(by_set.items()):
+            for i in range(0, len(elements), self.chunk_size):
+                chunk = ", ".join(elements[i:i + self.chunk_size])
+                lines.append(f"{verb} element {self.family} {self.table} {set_name} {{ {chunk} }}")
+        return lines
+
+    def _definitions(self) -> List[str]:
+        # "add" is a no-op for a table or set that already exists
+        return [
+            f"add table {self.family} {self.table}",
+            f"add set {self.family} {self.table} blocked_v4 {{ type ipv4_addr; flags interval; }}",
+            f"add set {self.family} {self.table} blocked_v6 {{ type ipv6_addr; flags interval; }}"
+        ]
+
+    def _write(self, script: str):
+        if os.path.exists(self.path) and stat.S_ISFIFO(os.stat(self.path).st_mode):
+            # Non-blocking open fails with ENXIO while no reader has the pipe open
+            try:
+                fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    raise ConnectionError(f"No reader on firewall pipe {self.path}")
+                raise
+            try:
+                os.set_blocking(fd, True)
+                os.write(fd, script.encode())
+            finally:
+                os.close(fd)
+        else:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(script)
+        self.scripts_written += 1
+
+    async def _run(self, lines: List[str]):
+        script = "\n".join(lines) + "\n"
+        await asyncio.get_running_loop().run_in_executor(None, self._write, script)
+
+    async def apply(self, add: List[str], remove: List[str]):
+        # Removals first, so re-adding an entry as part of a wider prefix cannot collide
+        await self._run(self._definitions() + self._elements("delete", remove) + self._elements("add", add))
+
+    def _chain(self) -> List[str]:
+        # Flushed and refilled, so a resync never duplicates the rules
+        chain = f"{self.family} {self.table} input"
+        return [
+            f"add chain {chain} {{ type filter hook input priority -10; policy accept; }}",
+            f"flush chain {chain}",
+            f"add rule {chain} ip saddr @blocked_v4 drop",
+            f"add rule {chain} ip6 saddr @blocked_v6 drop"
+        ]
+
+    async def replace(self, entries: List[str]):
+        flush = [f"flush set {self.family} {self.table} {name}" for name in ("blocked_v4", "blocked_v6")]
+        await self._run(self._definitions() + self._chain() + flush + self._elements("add", entries))
+
+
+class FirewallSync:
+    def __init__(self, backend: FirewallBackend, interval: float = 0.5):
+        """Batch blocklist changes to backend every interval seconds"""
+        self.backend = backend
+        self.interval = interval
+        self._wanted: Set[str] = set()    # The whole blocklist
+        self._applied: Set[str] = set()   # What the backend holds
+        self._pending: Dict[str, bool] = {}  # entry -> wanted, since the last flush
+        self._needs_resync = True
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+        self.batches = 0
+        self.entries_added = 0
+        self.entries_removed = 0
+        self.failures = 0
+        self.resyncs = 0
+
+    def add(self, entry: str):
+        self._wanted.add(entry)
+        self._pending[entry] = True
+
+    def remove(self, entry: str):
+        self._wanted.discard(entry)
+        self._pending[entry] = False
+
+    async def flush(self):
+        """Send everything pending since the last flush as one diffed batch (or a full resync if due)"""
+        async with self._lock:
+            if self._needs_resync:
+                await self._resync()
+                return
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            add = [entry for entry, wanted in pending.items() if wanted and entry not in self._applied]
+            remove = [entry for entry, wanted in pending.items() if not wanted and entry in self._applied]
+            if not add and not remove:
+                return
+            try:
+                await self.backend.apply(add, remove)
+            except Exception as e:
+                self.failures += 1
+                print(f"Firewall sync failed ({len(add)} adds, {len(remove)} removes): {e}")
+                # Keep the changes unless newer ones for the same entries arrived meanwhile
+                self._pending = {**pending, **self._pending}
+                return
+            self._applied.update(add)
+            self._applied.difference_update(remove)
+            self.batches += 1
+            self.entries_added += len(add)
+            self.entries_removed += len(remove)
+
+    async def _resync(self):
+        entries = sorted(self._wanted)
+        self._pending = {}
+        try:
+            await self.backend.replace(entries)
+        except Exception as e:
+            # Retried on every flush until it succeeds, so stale entries cannot linger
+            self.failures += 1
+            print(f"Firewall resync failed: {e}")
+            return
+        self._applied = set(entries)
+        self._needs_resync = False
+        self.resyncs += 1
+        print(f"🧱 Firewall resync ({self.backend.name}): {len(entries)} entries")
+
+    async def resync(self):
+        """Replace the backend's whole set with the current blocklist"""
+        self._needs_resync = True
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Firewall sync error: {e}")
+
+    async def start(self, entries: Iterable[str] = ()):
+        """Resync the backend to entries (the blocklist at startup), then flush periodically"""
+        self._wanted = set(entries)
+        self._lock = asyncio.Lock()
+        await self.resync()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush what is pending and stop"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._lock:
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Firewall sync error: {e}")
+        await self.backend.close()
+
+    def get_stats(self) -> Dict:
+        return {
+            "backend": self.backend.name,
+            "wanted": len(self._wanted),
+            "applied": len(self._applied),
+            "pending": len(self._pending),
+            "in_sync": not self._needs_resync and not self._pending,
+            "batches": self.batches,
+            "entries_added": self.entries_added,
+            "entries_removed": self.entries_removed,
+            "failures": self.failures,
+            "resyncs": self.resyncs
+        }
+
+
+def create_firewall_sync() -> FirewallSync:
+    """Build the firewall sync selected by FIREWALL_BACKEND"""
+    backend = os.getenv("FIREWALL_BACKEND", "none").lower()
+    interval = float(os.getenv("FIREWALL_SYNC_INTERVAL", "0.5"))
+    if backend == "none":
+        return FirewallSync(NullFirewall(), interval)
+    if backend == "nftables":
+        return FirewallSync(NftablesScriptBackend(
+            os.getenv("FIREWALL_NFT_PATH", "/tmp/cronx-nft.txt"),
+            table=os.getenv("FIREWALL_NFT_TABLE", "cronx"),
+            chunk_size=int(os.getenv("FIREWALL_NFT_CHUNK_SIZE", "1000"))
+        ), interval)
+    raise ValueError(f"Unknown firewall backend: {backend} (expected 'none' or 'nftables')")
@@ -0,0 +1,140 @@
+"""
+Inference Pool
+Runs CPU-bound model calls off the asyncio event loop in a bounded
+thread or process pool, so /health and other requests stay responsive
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+
+class PoolFullError(Exception):
+    """Raised when the pool's queue is full; the caller should retry later"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _timed_call(fn: Callable, args: Tuple):
+    """Run fn in the worker and report how long the worker was busy"""
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+class InferencePool:
+    def __init__(
+        self,
+        mode: str = "thread",
+        workers: int = 4,
+        max_queue: int = 256,
+        retry_after: int = 1,
+        initializer: Optional[Callable] = None,
+        initargs: Tuple = ()
+    ):
+        """
+        Initialize the pool
+
+        mode is "thread" or "process". At most max_queue calls may wait
+        for a worker; beyond that run() raises PoolFullError instead
+        of queueing without limit. initializer/initargs are passed to
+        process workers (e.g. to hand them the model artifact to load).
+        """
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown inference pool mode: {mode} (expected 'thread' or 'process')")
+
+        self.mode = mode
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.initializer = initializer
+        self.initargs = initargs
+
+        self._executor: Optional[Executor] = None
+        self._pending = 0  # queued + running
+        self._busy_seconds = 0.0
+        self._started_at = time.perf_counter()
+        self.completed = 0
+        self.rejected = 0
+
+    def _create_executor(self) -> Executor:
+        if self.mode == "process":
+            return ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=self.initializer,
+                initargs=self.initargs
+            )
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+
+    def start(self):
+        """Create the worker pool"""
+        if self._executor is None:
+            self._executor = self._create_executor()
+            self._started_at = time.perf_counter()
+
+    def reload(self, initargs: Tuple):
+        """
+        Replace process workers with ones initialised from new initargs
+
+        Calls already running finish on the old workers.
+        """
+        self.initargs = initargs
+        if self.mode != "process" or self._executor is None:
+            return
+        old_executor = self._executor
+        self._executor = self._create_executor()
+        old_executor.shutdown(wait=False)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn: Callable, *args):
+        """Run fn(*args) on a worker, or raise PoolFullError if the queue is full"""
+        if self._executor is None:
+            self.start()
+
+        if self._pending - self.workers >= self.max_queue:
+            self.rejected += 1
+            raise PoolFullError(self.retry_after)
+
+        self._pending += 1
+        loop = asyncio.get_running_loop()
+        try:
+            result, busy = await loop.run_in_executor(self._executor, _timed_call, fn, args)
+            self._busy_seconds += busy
+            self.completed += 1
+            return result
+        finally:
+            self._pending -= 1
+
+    def get_stats(self) -> Dict:
+        """Queue depth and worker utilisation"""
+        elapsed = max(time.perf_counter() - self._started_at, 1e-9)
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queue_depth": max(self._pending - self.workers, 0),
+            "active_workers": min(self._pending, self.workers),
+            "utilisation": round(min(self._busy_seconds / (elapsed * self.workers), 1.0), 4),
+            "completed": self.completed,
+            "rejected": self.rejected
+        }
+
+
+def create_inference_pool(initializer: Optional[Callable] = None, initargs: Tuple = ()) -> InferencePool:
+    """Create the pool from INFERENCE_POOL_MODE / INFERENCE_WORKERS / INFERENCE_MAX_QUEUE"""
+    return InferencePool(
+        mode=os.getenv("INFERENCE_POOL_MODE", "thread").lower(),
+        workers=int(os.getenv("INFERENCE_WORKERS", str(min(os.cpu_count() or 1, 4)))),
+        max_queue=int(os.getenv("INFERENCE_MAX_QUEUE", "256")),
+        retry_after=int(os.getenv("INFERENCE_RETRY_AFTER", "1")),
+        initializer=initializer,
+        initargs=initargs
+    )
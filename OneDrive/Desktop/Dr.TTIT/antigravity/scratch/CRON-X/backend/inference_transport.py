@@ -0,0 +1,233 @@
+"""
+Inference Transports
+How the Decision Engine reaches the AI model:
+- http: POST to the MCP server (default)
+- inprocess: call ai_detector directly from a thread pool, skipping the
+  loopback HTTP hop and the second round of pydantic validation
+"""
+
+import asyncio
+import importlib.util
+import os
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import httpx
+
+
+class TransportError(Exception):
+    """Raised when a transport cannot produce a prediction"""
+
+
+class TransportBusyError(TransportError):
+    """Raised when the model server applies backpressure (HTTP 429)"""
+
+
+class InferenceTransport(ABC):
+    """Interface implemented by every inference transport"""
+
+    name = "base"
+
+    async def start(self):
+        """Acquire long-lived resources (called on app startup)"""
+
+    async def close(self):
+        """Release long-lived resources (called on app shutdown)"""
+
+    @abstractmethod
+    async def infer(self, log_data: Dict) -> Dict:
+        """Return one prediction dict for one log"""
+
+    @abstractmethod
+    async def infer_batch(self, logs: List[Dict]) -> List[Dict]:
+        """Return one prediction dict per log, in input order"""
+
+    def get_stats(self) -> Dict:
+        return {"transport": self.name}
+
+
+class HttpTransport(InferenceTransport):
+    """Pooled keep-alive HTTP client to the MCP server"""
+
+    name = "http"
+
+    def __init__(self, mcp_url: str):
+        self.mcp_url = mcp_url
+
+        # MCP HTTP client pool configuration
+        self.pool_size = int(os.getenv("MCP_POOL_SIZE", "100"))
+        self.keepalive_connections = int(os.getenv("MCP_KEEPALIVE_CONNECTIONS", "20"))
+        self.keepalive_expiry = float(os.getenv("MCP_KEEPALIVE_EXPIRY", "30"))
+        self.request_timeout = float(os.getenv("MCP_TIMEOUT", "5.0"))
+        self.connect_timeout = float(os.getenv("MCP_CONNECT_TIMEOUT", "1.0"))
+        self.max_in_flight = int(os.getenv("MCP_MAX_IN_FLIGHT", "256"))
+        self.http2 = os.getenv("MCP_HTTP2", "false").lower() == "true"
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._in_flight: Optional[asyncio.Semaphore] = None
+
+    async def start(self):
+        """Open the long-lived MCP HTTP client"""
+        if self._client is not None:
+            return
+
+        http2 = self.http2
+        if http2 and importlib.util.find_spec("h2") is None:
+            print("MCP_HTTP2 requested but the 'h2' package is not installed - using HTTP/1.1")
+            http2 = False
+
+        self._client = httpx.AsyncClient(
+            base_url=self.mcp_url,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            timeout=httpx.Timeout(self.request_timeout, connect=self.connect_timeout)
+        )
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+
+    async def close(self):
+        """Close the MCP HTTP client and its pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post(self, path: str, payload) -> httpx.Response:
+        """POST to MCP over the pooled client, bounded by max_in_flight"""
+        if self._client is None:
+            await self.start()
+
+        async with self._in_flight:
+            return await self._client.post(path, json=payload)
+
+    async def infer(self, log_data: Dict) -> Dict:
+        response = await self._post("/mcp/infer", log_data)
+        if response.status_code == 429:
+            raise TransportBusyError(f"MCP busy, retry after {response.headers.get('Retry-After')}s")
+        if response.status_code != 200:
+            raise TransportError(f"MCP Error: {response.status_code}")
+        return response.json()
+
+    async def infer_batch(self, logs: List[Dict]) -> List[Dict]:
+        response = await self._post("/mcp/infer/batch", logs)
+        if response.status_code == 429:
+            raise TransportBusyError(f"MCP busy, retry after {response.headers.get('Retry-After')}s")
+        if response.status_code == 422 and len(logs) > 1:
+            # One malformed log rejects the whole batch - let the caller score individually
+            raise TransportError("MCP rejected batch: 422")
+        if response.status_code != 200:
+            raise TransportError(f"MCP Error: {response.status_code}")
+        return response.json()
+
+    def get_stats(self) -> Dict:
+        return {
+            "transport": self.name,
+            "mcp_server": self.mcp_url,
+            "pool_size": self.pool_size,
+            "keepalive_connections": self.keepalive_connections,
+            "max_in_flight": self.max_in_flight,
+            "http2": self.http2
+        }
+
+
+class InProcessTransport(InferenceTransport):
+    """Call the local ai_detector from a thread pool so the event loop is never blocked"""
+
+    name = "inprocess"
+
+    def __init__(self):
+        self.workers = int(os.getenv("INPROCESS_WORKERS", "4"))
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._ai_detector = None
+        self._detector = None
+        self._entity_baselines = None
+        self._sync_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Load the model and start the worker threads"""
+        if self._executor is not None:
+            return
+
+        # Imported lazily so the http transport never loads the model
+        from . import ai_detector
+        from .entity_baselines import create_entity_baselines
+        loop = asyncio.get_running_loop()
+        status = await loop.run_in_executor(None, ai_detector.initialize_detector)
+        print(f"📊 AI Model: {status} (v{ai_detector.detector.version})")
+        self._ai_detector = ai_detector
+        self._detector = ai_detector.detector
+        self._entity_baselines = create_entity_baselines(ai_detector.FEATURE_NAMES, ai_detector.MODEL_DIR)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix="inference"
+        )
+        baselines = self._entity_baselines
+        if baselines and baselines.path and baselines.sync_interval > 0:
+            self._sync_task = asyncio.create_task(self._sync_baselines(baselines.sync_interval))
+
+    async def _sync_baselines(self, interval: float):
+        """Merge this worker's baseline updates with those of the other API workers"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await loop.run_in_executor(self._executor, self._entity_baselines.sync)
+            except Exception as e:
+                print(f"Entity baseline sync failed: {e}")
+
+    async def close(self):
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._entity_baselines:
+            self._entity_baselines.sync()
+
+    def _predict_batch(self, logs: List[Dict]) -> List[Dict]:
+        """Runs on a worker thread"""
+        try:
+            logs = [self._ai_detector.normalize_log_data(log) for log in logs]
+        except (ValueError, TypeError) as e:
+            # Same as the MCP server's 422: the caller scores the batch log by log
+            raise TransportError(f"Rejected malformed log: {e}") from e
+        if not self._entity_baselines:
+            results = self._detector.predict_batch(logs)
+        else:
+            results, features = self._detector.predict_batch_with_features(logs)
+            active = self._detector.registry.active
+            results = self._entity_baselines.apply(
+                logs, features, results,
+                scale=active.scaler.scale_ if active else None
+            )
+        return [self._ai_detector.classify_prediction(*result) for result in results]
+
+    async def infer(self, log_data: Dict) -> Dict:
+        return (await self.infer_batch([log_data]))[0]
+
+    async def infer_batch(self, logs: List[Dict]) -> List[Dict]:
+        if self._executor is None:
+            await self.start()
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._predict_batch, logs)
+
+    def get_stats(self) -> Dict:
+        return {
+            "transport": self.name,
+            "workers": self.workers,
+            "entity_baselines": self._entity_baselines.get_stats() if self._entity_baselines else None
+        }
+
+
+def create_transport(name: str, mcp_url: str) -> InferenceTransport:
+    """Build the transport selected by MCP_TRANSPORT"""
+    if name == "http":
+        return HttpTransport(mcp_url)
+    if name == "inprocess":
+        return InProcessTransport()
+    raise ValueError(f"Unknown inference transport: {name} (expected 'http' or 'inprocess')")
@@ -0,0 +1,329 @@
+"""
+IP Enrichment
+ASN, country and network-novelty signals for a log's IP address.
+
+Network tables are loaded from local files (IP_RANGES_FILE, comma
+separated) in either of two formats, detected per line:
+- CSV:  network,asn,country[,org]          e.g. 8.8.8.0/24,15169,US,GOOGLE
+- TSV:  range_start<TAB>range_end<TAB>asn<TAB>country[<TAB>org]
+        (the iptoasn.com ip2asn-v4 / -v6 / -combined dumps)
+Lines starting with # are comments; ASN 0 ("not routed") is skipped.
+
+Longest-prefix match: nested prefixes are flattened once at load time into
+disjoint sorted intervals where the most specific prefix wins, so a lookup
+is one binary search (bisect) over the interval starts. IPv4 bounds live in
+compact array('I') columns; IPv6 bounds are Python ints. An LRU cache in
+front of the search serves hot IPs without parsing the address again.
+
+Per user, the ASNs and countries seen so far are remembered (bounded, least
+recently active users are forgotten) to flag a login from a new network.
+That history is updated once, by the gateway when it receives an event
+(observe_user), and travels with the log as its "network_history" block;
+enrich() itself is a pure lookup, so training logs, re-scored logs and
+whichever worker scores a log do not change the verdict.
+"""
+
+import ipaddress
+import os
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+DEFAULT_RANGES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "geoip", "ip_ranges.csv")
+
+# Per-user novelty fields of the gateway's network_history block
+NETWORK_HISTORY_FIELDS = ("asn_new_for_user", "country_new_for_user", "user_asn_count")
+
+# Fields enrich() adds to a normalized log (all numeric, used as model features)
+ENRICHMENT_FIELDS = ("ip_private", "ip_unknown_network", *NETWORK_HISTORY_FIELDS)
+
+
+class NetworkInfo(NamedTuple):
+    asn: int          # 0 when the address is in no loaded network
+    country: str      # ISO 3166 alpha-2, "" when unknown
+    org: str
+    private: bool     # Not in the table and private, loopback, link-local or otherwise non-global
+
+
+UNKNOWN_NETWORK = NetworkInfo(0, "", "", False)
+
+
+def _flatten(ranges: List[Tuple[int, int, int]]) -> List[Tuple[int, int, int]]:
+    """
+    Disjoint (start, end, value) intervals from nested or disjoint ranges
+
+    A range inside another (a more specific prefix) overrides it for the
+    addresses it covers. Ranges that partially overlap are not expected in
+    prefix tables; the one starting later wins for the overlap.
+    """
+    ranges.sort(key=lambda r: (r[0], -r[1]))
+    out: List[Tuple[int, int, int]] = []
+    open_ranges: List[Tuple[int, int]] = []  # (end, value), innermost last
+    cursor = 0
+
+    def emit(start: int, end: int, value: int):
+        if start <= end:
+            out.append((start, end, value))
+
+    for start, end, value in ranges:
+        while open_ranges and open_ranges[-1][0] < start:
+            closed_end, closed_value = open_ranges.pop()
+            emit(cursor, closed_end, closed_value)
+            cursor = closed_end + 1
+        if open_ranges:
+            emit(cursor, start - 1, open_ranges[-1][1])
+        open_ranges.append((end, value))
+        cursor = start
+    while open_ranges:
+        closed_end, closed_value = open_ranges.pop()
+        emit(cursor, closed_end, closed_value)
+        cursor = closed_end + 1
+    return out
+
+
+class PrefixTable:
+    """Static longest-prefix-match index over IPv4 and IPv6 networks"""
+
+    def __init__(self):
+        self._values: List[Tuple[int, str, str]] = []  # (asn, country, org), shared by many ranges
+        self._value_ids: Dict[Tuple[int, str, str], int] = {}
+        self._pending: Dict[int, List[Tuple[int, int, int]]] = {4: [], 6: []}
+        self._v4 = (array("I"), array("I"), array("I"))  # starts, ends, value ids
+        self._v6: Tuple[List[int], List[int], List[int]] = ([], [], [])
+
+    def add(self, start: str, end: str, asn: int, country: str = "", org: str = ""):
+        """Add the range of addresses start..end (inclusive); call build() when done"""
+        first, last = ipaddress.ip_address(start), ipaddress.ip_address(end)
+        if first.version != last.version or int(first) > int(last):
+            raise ValueError(f"Invalid address range {start} - {end}")
+        value = (asn, country.upper(), org)
+        value_id = self._value_ids.get(value)
+        if value_id is None:
+            value_id = self._value_ids[value] = len(self._values)
+            self._values.append(value)
+        self._pending[first.version].append((int(first), int(last), value_id))
+
+    def add_network(self, network: str, asn: int, country: str = "", org: str = ""):
+        net = ipaddress.ip_network(network, strict=False)
+        self.add(str(net.network_address), str(net.broadcast_address), asn, country, org)
+
+    def build(self) -> "PrefixTable":
+        """Flatten everything added so far (together with what was built before) for lookups"""
+        for version, columns in ((4, self._v4), (6, self._v6)):
+            pending = self._pending[version]
+            if not pending:
+                continue
+            existing = list(zip(*columns))
+            flat = _flatten(existing + pending)
+            starts, ends, values = (array("I"), array("I"), array("I")) if version == 4 else ([], [], [])
+            for start, end, value in flat:
+                starts.append(start)
+                ends.append(end)
+                values.append(value)
+            if version == 4:
+                self._v4 = (starts, ends, values)
+            else:
+                self._v6 = (starts, ends, values)
+            self._pending[version] = []
+        return self
+
+    def lookup(self, address: int, version: int = 4) -> Optional[Tuple[int, str, str]]:
+        """(asn, country, org) of the most specific network containing an address, or None"""
+        starts, ends, values = self._v4 if version == 4 else self._v6
+        i = bisect_right(starts, address) - 1
+        if i >= 0 and address <= ends[i]:
+            return self._values[values[i]]
+        return None
+
+    def __len__(self) -> int:
+        return len(self._v4[0]) + len(self._v6[0])
+
+    def get_stats(self) -> Dict:
+        return {
+            "ipv4_intervals": len(self._v4[0]),
+            "ipv6_intervals": len(self._v6[0]),
+            "networks": len(self._values)
+        }
+
+
+def _parse_line(table: PrefixTable, line: str):
+    if "\t" in line:
+        fields = line.split("\t")
+        start, end, asn, country = fields[:4]
+        org = fields[4] if len(fields) > 4 else ""
+        if int(asn):
+            table.add(start, end, int(asn), "" if country == "None" else country, org)
+        return
+    fields = [field.strip() for field in line.split(",")]
+    network, asn = fields[0], fields[1].upper().removeprefix("AS")
+    country = fields[2] if len(fields) > 2 else ""
+    org = ",".join(fields[3:]).strip('"')
+    if int(asn):
+        table.add_network(network, int(asn), country, org)
+
+
+def load_ip_table(paths: Iterable[str]) -> PrefixTable:
+    """Build a PrefixTable from CSV / TSV network files (missing files are skipped)"""
+    table = PrefixTable()
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"⚠️ IP ranges file not found: {path}")
+            continue
+        skipped = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.rstrip("\r\n")
+                if not line.strip() or line.lstrip().startswith("#"):
+                    continue
+                try:
+                    _parse_line(table, line)
+                except (ValueError, IndexError):
+                    skipped += 1
+        if skipped:
+            print(f"⚠️ Skipped {skipped} malformed lines in {path}")
+    return table.build()
+
+
+class UserNetworkHistory:
+    """ASNs and countries each user has been seen from (least recently active users are dropped)"""
+
+    def __init__(self, max_users: int = 100000):
+        self.max_users = max_users
+        self._users: "OrderedDict[str, Tuple[set, set]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, user_id: str, asn: int, country: str) -> Tuple[bool, bool, int]:
+        """
+        Record a sighting; returns (new ASN, new country, distinct ASNs so far)
+
+        A user's first sighting is not "new": there is nothing to compare it to.
+        Unknown networks (ASN 0 / no country) are never recorded or flagged.
+        """
+        with self._lock:
+            seen = self._users.get(user_id)
+            if seen is None:
+                seen = self._users[user_id] = (set(), set())
+                if len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+                first = True
+            else:
+                self._users.move_to_end(user_id)
+                first = not seen[0] and not seen[1]
+            asns, countries = seen
+            new_asn = bool(asn) and not first and asn not in asns
+            new_country = bool(country) and not first and country not in countries
+            if asn:
+                asns.add(asn)
+            if country:
+                countries.add(country)
+            return new_asn, new_country, len(asns)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+
+class IPEnricher:
+    def __init__(self, table: PrefixTable, cache_size: int = 65536, max_users: int = 100000):
+        """Enrich logs from a PrefixTable with an LRU cache of cache_size IPs"""
+        self.table = table
+        self.history = UserNetworkHistory(max_users)
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def _lookup(self, ip: Optional[str]) -> NetworkInfo:
+        """NetworkInfo for an IP string (UNKNOWN_NETWORK if invalid)"""
+        try:
+            address = ipaddress.ip_address((ip or "").strip())
+        except ValueError:
+            return UNKNOWN_NETWORK
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        found = self.table.lookup(int(address), address.version)
+        if found:
+            # A network listed in the table is routed, even a documentation range
+            return NetworkInfo(*found, False)
+        return NetworkInfo(0, "", "", not address.is_global)
+
+    def enrich(self, log: Dict) -> Dict:
+        """
+        Add network fields to a normalized log in place and return it
+
+        Sets asn ("AS<n>", unless the client already sent one) and country,
+        plus the numeric ENRICHMENT_FIELDS used by the model. The per-user
+        fields come from the log's network_history block (0 when missing);
+        no state is changed.
+        """
+        info = self.lookup(log.get('ip'))
+        if info.asn and not log.get('asn'):
+            log['asn'] = f"AS{info.asn}"
+        log['country'] = info.country or None
+        log['ip_private'] = 1 if info.private else 0
+        log['ip_unknown_network'] = 1 if not info.asn and not info.private else 0
+        history = log.pop('network_history', None) or {}
+        for name in NETWORK_HISTORY_FIELDS:
+            log[name] = history.get(name) or 0
+        return log
+
+    def observe_user(self, log: Dict) -> Dict[str, int]:
+        """
+        Gateway stage: record the log's network in its user's history
+
+        Returns the network_history block (NETWORK_HISTORY_FIELDS) to send
+        along with the log. Call once per received event.
+        """
+        new_asn = new_country = False
+        asn_count = 0
+        user_id = log.get('user_id')
+        if user_id:
+            info = self.lookup(log.get('ip'))
+            new_asn, new_country, asn_count = self.history.observe(str(user_id), info.asn, info.country)
+        return {
+            'asn_new_for_user': 1 if new_asn else 0,
+            'country_new_for_user': 1 if new_country else 0,
+            'user_asn_count': asn_count
+        }
+
+    def asn_label(self, ip: Optional[str]) -> str:
+        """Network label of an IP: AS<n>, private or unknown"""
+        info = self.lookup(ip)
+        if info.private:
+            return "private"
+        return f"AS{info.asn}" if info.asn else "unknown"
+
+    def describe(self, ip: Optional[str]) -> Dict[str, str]:
+        """Display fields for an event's enriched block (geo / asn / org)"""
+        info = self.lookup(ip)
+        if info.private:
+            return {"geo": "private", "asn": "private", "org": ""}
+        return {
+            "geo": info.country or "unknown",
+            "asn": self.asn_label(ip),
+            "org": info.org
+        }
+
+    def get_stats(self) -> Dict:
+        cache = self.lookup.cache_info()
+        lookups = cache.hits + cache.misses
+        return {
+            **self.table.get_stats(),
+            "cache_size": cache.currsize,
+            "cache_max": cache.maxsize,
+            "cache_hit_rate": round(cache.hits / lookups, 3) if lookups else 0.0
+        }
+
+
+def create_ip_enricher() -> IPEnricher:
+    """Enricher over IP_RANGES_FILE (comma separated; default the bundled sample table)"""
+    paths = [p.strip() for p in os.getenv("IP_RANGES_FILE", DEFAULT_RANGES_FILE).split(",") if p.strip()]
+    table = load_ip_table(paths)
+    return IPEnricher(
+        table,
+        cache_size=int(os.getenv("IP_CACHE_SIZE", "65536")),
+        max_users=int(os.getenv("IP_HISTORY_MAX_USERS", "100000"))
+    )
+
+
+# Global enricher instance
+ip_enricher = create_ip_enricher()
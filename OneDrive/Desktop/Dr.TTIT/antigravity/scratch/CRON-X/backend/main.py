@@ -1,13 +1,23 @@
 import asyncio
 import os
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from .routes import api
-from .mock_data import generate_alert, MOCK_ALERTS
+from .mock_data import generate_alert
+from .models import Alert, AuditLog, Note
+from .alert_store import alert_store
+from .persistence import alert_repository
+from .session_index import session_index
 from .email_service import email_service
 from .decision_engine import decision_engine
+from .batcher import create_log_batcher
+from .window_counters import create_activity_counters
+from .ip_enrichment import ip_enricher
+from .broadcaster import broadcaster, publish_alert_new, broadcast_alert_new, broadcast_alert_update
+from .pubsub import alert_bus
 import json
 import time
+import uuid
 from datetime import datetime
 
 app = FastAPI(title="CRON-X AI-Powered SOC API")
@@ -23,50 +33,76 @@ app.add_middleware(
 
 app.include_router(api.router, prefix="/api")
 
-# WebSocket Connection Manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-
-    async def broadcast(self, message: dict):
-        disconnected = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                disconnected.append(connection)
-        
-        for conn in disconnected:
-            self.disconnect(conn)
-
-manager = ConnectionManager()
-
+# WebSocket fan-out: per-client queues so one slow dashboard cannot delay the rest
 @app.websocket("/ws/alerts")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    client = await broadcaster.connect(websocket)
     try:
         while True:
             data = await websocket.receive_text()
+            try:
+                request = json.loads(data)
+            except ValueError:
+                continue
+            if not isinstance(request, dict) or request.get("type") != "subscribe":
+                continue
+            
+            # {"type": "subscribe", "filters": {"severity": ["high"]}, "projection": "summary"}
+            try:
+                broadcaster.subscribe(client, request.get("filters") or {}, request.get("projection", "full"))
+                await broadcaster.send(client, {
+                    "type": "subscribed",
+                    "filters": request.get("filters") or {},
+                    "projection": client.projection
+                })
+            except (ValueError, TypeError, AttributeError) as e:
+                await broadcaster.send(client, {"type": "error", "detail": str(e)})
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        await broadcaster.disconnect(client)
 
 # ===== AI-POWERED ANOMALY DETECTION =====
 
+def store_alert(alert: Alert) -> bool:
+    """Add a new alert to the in-memory store, the session index and persistent storage (False if its id is taken)"""
+    if not alert_store.add(alert):  # Evicts the oldest alert when full
+        print(f"Duplicate alert id ignored: {alert.alert_id}")
+        return False
+    session_index.record(alert)
+    alert_repository.save_alert(alert)
+    return True
+
+async def on_bus_message(channel: str, message: dict):
+    """Apply an alert event published by another worker and forward it to local dashboards"""
+    if channel == "talkers":
+        decision_engine.top_talkers.add_peer(message["origin"], message["snapshot"])
+        return
+    if channel != "alerts":
+        return
+    alert = Alert(**message["alert"])
+    if message["type"] == "alert_new":
+        # Persisted by the worker that raised it
+        if alert_store.add(alert):
+            session_index.record(alert)
+            await broadcast_alert_new(alert)
+    elif message["type"] == "alert_update":
+        changes = message["changes"]
+        local = alert_store.get(alert.alert_id)
+        if local is not None:
+            alert_store.set_status(local, changes["status"])
+            # Replace from the sender's offset, so a repeated delta is not appended twice
+            local.notes[changes["notes"]["from"]:] = [Note(**note) for note in changes["notes"]["entries"]]
+            local.audit[changes["audit"]["from"]:] = [AuditLog(**entry) for entry in changes["audit"]["entries"]]
+            alert = local
+        await broadcast_alert_update(alert, message["previous_status"], changes)
+
 async def send_alert_to_dashboard(alert_data: dict):
     """Callback function to send alerts to dashboard via WebSocket"""
     from .models import Alert, Event, StructuredReason
     
     # Create full alert object
     alert = Alert(
-        alert_id=f"AI_{int(time.time())}_{alert_data.get('user_id', 'unknown')}",
+        # Several alerts for one user can be raised within the same second
+        alert_id=f"AI_{int(time.time())}_{alert_data.get('user_id', 'unknown')}_{uuid.uuid4().hex[:6]}",
         created_ts=int(alert_data.get('timestamp', time.time())),
         status="open",
         severity=alert_data.get('severity', 'medium'),
@@ -93,10 +129,8 @@ async def send_alert_to_dashboard(alert_data: dict):
         short_text=f"🤖 AI Alert: {alert_data.get('reason', 'Suspicious activity detected')}"
     )
     
-    # Add to alerts list
-    MOCK_ALERTS.insert(0, alert)
-    if len(MOCK_ALERTS) > 100:
-        MOCK_ALERTS.pop()
+    if not store_alert(alert):
+        return
     
     # Send email if high severity
     if alert.severity == "high" and email_service.enabled:
@@ -105,28 +139,84 @@ async def send_alert_to_dashboard(alert_data: dict):
             email_service.send_alert_email(recipient, alert.dict())
     
     # Broadcast to dashboard
-    msg = {
-        "type": "alert_new",
-        "alert": alert.dict()
-    }
-    await manager.broadcast(msg)
+    await publish_alert_new(alert)
 
 # Register callback with decision engine
 decision_engine.register_alert_callback(send_alert_to_dashboard)
 
+# Concurrent log_activity calls are scored by MCP in micro-batches
+log_batcher = create_log_batcher(decision_engine.analyze_batch)
+
+# Server-side velocity (events, failed auths, distinct users) per IP, user and session
+activity_counters = create_activity_counters()
+
+# Workers exchange top-talker sketches over the alert bus this often (seconds)
+TALKER_SYNC_INTERVAL = float(os.getenv("TALKER_SYNC_INTERVAL", "5"))
+talker_sync_task = None
+
+async def publish_top_talkers():
+    """Periodically send this worker's top-talker sketches to the other workers"""
+    while True:
+        await asyncio.sleep(TALKER_SYNC_INTERVAL)
+        try:
+            await alert_bus.publish("talkers", {
+                "origin": alert_bus.origin,
+                "snapshot": decision_engine.top_talkers.export()
+            })
+        except Exception as e:
+            print(f"Top talker sync error: {e}")
+
+# Traffic from blocked IPs / prefixes: "drop" (answer without inference) or "reject" (403)
+BLOCKED_TRAFFIC_POLICY = os.getenv("BLOCKED_TRAFFIC_POLICY", "drop").lower()
+blocked_traffic_dropped = 0
+
 @app.post("/api/log-activity")
 async def log_activity(log_data: dict):
     """
     Receive user activity logs and analyze with AI
     This is the main entry point for the AI system
+    
+    Events from blocked IPs or prefixes are answered here, before any
+    inference cost is paid. Every event, dropped or not, counts towards
+    the top talkers.
     """
+    global blocked_traffic_dropped
+    # Checked once here: the sketches, the blocklist and IP enrichment all expect a string
+    ip = log_data.get('ip')
+    if ip is not None and not isinstance(ip, str):
+        return {
+            "success": False,
+            "error": f"ip must be a string, not {type(ip).__name__}",
+            "mcp_status": "error"
+        }
+    log_data['talkers'] = decision_engine.top_talkers.record(log_data)
+    blocked_by = decision_engine.blocked_by(log_data.get('ip'))
+    if blocked_by:
+        blocked_traffic_dropped += 1
+        if BLOCKED_TRAFFIC_POLICY == "reject":
+            raise HTTPException(status_code=403, detail=f"Blocked by {blocked_by}")
+        return {
+            "success": True,
+            "analyzed": False,
+            "action_result": {"action_executed": "drop", "ip_blocked": True, "blocked_by": blocked_by},
+            "mcp_status": "skipped"
+        }
+    return await analyze_activity(log_data)
+
+async def analyze_activity(log_data: dict) -> dict:
+    """Score one log with the AI model and act on the prediction"""
     try:
         # Add timestamp if not present
         if 'timestamp' not in log_data:
             log_data['timestamp'] = time.time()
         
-        # Send to MCP for AI analysis
-        prediction = await decision_engine.analyze_log(log_data)
+        # Window counters travel with the log: model features and decision rules
+        log_data['velocity'] = activity_counters.record(log_data)
+        # Per-user network history is kept here, once per event, not by the scorers
+        log_data['network_history'] = ip_enricher.observe_user(log_data)
+        
+        # Send to MCP for AI analysis (batched with concurrent requests)
+        prediction = await log_batcher.submit(log_data)
         
         # Execute automated action based on AI prediction
         result = await decision_engine.execute_action(prediction, log_data)
@@ -152,23 +242,65 @@ async def get_blocked_ips():
     blocked = await decision_engine.get_blocked_ips()
     return {"blocked_ips": blocked, "count": len(blocked)}
 
-@app.post("/api/unblock-ip/{ip}")
+@app.post("/api/unblock-ip/{ip:path}")
 async def unblock_ip(ip: str):
-    """Manually unblock an IP address"""
-    if ip in decision_engine.blocked_ips:
-        decision_engine.blocked_ips.remove(ip)
-        if ip in decision_engine.block_duration:
-            del decision_engine.block_duration[ip]
+    """Manually unblock an IP address or prefix (e.g. /api/unblock-ip/203.0.113.0/24)"""
+    if decision_engine.unblock_ip(ip):
         return {"success": True, "message": f"IP {ip} unblocked"}
+    blocked_by = decision_engine.blocked_by(ip)
+    if blocked_by:
+        return {"success": False, "message": f"IP {ip} is blocked as part of {blocked_by} - unblock that instead"}
     return {"success": False, "message": f"IP {ip} was not blocked"}
 
+@app.get("/api/top-talkers")
+async def top_talkers(limit: int = 20):
+    """
+    Top IPs and ASNs by events, top IPs by alerts and blocks, and distinct
+    IPs / users over the last one to two TOPK_WINDOW_SECONDS windows,
+    merged across every API worker (counts are approximate)
+    """
+    report = decision_engine.top_talkers.report(limit, max_age=3 * TALKER_SYNC_INTERVAL)
+    for talker in report["top_ips"] + report["top_offenders"]:
+        talker["blocked_by"] = decision_engine.blocked_by(talker["ip"])
+    return report
+
+@app.get("/api/batcher-stats")
+async def batcher_stats():
+    """Get micro-batcher batch-size and queue-wait histograms"""
+    return log_batcher.get_stats()
+
+@app.get("/api/ws-stats")
+async def ws_stats():
+    """Get dashboard WebSocket connections, queue depths, delivery lag and alert bus counters"""
+    stats = broadcaster.get_stats()
+    stats["bus"] = alert_bus.get_stats()
+    return stats
+
+@app.get("/api/storage-stats")
+async def storage_stats():
+    """Get alert store and persistence writer statistics"""
+    return {
+        "alerts_in_memory": len(alert_store),
+        "memory_capacity": alert_store.capacity,
+        "sessions": session_index.get_stats(),
+        "persistence": alert_repository.get_stats()
+    }
+
 @app.get("/api/ai-status")
 async def ai_status():
     """Get AI system status"""
     return {
         "ai_enabled": True,
         "mcp_server": decision_engine.mcp_url,
-        "blocked_ips_count": len(decision_engine.blocked_ips),
+        "inference": decision_engine.transport.get_stats(),
+        "blocked_ips_count": len(decision_engine.block_expiry),
+        "blocklist": decision_engine.blocklist.get_stats(),
+        "firewall": decision_engine.firewall.get_stats(),
+        "velocity_counters": activity_counters.get_stats(),
+        "network_history": {"tracked_users": len(ip_enricher.history), "max_users": ip_enricher.history.max_users},
+        "top_talkers": decision_engine.top_talkers.get_stats(),
+        "blocked_traffic_dropped": blocked_traffic_dropped,
+        "block_expiry": decision_engine.block_expiry.get_stats(),
         "model_type": "Isolation Forest",
         "detection_active": True
     }
@@ -180,20 +312,15 @@ async def trigger_alert():
     """Manually trigger a test alert"""
     new_alert = generate_alert()
     
-    MOCK_ALERTS.insert(0, new_alert)
-    if len(MOCK_ALERTS) > 100:
-        MOCK_ALERTS.pop()
+    if not store_alert(new_alert):
+        raise HTTPException(status_code=409, detail=f"Alert {new_alert.alert_id} already exists")
     
     if new_alert.severity == "high" and email_service.enabled:
         recipient = os.getenv("ALERT_RECIPIENT_EMAIL", "")
         if recipient:
             email_service.send_alert_email(recipient, new_alert.dict())
     
-    msg = {
-        "type": "alert_new",
-        "alert": new_alert.dict()
-    }
-    await manager.broadcast(msg)
+    await publish_alert_new(new_alert)
     
     return {"success": True, "alert_id": new_alert.alert_id}
 
@@ -217,8 +344,9 @@ async def simulate_suspicious_activity():
         "failed_logins": 5  # Multiple failures
     }
     
-    # Analyze with AI
-    result = await log_activity(suspicious_log)
+    # Analyze with AI (bypasses the blocklist so repeated simulations still reach the model)
+    suspicious_log['talkers'] = decision_engine.top_talkers.record(suspicious_log)
+    result = await analyze_activity(suspicious_log)
     
     return {
         "success": True,
@@ -234,3 +362,35 @@ async def startup_event():
     print("✅ Decision Engine: Ready")
     print("🔒 IP Blocking: Enabled")
     print("📧 Email Alerts: " + ("Enabled" if email_service.enabled else "Disabled"))
+    # Opened first: the decision engine restores active blocks from it
+    alert_repository.start()
+    await decision_engine.start()
+    print(f"🔌 Inference Transport: {decision_engine.transport.name}")
+    print(f"🧱 Firewall Sync: {decision_engine.firewall.backend.name}")
+    await log_batcher.start()
+    print(f"📦 Micro-batching: up to {log_batcher.max_batch_size} logs / {log_batcher.max_wait_ms}ms")
+    
+    # Reload the newest alerts so a restart does not empty the dashboard
+    loop = asyncio.get_running_loop()
+    recent, _ = await loop.run_in_executor(None, lambda: alert_repository.query_alerts(limit=alert_store.capacity))
+    for alert in reversed(recent):
+        alert_store.add(alert)
+        session_index.record(alert)
+    print(f"💾 Alert Persistence: {alert_repository.name} ({len(recent)} alerts restored)")
+    
+    await alert_bus.start(on_bus_message)
+    print(f"📡 Alert Bus: {alert_bus.name}")
+    
+    global talker_sync_task
+    talker_sync_task = asyncio.create_task(publish_top_talkers())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers and close pooled connections"""
+    if talker_sync_task:
+        talker_sync_task.cancel()
+    await log_batcher.stop()
+    await decision_engine.close()
+    await alert_bus.close()
+    await broadcaster.close_all()
+    alert_repository.close()
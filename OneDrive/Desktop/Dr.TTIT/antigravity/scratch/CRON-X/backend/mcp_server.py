@@ -9,12 +9,34 @@ from typing import Dict, List, Optional
 import uvicorn
 from datetime import datetime
 import asyncio
+import os
 
 # Import AI detector
-from ai_detector import detector
+from ai_detector import (
+    detector, normalize_log_data, classify_prediction, predict_logs_with_features, load_detector_artifact,
+    initialize_detector, latest_artifact, serving_artifact, FEATURE_NAMES, MODEL_DIR
+)
+from inference_pool import PoolFullError, create_inference_pool
+from streaming_trainer import create_streaming_trainer
+from entity_baselines import create_entity_baselines
+from cursor_trace import CursorTrace
+from feature_schema import FEATURE_EXTRACTOR
+from ip_enrichment import ip_enricher
 
 app = FastAPI(title="MCP Anomaly Detection Server")
 
+# Model calls run here, never on the event loop
+inference_pool = create_inference_pool(initializer=load_detector_artifact)
+
+# Learns from recent normal traffic when STREAMING_TRAINING=true (else None)
+streaming_trainer = create_streaming_trainer(detector)
+
+# Per-user baselines in front of the global model (built at startup; None if ENTITY_BASELINES=false)
+entity_baselines = None
+
+# Train on sample data when no model artifact exists yet
+MODEL_AUTO_TRAIN = os.getenv("MODEL_AUTO_TRAIN", "true").lower() == "true"
+
 class LogEntry(BaseModel):
     """Log entry model"""
     timestamp: float
@@ -27,6 +49,13 @@ class LogEntry(BaseModel):
     session_duration: Optional[int] = 0
     api_calls_count: Optional[int] = 0
     failed_logins: Optional[int] = 0
+    cohort: Optional[str] = None  # Optional entity keys for ENTITY_KEYS
+    asn: Optional[str] = None
+    cursor_trace: Optional[CursorTrace] = None  # Raw cursor points (points, columnar or delta form)
+    keystroke_times: Optional[List[float]] = None  # Key press times in ms
+    velocity: Optional[Dict[str, float]] = None  # Gateway window counters (ip_events_1m, ...)
+    talkers: Optional[Dict[str, float]] = None  # Gateway sketch features (ip_distinct_users, ...)
+    network_history: Optional[Dict[str, int]] = None  # Gateway per-user network novelty (asn_new_for_user, ...)
     user_agent: Optional[str] = ""
     raw_log: Optional[str] = ""
 
@@ -37,6 +66,7 @@ class AnomalyPrediction(BaseModel):
     reason: str
     severity: str
     recommended_action: str
+    model_version: int = 0  # 0 = rule-based fallback (no trained model)
 
 @app.get("/health")
 async def health_check():
@@ -44,10 +74,51 @@ async def health_check():
     return {
         "status": "healthy",
         "model_trained": detector.is_trained,
+        "model_version": detector.version,
         "server": "MCP Anomaly Detection",
+        "worker_pid": os.getpid(),
         "timestamp": datetime.now().isoformat()
     }
 
+def _to_log_data(log: LogEntry) -> Dict:
+    """Convert a LogEntry into the dict the AI model expects"""
+    return normalize_log_data(dict(log))  # Shallow - keeps cursor_trace as a CursorTrace
+
+def _to_prediction(is_anomaly: bool, confidence: float, reason: str, model_version: int) -> AnomalyPrediction:
+    """Map a raw model output to severity and recommended action"""
+    return AnomalyPrediction(**classify_prediction(is_anomaly, confidence, reason, model_version))
+
+def _after_scoring(log_data: List[Dict], features, results: List[tuple]) -> List[tuple]:
+    """
+    Post-scoring work on the feature rows built in the pool (runs on a
+    thread: SQLite reads, trainer lock)
+
+    Warm per-entity baselines get the last word first, so events they flag
+    never enter the streaming trainer's window of normal traffic.
+    """
+    if entity_baselines:
+        active = detector.registry.active
+        results = entity_baselines.apply(
+            log_data, features, results,
+            scale=active.scaler.scale_ if active else None
+        )
+    if streaming_trainer:
+        streaming_trainer.observe(features, results)
+    return results
+
+async def _after_scoring_off_loop(log_data: List[Dict], features, results: List[tuple]) -> List[tuple]:
+    if not entity_baselines and not streaming_trainer:
+        return results
+    return await asyncio.get_running_loop().run_in_executor(None, _after_scoring, log_data, features, results)
+
+def _backpressure(error: PoolFullError) -> HTTPException:
+    """429 telling the client when to retry instead of queueing without limit"""
+    return HTTPException(
+        status_code=429,
+        detail=str(error),
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
 @app.post("/mcp/infer", response_model=AnomalyPrediction)
 async def infer_anomaly(log: LogEntry):
     """
@@ -59,48 +130,36 @@ async def infer_anomaly(log: LogEntry):
     3. Returns prediction with recommended action
     """
     try:
-        # Convert log to dict for AI model
-        log_data = {
-            'timestamp': log.timestamp,
-            'user_id': log.user_id,
-            'session_id': log.session_id,
-            'ip': log.ip,
-            'cursor_speed': log.cursor_speed or 0,
-            'keystroke_speed': log.keystroke_speed or 300,
-            'session_duration': log.session_duration or 0,
-            'api_calls_count': log.api_calls_count or 0,
-            'failed_logins': log.failed_logins or 0
-        }
-        
         # Get AI prediction
-        is_anomaly, confidence, reason = detector.predict(log_data)
+        log_data = [_to_log_data(log)]
+        results, features = await inference_pool.run(predict_logs_with_features, log_data)
+        results = await _after_scoring_off_loop(log_data, features, results)
         
-        # Determine severity based on confidence
-        if confidence > 0.8:
-            severity = "high"
-        elif confidence > 0.5:
-            severity = "medium"
-        else:
-            severity = "low"
+        return _to_prediction(*results[0])
         
-        # Determine recommended action
-        if severity == "high":
-            action = "block_ip"
-        elif severity == "medium":
-            action = "alert"
-        else:
-            action = "monitor"
+    except PoolFullError as e:
+        raise _backpressure(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"AI inference failed: {str(e)}")
+
+@app.post("/mcp/infer/batch", response_model=List[AnomalyPrediction])
+async def infer_anomaly_batch(logs: List[LogEntry]):
+    """
+    Batch MCP endpoint: score many logs with one model pass
+    
+    Predictions are returned in the same order as the input logs.
+    """
+    try:
+        log_data = [_to_log_data(log) for log in logs]
+        results, features = await inference_pool.run(predict_logs_with_features, log_data)
+        results = await _after_scoring_off_loop(log_data, features, results)
         
-        return AnomalyPrediction(
-            is_anomaly=is_anomaly,
-            confidence=round(confidence, 3),
-            reason=reason,
-            severity=severity,
-            recommended_action=action
-        )
+        return [_to_prediction(*result) for result in results]
         
+    except PoolFullError as e:
+        raise _backpressure(e)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"AI inference failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"AI batch inference failed: {str(e)}")
 
 @app.post("/mcp/train")
 async def train_model(logs: List[LogEntry]):
@@ -109,54 +168,150 @@ async def train_model(logs: List[LogEntry]):
     This allows the model to adapt to organization-specific patterns
     """
     try:
-        training_data = [
-            {
-                'timestamp': log.timestamp,
-                'cursor_speed': log.cursor_speed or 0,
-                'keystroke_speed': log.keystroke_speed or 300,
-                'session_duration': log.session_duration or 0,
-                'api_calls_count': log.api_calls_count or 0,
-                'ip': log.ip
-            }
-            for log in logs
-        ]
+        training_data = [_to_log_data(log) for log in logs]
+        
+        # Fit a new immutable version off the serving path, persist it so
+        # sibling server workers pick it up, then swap it in atomically.
+        # Requests already running finish on the version they started with.
+        loop = asyncio.get_running_loop()
+        new_version = await loop.run_in_executor(None, detector.train_and_save, training_data)
+        success = new_version is not None
         
-        success = detector.train(training_data)
+        if success:
+            # Process workers serve a memory-mapped artifact - restart them on the new one
+            inference_pool.reload((serving_artifact(),))
         
         return {
             "success": success,
             "samples_trained": len(logs),
+            "model_version": detector.version,
             "message": "Model training completed" if success else "Training failed"
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Training failed: {str(e)}")
 
+async def _watch_model_artifacts(interval: float):
+    """Load newer model artifacts saved by another worker or process"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            latest = latest_artifact()
+            if latest and latest[0] > detector.registry.latest_version:
+                detector.load(latest[1], mmap_mode="r")
+                inference_pool.reload((serving_artifact(),))
+                print(f"🔄 Worker {os.getpid()} loaded model v{detector.version}")
+        except Exception as e:
+            print(f"Model artifact reload failed: {e}")
+
+async def _streaming_refresh_loop(interval: float):
+    """Periodically rebuild part of the forest from the recent-traffic window"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            version = await loop.run_in_executor(None, streaming_trainer.refresh)
+            if version:
+                inference_pool.reload((serving_artifact(),))
+                print(f"🔁 Streaming refresh: model v{version}")
+        except Exception as e:
+            print(f"Streaming refresh failed: {e}")
+
+async def _entity_sync_loop(interval: float):
+    """Merge this worker's baseline updates with those of the other workers"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await loop.run_in_executor(None, entity_baselines.sync)
+        except Exception as e:
+            print(f"Entity baseline sync failed: {e}")
+
+@app.get("/mcp/models")
+async def list_models():
+    """Registered model versions and which one is serving"""
+    return {
+        "active_version": detector.version,
+        "versions": detector.registry.list_versions()
+    }
+
+@app.post("/mcp/models/{version}/activate")
+async def activate_model(version: int):
+    """Serve a previously registered model version (e.g. roll back a bad retrain)"""
+    try:
+        detector.registry.activate(version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    inference_pool.reload((serving_artifact(),))
+    return {"success": True, "active_version": detector.version}
+
+@app.on_event("startup")
+async def startup_event():
+    status = initialize_detector(train_if_missing=MODEL_AUTO_TRAIN)
+    print(f"📊 AI Model: {status} (v{detector.version}) from {MODEL_DIR}")
+    inference_pool.reload((serving_artifact(),))
+    inference_pool.start()
+    
+    interval = float(os.getenv("MODEL_RELOAD_INTERVAL", "5"))
+    if interval > 0:
+        asyncio.create_task(_watch_model_artifacts(interval))
+    
+    if streaming_trainer:
+        refresh_interval = float(os.getenv("STREAMING_REFRESH_INTERVAL", "300"))
+        asyncio.create_task(_streaming_refresh_loop(refresh_interval))
+    
+    # Built here rather than at import, which would create its SQLite file as a side effect
+    global entity_baselines
+    entity_baselines = create_entity_baselines(FEATURE_NAMES, MODEL_DIR)
+    if entity_baselines and entity_baselines.path and entity_baselines.sync_interval > 0:
+        asyncio.create_task(_entity_sync_loop(entity_baselines.sync_interval))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    inference_pool.shutdown()
+    if entity_baselines:
+        entity_baselines.sync()
+
 @app.get("/mcp/stats")
 async def get_stats():
     """Get MCP server and model statistics"""
     return {
         "model_trained": detector.is_trained,
         "model_type": "Isolation Forest",
-        "features_used": [
-            "login_hour",
-            "day_of_week", 
-            "cursor_speed",
-            "keystroke_speed",
-            "session_duration",
-            "api_calls",
-            "ip_score"
-        ],
+        "model_version": detector.version,
+        "model_metadata": detector.metadata,
+        "inference_pool": inference_pool.get_stats(),
+        "streaming_training": streaming_trainer.get_stats() if streaming_trainer else None,
+        "entity_baselines": entity_baselines.get_stats() if entity_baselines else None,
+        "features_used": FEATURE_EXTRACTOR.describe(),
+        "ip_enrichment": ip_enricher.get_stats(),
         "detection_capabilities": [
             "Unusual login times",
             "Abnormal typing patterns",
             "Suspicious cursor movements",
-            "Geographic anomalies",
-            "Behavioral deviations"
+            "Network anomalies (new ASN / country per user)",
+            "Brute force and credential stuffing velocity (per IP / user / session)",
+            "Distinct users tried per IP and top-talker traffic share (IP / ASN)",
+            "Behavioral deviations",
+            "Per-user baseline deviations"
         ]
     }
 
 if __name__ == "__main__":
-    print("🚀 Starting MCP Anomaly Detection Server on port 8001...")
-    print("📊 AI Model Status:", "Trained" if detector.is_trained else "Not Trained")
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    workers = int(os.getenv("MCP_WORKERS", "1"))
+    print(f"🚀 Starting MCP Anomaly Detection Server on port 8001 ({workers} worker(s))...")
+    
+    if workers > 1:
+        # Make sure an artifact exists before the workers start, so they all
+        # memory-map the same file instead of each training a model
+        status = initialize_detector(train_if_missing=MODEL_AUTO_TRAIN)
+        print(f"📊 AI Model: {status} (v{detector.version}) from {MODEL_DIR}")
+        uvicorn.run(
+            "mcp_server:app",
+            host="0.0.0.0",
+            port=8001,
+            workers=workers,
+            app_dir=os.path.dirname(os.path.abspath(__file__))
+        )
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8001)
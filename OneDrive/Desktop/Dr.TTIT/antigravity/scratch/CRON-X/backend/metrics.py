@@ -0,0 +1,36 @@
+"""
+Lightweight in-process metrics
+Fixed-bucket histograms used to tune batching and queueing behaviour
+"""
+
+import bisect
+from typing import Dict, List
+
+
+class Histogram:
+    def __init__(self, buckets: List[float]):
+        """Histogram with fixed upper bucket bounds (an overflow bucket is added)"""
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        """Record one observation"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self) -> Dict:
+        """Return bucket counts and summary statistics"""
+        buckets = {f"le_{bound:g}": n for bound, n in zip(self.buckets, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3) if self.count else 0.0,
+            "max": round(self.max, 3),
+            "buckets": buckets
+        }
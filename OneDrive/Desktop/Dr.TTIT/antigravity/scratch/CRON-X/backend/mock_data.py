@@ -1,30 +1,39 @@
 import random
 import time
 import uuid
-from typing import List
-from .models import Alert, Event, CursorPoint, StructuredReason, Note, AuditLog
+from .cursor_trace import CursorTrace
+from .ip_enrichment import ip_enricher
+from .models import Alert, Event, StructuredReason, Note, AuditLog
 
-def generate_cursor_trace(duration_ms: int = 5000) -> List[CursorPoint]:
-    points = []
+def generate_cursor_trace(duration_ms: int = 5000) -> CursorTrace:
+    ts, xs, ys = [], [], []
     t = 0
     x, y = random.randint(100, 800), random.randint(100, 600)
     while t < duration_ms:
-        points.append(CursorPoint(t=t, x=x, y=y))
+        ts.append(t)
+        xs.append(x)
+        ys.append(y)
         t += random.randint(20, 100)
         x += random.randint(-20, 20)
         y += random.randint(-20, 20)
         # Clamp
         x = max(0, min(1000, x))
         y = max(0, min(800, y))
-    return points
+    return CursorTrace(ts, xs, ys)
+
+def generate_ip() -> str:
+    # Documentation ranges covered by the bundled sample network table
+    prefix = random.choice(["192.0.2", "198.51.100", "203.0.113"])
+    return f"{prefix}.{random.randint(1, 254)}"
 
 def generate_event(user_id: str, session_id: str) -> Event:
     ts = int(time.time())
     event_type = random.choice(["cursor_move", "keystroke", "login", "api_call", "failed_auth"])
     
-    trace = []
+    trace = CursorTrace()
     if event_type == "cursor_move":
         trace = generate_cursor_trace()
+    ip = generate_ip()
     
     return Event(
         event_id=f"evt_{uuid.uuid4().hex[:8]}",
@@ -32,12 +41,12 @@ def generate_event(user_id: str, session_id: str) -> Event:
         user_id=user_id,
         session_id=session_id,
         event_type=event_type,
-        ip=f"203.0.{random.randint(1, 255)}.{random.randint(1, 255)}",
+        ip=ip,
         user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36...",
         cursor_trace=trace,
         keystroke_speed=random.randint(200, 500) if event_type == "keystroke" else None,
         raw_log=f"USER:{user_id}|TS:{ts}|TYPE:{event_type}",
-        enriched={"geo": random.choice(["US", "IN", "DE", "JP"]), "asn": f"AS{random.randint(1000, 9999)}"}
+        enriched=ip_enricher.describe(ip)
     )
 
 def generate_alert() -> Alert:
@@ -70,6 +79,3 @@ def generate_alert() -> Alert:
         audit=[],
         short_text=f"{random.choice(['Login', 'API Call', 'Access'])} from {events[0].enriched.get('geo')} + anomaly"
     )
-
-# Start with empty alerts - they will be generated in real-time
-MOCK_ALERTS: List[Alert] = []
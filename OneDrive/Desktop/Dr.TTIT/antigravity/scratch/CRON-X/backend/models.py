@@ -1,5 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
+from .cursor_trace import CursorTrace
 
 class CursorPoint(BaseModel):
     t: int
@@ -14,7 +15,7 @@ class Event(BaseModel):
     event_type: str
     ip: str
     user_agent: str
-    cursor_trace: List[CursorPoint] = []
+    cursor_trace: CursorTrace = Field(default_factory=CursorTrace)  # Also accepts a list of CursorPoint
     keystroke_speed: Optional[int] = None
     raw_log: Optional[str] = None
     enriched: Dict[str, Any] = {}
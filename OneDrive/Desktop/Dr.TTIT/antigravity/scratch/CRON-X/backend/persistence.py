@@ -0,0 +1,502 @@
+"""
+Alert Persistence
+Durable storage for alerts, their events, notes and audit entries, and
+for the active IP blocks (so a restart does not lift them):
+- none: keep alerts in memory only (the AlertStore)
+- sqlite: embedded SQLite database in WAL mode (default)
+
+Writes never touch the disk on the request path: they are queued and a
+background writer thread applies them in batches, one transaction per
+batch. With synchronous=NORMAL in WAL mode a commit only appends to the
+WAL; it is fsynced at checkpoints, so a power loss may lose the last
+batches but never corrupts the database. Reads use per-thread
+connections, which WAL lets run alongside the writer.
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from .models import Alert, AuditLog, Event, Note
+
+FILTER_COLUMNS = ("severity", "status", "user_id", "ip", "session_id")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    seq INTEGER PRIMARY KEY,  -- insertion order, same order as the AlertStore
+    alert_id TEXT NOT NULL UNIQUE,
+    created_ts INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    severity TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    ip TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+-- Single-column indexes end in seq, so filtered pages come out in seq order
+CREATE INDEX IF NOT EXISTS idx_alerts_created ON alerts (created_ts);
+CREATE INDEX IF NOT EXISTS idx_alerts_user ON alerts (user_id);
+CREATE INDEX IF NOT EXISTS idx_alerts_ip ON alerts (ip);
+CREATE INDEX IF NOT EXISTS idx_alerts_severity ON alerts (severity);
+CREATE INDEX IF NOT EXISTS idx_alerts_status ON alerts (status);
+CREATE INDEX IF NOT EXISTS idx_alerts_session ON alerts (session_id);
+
+CREATE TABLE IF NOT EXISTS events (
+    event_id TEXT PRIMARY KEY,
+    alert_id TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    session_id TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_alert ON events (alert_id);
+CREATE INDEX IF NOT EXISTS idx_events_session ON events (session_id, ts);
+
+CREATE TABLE IF NOT EXISTS notes (
+    alert_id TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    author TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_notes_alert ON notes (alert_id, ts);
+
+CREATE TABLE IF NOT EXISTS audit (
+    alert_id TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    actor TEXT NOT NULL,
+    action TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_audit_alert ON audit (alert_id, ts);
+
+CREATE TABLE IF NOT EXISTS blocks (
+    entry TEXT PRIMARY KEY,
+    deadline REAL NOT NULL
+);
+"""
+
+
+class AlertRepository:
+    """Persistence interface; this base class keeps nothing (backend "none")"""
+
+    name = "none"
+    enabled = False
+
+    def start(self):
+        """Open the store (called on app startup)"""
+
+    def close(self):
+        """Flush pending writes and close (called on app shutdown)"""
+
+    def save_alert(self, alert: Alert):
+        """Queue a new alert with its events, notes and audit entries"""
+
+    def save_note(self, alert_id: str, note: Note):
+        """Queue a note appended to an alert"""
+
+    def save_audit(self, alert_id: str, entry: AuditLog):
+        """Queue an audit entry appended to an alert"""
+
+    def update_status(self, alert_id: str, status: str):
+        """Queue an alert status change"""
+
+    def save_block(self, entry: str, deadline: float):
+        """Queue a blocklist entry (IP or CIDR) and its unblock deadline (epoch seconds)"""
+
+    def delete_block(self, entry: str):
+        """Queue the removal of a blocklist entry (unblocked, expired or merged into a prefix)"""
+
+    def load_blocks(self) -> List[Tuple[str, float]]:
+        """(entry, deadline) of every stored block"""
+        return []
+
+    def get_alert(self, alert_id: str) -> Optional[Alert]:
+        return None
+
+    def query_alerts(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        **filters: Optional[str]
+    ) -> Tuple[List[Alert], Optional[str]]:
+        return [], None
+
+    def cursor_before(self, alert_id: str, **filters: Optional[str]) -> Optional[str]:
+        """query_alerts cursor for the alerts stored before alert_id, None if none of them match filters"""
+        return None
+
+    def query_sessions(
+        self,
+        limit: int = 100,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        user_id: Optional[str] = None,
+        ip: Optional[str] = None
+    ) -> List[Dict]:
+        return []
+
+    def get_stats(self) -> Dict:
+        return {"backend": self.name}
+
+
+_STOP = object()
+
+
+class SQLiteRepository(AlertRepository):
+    """SQLite (WAL) store with a group-committing background writer"""
+
+    name = "sqlite"
+    enabled = True
+
+    def __init__(self, path: str, batch_size: int = 500, flush_interval: float = 0.05, max_queue: int = 100000):
+        """
+        Initialize the repository
+
+        The writer commits once batch_size writes are queued or
+        flush_interval seconds after the first one, whichever comes first.
+        At most max_queue writes may wait; beyond that they are dropped
+        (and counted) rather than blocking the request path.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._writer: Optional[threading.Thread] = None
+        self._local = threading.local()
+
+        self.written = 0
+        self.commits = 0
+        self.dropped = 0
+        self.last_commit_ms = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode NORMAL does not fsync on commit, only at checkpoints
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start(self):
+        """Create the schema and start the writer thread"""
+        if self._writer is not None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.close()
+        self._writer = threading.Thread(target=self._write_loop, name="alert-writer", daemon=True)
+        self._writer.start()
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._queue.put(_STOP)
+        self._writer.join()
+        self._writer = None
+
+    # ===== WRITES =====
+
+    def _enqueue(self, sql: str, params: Tuple):
+        try:
+            self._queue.put_nowait((sql, params))
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        conn = self._connect()
+        stopping = False
+        while True:
+            try:
+                # After close() only drain what is already queued
+                item = self._queue.get_nowait() if stopping else self._queue.get()
+            except queue.Empty:
+                break
+
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                timeout = 0 if stopping else deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                started = time.perf_counter()
+                try:
+                    with conn:  # One transaction per batch (no fsync until the next checkpoint)
+                        for sql, params in batch:
+                            conn.execute(sql, params)
+                    self.written += len(batch)
+                    self.commits += 1
+                except sqlite3.Error as e:
+                    print(f"Alert persistence batch failed ({len(batch)} writes): {e}")
+                self.last_commit_ms = (time.perf_counter() - started) * 1000
+        conn.close()
+
+    def save_alert(self, alert: Alert):
+        self._enqueue(
+            "INSERT OR IGNORE INTO alerts "
+            "(alert_id, created_ts, status, severity, user_id, ip, session_id, body) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                alert.alert_id, alert.created_ts, alert.status, alert.severity,
+                alert.user_id, alert.ip, alert.session_id,
+                alert.json(exclude={"events", "notes", "audit"})
+            )
+        )
+        for event in alert.events:
+            self._enqueue(
+                "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?)",
+                (
+                    event.event_id, alert.alert_id, event.ts, event.session_id,
+                    # Cursor traces are stored delta-encoded; rows with point lists still load
+                    event.model_dump_json(context={"trace_format": "delta"})
+                )
+            )
+        for note in alert.notes:
+            self.save_note(alert.alert_id, note)
+        for entry in alert.audit:
+            self.save_audit(alert.alert_id, entry)
+
+    def save_note(self, alert_id: str, note: Note):
+        self._enqueue(
+            "INSERT INTO notes VALUES (?, ?, ?, ?)",
+            (alert_id, note.ts, note.author, note.text)
+        )
+
+    def save_audit(self, alert_id: str, entry: AuditLog):
+        self._enqueue(
+            "INSERT INTO audit VALUES (?, ?, ?, ?, ?)",
+            (alert_id, entry.ts, entry.type, entry.actor, entry.action)
+        )
+
+    def update_status(self, alert_id: str, status: str):
+        self._enqueue("UPDATE alerts SET status = ? WHERE alert_id = ?", (status, alert_id))
+
+    def save_block(self, entry: str, deadline: float):
+        self._enqueue("INSERT OR REPLACE INTO blocks VALUES (?, ?)", (entry, deadline))
+
+    def delete_block(self, entry: str):
+        self._enqueue("DELETE FROM blocks WHERE entry = ?", (entry,))
+
+    # ===== READS =====
+
+    def _reader(self) -> sqlite3.Connection:
+        """Connection owned by the calling thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _hydrate(self, rows: List[Tuple]) -> List[Alert]:
+        """Build Alert models from (alert_id, status, body) rows, with children"""
+        if not rows:
+            return []
+        conn = self._reader()
+        ids = [row[0] for row in rows]
+        marks = ",".join("?" * len(ids))
+        children: Dict[str, Dict[str, list]] = {
+            alert_id: {"events": [], "notes": [], "audit": []} for alert_id in ids
+        }
+        for alert_id, body in conn.execute(
+            f"SELECT alert_id, body FROM events WHERE alert_id IN ({marks}) ORDER BY ts", ids
+        ):
+            children[alert_id]["events"].append(Event(**json.loads(body)))
+        for alert_id, ts, author, text in conn.execute(
+            f"SELECT alert_id, ts, author, text FROM notes WHERE alert_id IN ({marks}) ORDER BY ts, rowid", ids
+        ):
+            children[alert_id]["notes"].append(Note(author=author, ts=ts, text=text))
+        for alert_id, ts, type_, actor, action in conn.execute(
+            f"SELECT alert_id, ts, type, actor, action FROM audit WHERE alert_id IN ({marks}) ORDER BY ts, rowid", ids
+        ):
+            children[alert_id]["audit"].append(AuditLog(type=type_, actor=actor, action=action, ts=ts))
+
+        alerts = []
+        for alert_id, status, body in rows:
+            data = json.loads(body)
+            data["status"] = status
+            alerts.append(Alert(**data, **children[alert_id]))
+        return alerts
+
+    def load_blocks(self) -> List[Tuple[str, float]]:
+        return self._reader().execute("SELECT entry, deadline FROM blocks").fetchall()
+
+    def get_alert(self, alert_id: str) -> Optional[Alert]:
+        rows = self._reader().execute(
+            "SELECT alert_id, status, body FROM alerts WHERE alert_id = ?", (alert_id,)
+        ).fetchall()
+        alerts = self._hydrate(rows)
+        return alerts[0] if alerts else None
+
+    def query_alerts(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        **filters: Optional[str]
+    ) -> Tuple[List[Alert], Optional[str]]:
+        """
+        Newest-first page of alerts created in [since, until]
+
+        filters are FILTER_COLUMNS (None values are ignored). cursor is
+        the opaque string returned with the previous page (or by
+        cursor_before).
+        """
+        clauses, params = [], []
+        for column, value in filters.items():
+            if value is None:
+                continue
+            if column not in FILTER_COLUMNS:
+                raise ValueError(f"Cannot filter alerts by: {column}")
+            clauses.append(f"{column} = ?")
+            params.append(value)
+        if since is not None:
+            clauses.append("created_ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created_ts <= ?")
+            params.append(until)
+        if cursor:
+            try:
+                params.append(int(cursor))
+            except ValueError:
+                raise ValueError(f"Invalid cursor: {cursor}")
+            clauses.append("seq < ?")
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._reader().execute(
+            f"SELECT alert_id, status, body, seq FROM alerts {where} ORDER BY seq DESC LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = str(rows[-1][3])
+        return self._hydrate([row[:3] for row in rows]), next_cursor
+
+    def cursor_before(self, alert_id: str, **filters: Optional[str]) -> Optional[str]:
+        conn = self._reader()
+        row = conn.execute("SELECT seq FROM alerts WHERE alert_id = ?", (alert_id,)).fetchone()
+        if row is None:
+            return None
+        clauses, params = ["seq < ?"], [row[0]]
+        for column, value in filters.items():
+            if value is None:
+                continue
+            if column not in FILTER_COLUMNS:
+                raise ValueError(f"Cannot filter alerts by: {column}")
+            clauses.append(f"{column} = ?")
+            params.append(value)
+        older = conn.execute(f"SELECT 1 FROM alerts WHERE {' AND '.join(clauses)} LIMIT 1", params).fetchone()
+        return str(row[0]) if older else None
+
+    def query_sessions(
+        self,
+        limit: int = 100,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        user_id: Optional[str] = None,
+        ip: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Sessions with alerts in [since, until], most recently seen first
+
+        Rows have the same fields as the session index. ip is the IP of the
+        session's latest alert. alerts_count, first/last seen and
+        severity_counts cover the alerts in the range; ips and event_count
+        also include every event of the session. As in the index, the ip
+        filter matches event IPs too.
+        """
+        clauses, params = [], []
+        if since is not None:
+            clauses.append("created_ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created_ts <= ?")
+            params.append(until)
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        if ip is not None:
+            clauses.append(
+                "session_id IN (SELECT session_id FROM alerts WHERE ip = ? "
+                "UNION SELECT session_id FROM events WHERE json_extract(body, '$.ip') = ?)"
+            )
+            params += [ip, ip]
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._reader().execute(
+            f"SELECT session_id, user_id, "
+            f"(SELECT b.ip FROM alerts b WHERE b.session_id = a.session_id ORDER BY b.seq DESC LIMIT 1), "
+            f"GROUP_CONCAT(DISTINCT ip), "
+            f"(SELECT GROUP_CONCAT(DISTINCT json_extract(e.body, '$.ip')) FROM events e "
+            f"WHERE e.session_id = a.session_id), "
+            f"(SELECT COUNT(*) FROM events e WHERE e.session_id = a.session_id), "
+            f"MIN(created_ts), MAX(created_ts), COUNT(*), GROUP_CONCAT(severity) "
+            f"FROM alerts a {where} GROUP BY session_id ORDER BY MAX(created_ts) DESC LIMIT ?",
+            params + [limit]
+        ).fetchall()
+        return [
+            {
+                "session_id": session_id,
+                "user_id": user,
+                "ip": latest_ip,
+                "ips": sorted(set(alert_ips.split(",")) | set(event_ips.split(",") if event_ips else ())),
+                "event_count": event_count,
+                "first_seen": first_seen,
+                "last_seen": last_seen,
+                "alerts_count": alerts_count,
+                "severity_counts": dict(Counter(severities.split(",")))
+            }
+            for (
+                session_id, user, latest_ip, alert_ips, event_ips,
+                event_count, first_seen, last_seen, alerts_count, severities
+            ) in rows
+        ]
+
+    def get_stats(self) -> Dict:
+        return {
+            "backend": self.name,
+            "path": self.path,
+            "pending_writes": self._queue.qsize(),
+            "written": self.written,
+            "commits": self.commits,
+            "avg_batch": round(self.written / self.commits, 1) if self.commits else 0.0,
+            "last_commit_ms": round(self.last_commit_ms, 3),
+            "dropped": self.dropped
+        }
+
+
+def create_repository() -> AlertRepository:
+    """Build the backend selected by ALERT_DB_BACKEND"""
+    backend = os.getenv("ALERT_DB_BACKEND", "sqlite").lower()
+    if backend == "none":
+        return AlertRepository()
+    if backend == "sqlite":
+        default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cronx.db")
+        return SQLiteRepository(
+            os.getenv("ALERT_DB_PATH", default_path),
+            batch_size=int(os.getenv("ALERT_DB_BATCH_SIZE", "500")),
+            flush_interval=float(os.getenv("ALERT_DB_FLUSH_MS", "50")) / 1000,
+            max_queue=int(os.getenv("ALERT_DB_MAX_QUEUE", "100000"))
+        )
+    raise ValueError(f"Unknown alert persistence backend: {backend} (expected 'sqlite' or 'none')")
+
+
+alert_repository = create_repository()
@@ -0,0 +1,199 @@
+"""
+Prefix Set
+Compact set of blocked IPv4 / IPv6 hosts and CIDR prefixes for the
+pre-inference blocklist check:
+- each entry is stored as an int (the network bits) in a hash set per
+  prefix length, so a lookup is one hash probe per prefix length in use
+  (a handful in practice) after one inet_pton
+- hosts are aggregated automatically: once `threshold` hosts of the same
+  aggregation prefix (e.g. a /24 or a /64) are in the set, they are replaced
+  by that prefix
+- entries never overlap: adding a prefix replaces the entries inside it
+  (which is also what interval sets such as nftables' require)
+
+Entries are addressed by their canonical text form: "203.0.113.7",
+"203.0.113.0/24", "2001:db8::/64".
+"""
+
+import ipaddress
+import socket
+from typing import Dict, List, Optional, Set, Tuple
+
+_BITS = {4: 32, 6: 128}
+
+
+def parse_ip(ip: str) -> Optional[Tuple[int, int]]:
+    """(version, address as int) of an IP string, IPv4-mapped IPv6 as IPv4; None if invalid"""
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except (OSError, TypeError, ValueError):
+        pass
+    try:
+        value = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big")
+    except (OSError, TypeError, ValueError):
+        return None
+    if value >> 32 == 0xFFFF:
+        return 4, value & 0xFFFFFFFF
+    return 6, value
+
+
+def canonical_network(target: str) -> str:
+    """Canonical text form of an IP or CIDR ("1.2.3.4", "1.2.3.0/24"); raises ValueError"""
+    network = ipaddress.ip_network(target.strip(), strict=False)
+    if network.version == 6 and network.prefixlen >= 96 and int(network.network_address) >> 32 == 0xFFFF:
+        network = ipaddress.ip_network((int(network.network_address) & 0xFFFFFFFF, network.prefixlen - 96))
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+
+class PrefixSet:
+    def __init__(self, aggregate: Optional[Dict[int, Tuple[int, int]]] = None):
+        """
+        aggregate maps an IP version to (prefix length, threshold): that many
+        longer entries inside one such prefix are merged into it
+        (e.g. {4: (24, 16), 6: (64, 4)}); a threshold of 0 disables it.
+        """
+        self.aggregate = {version: rule for version, rule in (aggregate or {}).items() if rule[1] > 0}
+        self._by_len: Dict[int, Dict[int, Set[int]]] = {4: {}, 6: {}}  # version -> length -> networks
+        self._lengths: Dict[int, List[int]] = {4: [], 6: []}  # Lengths in use, shortest first
+        # version -> aggregation prefix -> (length, network) entries inside it
+        self._children: Dict[int, Dict[int, Set[Tuple[int, int]]]] = {4: {}, 6: {}}
+        self._size = 0
+        self.aggregations = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, ip: str) -> bool:
+        return self.covering(ip) is not None
+
+    @staticmethod
+    def _parse(network: str) -> Tuple[int, int, int]:
+        """(version, length, network bits) of a canonical entry"""
+        address, _, length = network.partition("/")
+        version, value = parse_ip(address)
+        length = int(length) if length else _BITS[version]
+        return version, length, value >> (_BITS[version] - length)
+
+    @staticmethod
+    def _format(version: int, length: int, bits: int) -> str:
+        value = bits << (_BITS[version] - length)
+        address = ipaddress.IPv4Address(value) if version == 4 else ipaddress.IPv6Address(value)
+        return str(address) if length == _BITS[version] else f"{address}/{length}"
+
+    def covering(self, ip: str) -> Optional[str]:
+        """The broadest entry containing an IP address (or entry), or None (also for unparsable input)"""
+        if not self._size or not ip or not isinstance(ip, str):
+            return None
+        address, _, length = ip.partition("/")
+        parsed = parse_ip(address)
+        if parsed is None:
+            return None
+        version, value = parsed
+        bits = _BITS[version]
+        try:
+            limit = int(length) if length else bits
+        except ValueError:
+            return None
+        if not 0 <= limit <= bits:
+            return None
+        by_len = self._by_len[version]
+        for entry_len in self._lengths[version]:
+            if entry_len > limit:
+                break
+            network = value >> (bits - entry_len)
+            if network in by_len[entry_len]:
+                return self._format(version, entry_len, network)
+        return None
+
+    def _insert(self, version: int, length: int, network: int):
+        by_len = self._by_len[version]
+        if length not in by_len:
+            by_len[length] = set()
+            self._lengths[version] = sorted(by_len)
+        by_len[length].add(network)
+        self._size += 1
+
+    def _discard(self, version: int, length: int, network: int) -> bool:
+        entries = self._by_len[version].get(length)
+        if not entries or network not in entries:
+            return False
+        entries.remove(network)
+        self._size -= 1
+        if not entries:
+            del self._by_len[version][length]
+            self._lengths[version] = sorted(self._by_len[version])
+        rule = self.aggregate.get(version)
+        if rule and length > rule[0]:
+            parent = network >> (length - rule[0])
+            children = self._children[version].get(parent)
+            if children:
+                children.discard((length, network))
+                if not children:
+                    del self._children[version][parent]
+        return True
+
+    def _inside(self, version: int, length: int, bits: int) -> List[Tuple[int, int]]:
+        """(length, network) of the entries inside a prefix (a scan of the longer lengths; hosts skip it)"""
+        found = []
+        for entry_len in self._lengths[version]:
+            if entry_len > length:
+                shift = entry_len - length
+                found.extend((entry_len, network) for network in self._by_len[version][entry_len] if network >> shift == bits)
+        return found
+
+    def add(self, network: str) -> Tuple[str, List[str]]:
+        """
+        Add a canonical IP / CIDR entry
+
+        Returns (entry that now covers it, entries absorbed into that entry):
+        - (network, [])               added as is
+        - (network, [...])            added; the listed entries inside it
+                                      were replaced by it
+        - (broader entry, [])         already covered, nothing added
+        - (aggregate prefix, [...])   the aggregation threshold was reached;
+                                      the listed entries were replaced by it
+        """
+        covered_by = self.covering(network)
+        if covered_by is not None:
+            return covered_by, []
+        version, length, bits = self._parse(network)
+        inside = self._inside(version, length, bits)
+        for child_len, child in inside:
+            self._discard(version, child_len, child)
+        self._insert(version, length, bits)
+        replaced = [self._format(version, child_len, child) for child_len, child in inside]
+
+        rule = self.aggregate.get(version)
+        if not rule or length <= rule[0]:
+            return network, replaced
+        agg_len, threshold = rule
+        parent = bits >> (length - agg_len)
+        children = self._children[version].setdefault(parent, set())
+        children.add((length, bits))
+        if len(children) < threshold:
+            return network, replaced
+
+        absorbed = replaced + [self._format(version, child_len, child) for child_len, child in children]
+        for child_len, child in list(children):
+            self._discard(version, child_len, child)
+        self._insert(version, agg_len, parent)
+        self.aggregations += 1
+        return self._format(version, agg_len, parent), absorbed
+
+    def remove(self, network: str) -> bool:
+        """Remove an entry exactly as added (removing a host inside a prefix does nothing)"""
+        try:
+            version, length, bits = self._parse(network)
+        except (TypeError, ValueError, KeyError):
+            return False
+        return self._discard(version, length, bits)
+
+    def get_stats(self) -> Dict:
+        return {
+            "entries": self._size,
+            "ipv4_prefix_lengths": self._lengths[4],
+            "ipv6_prefix_lengths": self._lengths[6],
+            "aggregations": self.aggregations
+        }
@@ -0,0 +1,242 @@
+"""
+Pub/Sub Bus
+Carries alert events between API worker processes so that a dashboard
+connected to one worker sees alerts raised in another:
+- memory: peers inside one process only (single worker, tests)
+- unix: a local broker on a Unix domain socket for several workers on one
+  host. The first worker to take the lock file runs the broker; if it dies
+  another worker takes over and everyone reconnects.
+
+A bus delivers each published message to every *other* peer; the
+publisher handles its own copy directly. A networked broker (e.g. Redis)
+only has to implement start / publish / close.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import uuid
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+Handler = Callable[[str, Dict], Awaitable[None]]
+
+
+class MessageBus(ABC):
+    """Interface implemented by every bus backend"""
+
+    name = "base"
+
+    def __init__(self):
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._handler: Optional[Handler] = None
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+
+    async def start(self, handler: Handler):
+        """Begin delivering messages from other peers to handler(channel, message)"""
+        self._handler = handler
+
+    @abstractmethod
+    async def publish(self, channel: str, message: Dict):
+        """Send a message to every other peer (never blocks on slow peers)"""
+
+    async def close(self):
+        """Stop receiving and release resources"""
+
+    async def _deliver(self, channel: str, message: Dict):
+        if self._handler is None:
+            return
+        self.received += 1
+        try:
+            await self._handler(channel, message)
+        except Exception as e:
+            print(f"Bus handler failed for {channel}: {e}")
+
+    def get_stats(self) -> Dict:
+        return {
+            "backend": self.name,
+            "origin": self.origin,
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped
+        }
+
+
+class InMemoryBus(MessageBus):
+    """Peers are the other InMemoryBus instances in this process"""
+
+    name = "memory"
+    _peers: Set["InMemoryBus"] = set()
+
+    async def start(self, handler: Handler):
+        await super().start(handler)
+        InMemoryBus._peers.add(self)
+
+    async def publish(self, channel: str, message: Dict):
+        self.published += 1
+        for peer in list(InMemoryBus._peers):
+            if peer is not self:
+                await peer._deliver(channel, message)
+
+    async def close(self):
+        InMemoryBus._peers.discard(self)
+
+
+class UnixSocketBus(MessageBus):
+    """Newline-delimited JSON over a Unix socket, relayed by an elected local broker"""
+
+    name = "unix"
+
+    def __init__(self, path: str, reconnect_delay: float = 0.5, max_buffer: int = 4 * 1024 * 1024):
+        """
+        Initialize the bus
+
+        path is the broker socket; path + ".lock" elects the broker. A peer
+        whose unsent data exceeds max_buffer bytes loses messages instead
+        of stalling the publisher.
+        """
+        if sys.platform == "win32":
+            raise RuntimeError("The unix alert bus needs Unix domain sockets - use ALERT_BUS=memory on Windows")
+        super().__init__()
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self.max_buffer = max_buffer
+
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: List[asyncio.StreamWriter] = []  # broker side
+        self._writer: Optional[asyncio.StreamWriter] = None  # client side
+        self._task: Optional[asyncio.Task] = None
+        self.reconnects = 0
+
+    @property
+    def is_broker(self) -> bool:
+        return self._server is not None
+
+    async def start(self, handler: Handler):
+        await super().start(handler)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    # ===== BROKER =====
+
+    async def _try_become_broker(self):
+        """Take the lock file and serve the socket, unless another worker holds it"""
+        import fcntl
+
+        if self._server is not None:
+            return
+        fd = os.open(self.path + ".lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return
+        self._lock_fd = fd
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # Left behind by a broker that died
+        self._server = await asyncio.start_unix_server(self._serve_peer, path=self.path)
+        print(f"📡 Alert bus broker running in worker {os.getpid()} on {self.path}")
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.append(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for peer in self._peers:
+                    if peer is writer:
+                        continue
+                    if peer.transport.get_write_buffer_size() > self.max_buffer:
+                        self.dropped += 1
+                        continue
+                    peer.write(line)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass  # Peer went away or the broker is shutting down
+        finally:
+            self._peers.remove(writer)
+            writer.close()
+
+    # ===== PEER =====
+
+    async def _run(self):
+        """Connect to the broker (electing one if needed) and read until closed"""
+        while True:
+            try:
+                await self._try_become_broker()
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=self.max_buffer)
+            except (OSError, ConnectionError):
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+
+            self._writer = writer
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    envelope = json.loads(line)
+                    if envelope.get("origin") != self.origin:
+                        await self._deliver(envelope["channel"], envelope["message"])
+            except (ConnectionError, ValueError, asyncio.LimitOverrunError) as e:
+                print(f"Alert bus connection lost: {e}")
+            finally:
+                self._writer = None
+                writer.close()
+            self.reconnects += 1
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def publish(self, channel: str, message: Dict):
+        writer = self._writer
+        if writer is None or writer.transport.get_write_buffer_size() > self.max_buffer:
+            self.dropped += 1
+            return
+        envelope = {"origin": self.origin, "channel": channel, "message": message}
+        writer.write(json.dumps(envelope, separators=(",", ":"), default=str).encode() + b"\n")
+        self.published += 1
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._server is not None:
+            self._server.close()
+            for peer in list(self._peers):
+                peer.close()
+            self._server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def get_stats(self) -> Dict:
+        stats = super().get_stats()
+        stats.update({
+            "path": self.path,
+            "connected": self._writer is not None,
+            "is_broker": self.is_broker,
+            "broker_peers": len(self._peers),
+            "reconnects": self.reconnects
+        })
+        return stats
+
+
+def create_bus() -> MessageBus:
+    """Build the bus selected by ALERT_BUS"""
+    backend = os.getenv("ALERT_BUS", "memory").lower()
+    if backend == "memory":
+        return InMemoryBus()
+    if backend == "unix":
+        return UnixSocketBus(os.getenv("ALERT_BUS_PATH", "/tmp/cronx-alert-bus.sock"))
+    raise ValueError(f"Unknown alert bus: {backend} (expected 'memory' or 'unix')")
+
+
+alert_bus = create_bus()
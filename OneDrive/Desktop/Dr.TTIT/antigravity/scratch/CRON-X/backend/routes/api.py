@@ -1,61 +1,147 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Response
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
 from ..models import Alert, ChatQuery, ChatResponse, Note, AuditLog
-from ..mock_data import MOCK_ALERTS
+from ..cursor_trace import TRACE_FORMATS
+from ..alert_store import alert_store
+from ..persistence import alert_repository
+from ..session_index import session_index
+from ..broadcaster import publish_alert_update
 import time
 
 router = APIRouter()
 
+TRACE_FORMAT_PATTERN = "^(" + "|".join(TRACE_FORMATS) + ")$"
+
+def _compact_response(body, trace_format: str) -> Response:
+    """Serialise alerts with columnar or delta-encoded cursor traces"""
+    context = {"trace_format": trace_format}
+    if isinstance(body, list):
+        content = "[" + ",".join(alert.model_dump_json(context=context) for alert in body) + "]"
+    else:
+        content = body.model_dump_json(context=context)
+    return Response(content=content, media_type="application/json")
+
 @router.get("/alerts", response_model=List[Alert])
-async def get_alerts(limit: int = 50, severity: Optional[str] = None, status: Optional[str] = None):
-    filtered = MOCK_ALERTS
-    if severity:
-        filtered = [a for a in filtered if a.severity == severity]
-    if status:
-        filtered = [a for a in filtered if a.status == status]
-    return filtered[:limit]
+async def get_alerts(
+    response: Response,
+    limit: int = Query(50, ge=1, le=1000),
+    severity: Optional[str] = None,
+    status: Optional[str] = None,
+    user_id: Optional[str] = None,
+    ip: Optional[str] = None,
+    session_id: Optional[str] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    cursor: Optional[str] = None,
+    trace_format: str = Query("points", pattern=TRACE_FORMAT_PATTERN)
+):
+    """
+    Newest alerts first, filtered by any combination of indexed fields
+
+    Recent alerts are served from memory. A time range (since/until,
+    unix seconds) or paging past the in-memory window reads persistent
+    storage. When more alerts match, the X-Next-Cursor header holds the
+    cursor for the next page. trace_format=columnar or delta returns
+    cursor traces as parallel arrays or base64 delta-encoded binary.
+    """
+    filters = dict(severity=severity, status=status, user_id=user_id, ip=ip, session_id=session_id)
+    use_db = alert_repository.enabled and (
+        since is not None or until is not None or (cursor or "").startswith("db:")
+    )
+    try:
+        if not use_db:
+            alerts, next_cursor = alert_store.query(limit=limit, cursor=cursor, **filters)
+            if next_cursor is None and alert_repository.enabled:
+                # Older matching alerts may only live in persistent storage (evicted,
+                # or never reloaded after a restart) - continue there
+                reference = alerts[-1] if alerts else alert_store.oldest()
+                older = reference and await run_in_threadpool(
+                    alert_repository.cursor_before, reference.alert_id, **filters
+                )
+                if alerts:
+                    next_cursor = older and f"db:{older}"
+                elif older or reference is None:
+                    use_db = True
+                    cursor = older and f"db:{older}"
+        if use_db:
+            alerts, next_cursor = await run_in_threadpool(
+                alert_repository.query_alerts,
+                limit=limit, cursor=(cursor or "")[3:] or None, since=since, until=until, **filters
+            )
+            next_cursor = next_cursor and f"db:{next_cursor}"
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if trace_format != "points":
+        response = _compact_response(alerts, trace_format)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if trace_format != "points":
+        return response
+    return alerts
+
+async def _get_alert_or_404(alert_id: str) -> Alert:
+    """Look in memory first, then in persistent storage"""
+    alert = alert_store.get(alert_id)
+    if alert is None and alert_repository.enabled:
+        alert = await run_in_threadpool(alert_repository.get_alert, alert_id)
+    if alert is None:
+        raise HTTPException(status_code=404, detail="Alert not found")
+    return alert
+
+def _set_status(alert: Alert, status: str):
+    alert_store.set_status(alert, status)
+    alert_repository.update_status(alert.alert_id, status)
+
+def _add_note(alert: Alert, note: Note):
+    alert.notes.append(note)
+    alert_repository.save_note(alert.alert_id, note)
+
+def _add_audit(alert: Alert, entry: AuditLog):
+    alert.audit.append(entry)
+    alert_repository.save_audit(alert.alert_id, entry)
 
 @router.get("/alerts/{alert_id}", response_model=Alert)
-async def get_alert_detail(alert_id: str):
-    for alert in MOCK_ALERTS:
-        if alert.alert_id == alert_id:
-            return alert
-    raise HTTPException(status_code=404, detail="Alert not found")
+async def get_alert_detail(alert_id: str, trace_format: str = Query("points", pattern=TRACE_FORMAT_PATTERN)):
+    alert = await _get_alert_or_404(alert_id)
+    if trace_format != "points":
+        return _compact_response(alert, trace_format)
+    return alert
 
 @router.post("/alerts/{alert_id}/ack", response_model=Alert)
 async def ack_alert(alert_id: str, body: dict):
-    for alert in MOCK_ALERTS:
-        if alert.alert_id == alert_id:
-            alert.status = "acknowledged"
-            if body.get("note"):
-                alert.notes.append(Note(author=body["actor"], ts=int(time.time()), text=body["note"]))
-            alert.audit.append(AuditLog(
-                type="action",
-                actor=body.get("actor", "user"),
-                action="acknowledged",
-                ts=int(time.time())
-            ))
-            return alert
-    raise HTTPException(status_code=404, detail="Alert not found")
+    alert = await _get_alert_or_404(alert_id)
+    previous_status, notes_from, audit_from = alert.status, len(alert.notes), len(alert.audit)
+    _set_status(alert, "acknowledged")
+    if body.get("note"):
+        _add_note(alert, Note(author=body["actor"], ts=int(time.time()), text=body["note"]))
+    _add_audit(alert, AuditLog(
+        type="action",
+        actor=body.get("actor", "user"),
+        action="acknowledged",
+        ts=int(time.time())
+    ))
+    await publish_alert_update(alert, previous_status, notes_from, audit_from)
+    return alert
 
 @router.post("/alerts/{alert_id}/override")
 async def override_alert(alert_id: str, body: dict):
-    for alert in MOCK_ALERTS:
-        if alert.alert_id == alert_id:
-            alert.audit.append(AuditLog(
-                type="override",
-                actor=body.get("actor", "user"),
-                action=body.get("action", "false_positive"),
-                ts=int(time.time())
-            ))
-            alert.status = "resolved"
-            alert.notes.append(Note(
-                author=body.get("actor", "user"),
-                ts=int(time.time()),
-                text=f"Override: {body.get('reason', 'False positive')}"
-            ))
-            return {"success": True, "message": "Alert overridden successfully"}
-    raise HTTPException(status_code=404, detail="Alert not found")
+    alert = await _get_alert_or_404(alert_id)
+    previous_status, notes_from, audit_from = alert.status, len(alert.notes), len(alert.audit)
+    _add_audit(alert, AuditLog(
+        type="override",
+        actor=body.get("actor", "user"),
+        action=body.get("action", "false_positive"),
+        ts=int(time.time())
+    ))
+    _set_status(alert, "resolved")
+    _add_note(alert, Note(
+        author=body.get("actor", "user"),
+        ts=int(time.time()),
+        text=f"Override: {body.get('reason', 'False positive')}"
+    ))
+    await publish_alert_update(alert, previous_status, notes_from, audit_from)
+    return {"success": True, "message": "Alert overridden successfully"}
 
 @router.post("/chat")
 async def chat(query: ChatQuery):
@@ -84,14 +170,14 @@ async def chat(query: ChatQuery):
     references = []
     
     if "high" in query_lower or "critical" in query_lower:
-        relevant_alerts = [a for a in MOCK_ALERTS if a.severity == "high"][:3]
+        relevant_alerts = alert_store.recent(3, severity="high")
     elif "user" in query_lower or "tok" in query_lower:
         # Extract user ID if present
-        for alert in MOCK_ALERTS[:5]:
+        for alert in alert_store.recent(5):
             if any(word in query_lower for word in [alert.user_id.lower(), "user"]):
                 relevant_alerts.append(alert)
     else:
-        relevant_alerts = MOCK_ALERTS[:3]
+        relevant_alerts = alert_store.recent(3)
     
     references = [a.alert_id for a in relevant_alerts]
     
@@ -124,25 +210,33 @@ async def chat(query: ChatQuery):
     )
 
 @router.get("/sessions")
-async def get_sessions():
-    """Get active sessions from alerts"""
-    sessions = {}
-    for alert in MOCK_ALERTS:
-        if alert.session_id not in sessions:
-            sessions[alert.session_id] = {
-                "session_id": alert.session_id,
-                "user_id": alert.user_id,
-                "ip": alert.ip,
-                "event_count": len(alert.events),
-                "last_seen": alert.created_ts,
-                "alerts_count": 1
-            }
-        else:
-            sessions[alert.session_id]["alerts_count"] += 1
-            if alert.created_ts > sessions[alert.session_id]["last_seen"]:
-                sessions[alert.session_id]["last_seen"] = alert.created_ts
+async def get_sessions(
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    sort_by: str = "last_seen",
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    user_id: Optional[str] = None,
+    ip: Optional[str] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None
+):
+    """
+    Get active sessions from the incrementally maintained session index
+
+    A time range (since/until, unix seconds) queries persistent storage
+    instead, which also covers sessions that have expired from the index.
+    """
+    if alert_repository.enabled and (since is not None or until is not None):
+        return await run_in_threadpool(
+            alert_repository.query_sessions, limit=limit, since=since, until=until, user_id=user_id, ip=ip
+        )
     
-    return list(sessions.values())
+    try:
+        return session_index.query(
+            limit=limit, offset=offset, sort_by=sort_by, descending=order == "desc", user_id=user_id, ip=ip
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/config/email")
 async def get_email_config():
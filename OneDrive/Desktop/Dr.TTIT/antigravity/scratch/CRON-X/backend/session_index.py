@@ -0,0 +1,187 @@
+"""
+Session Index
+Per-session summaries kept up to date as alerts are created, so listing
+sessions never rescans alert history:
+- counters, first/last seen, event count and the IPs seen per session
+- sessions idle for longer than the TTL are evicted (oldest first)
+- filter by user or IP, sort and paginate
+"""
+
+import heapq
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from .models import Alert
+
+SORT_FIELDS = ("last_seen", "first_seen", "alerts_count", "event_count")
+
+
+@dataclass
+class SessionSummary:
+    session_id: str
+    user_id: str
+    ip: str  # Most recent IP
+    first_seen: int
+    last_seen: int
+    alerts_count: int = 0
+    event_count: int = 0
+    ips: Set[str] = field(default_factory=set)
+    severity_counts: Dict[str, int] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict:
+        return {
+            "session_id": self.session_id,
+            "user_id": self.user_id,
+            "ip": self.ip,
+            "ips": sorted(self.ips),
+            "event_count": self.event_count,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "alerts_count": self.alerts_count,
+            "severity_counts": self.severity_counts
+        }
+
+
+class SessionIndex:
+    def __init__(self, ttl_seconds: int = 3600, max_sessions: int = 100000):
+        """
+        Initialize the index
+
+        Sessions without a new alert for ttl_seconds (by server receive
+        time) are dropped; at most
+        max_sessions are kept (least recently seen dropped first).
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        # Least recently seen first, so expiry only ever looks at the front
+        self._sessions: "OrderedDict[str, SessionSummary]" = OrderedDict()
+        self._by_user: Dict[str, Set[str]] = {}
+        self._by_ip: Dict[str, Set[str]] = {}
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def record(self, alert: Alert, seen_at: Optional[float] = None):
+        """
+        Fold a new alert into its session's summary
+
+        first_seen / last_seen and the TTL use the server's receive time
+        (seen_at, default now) rather than the client-supplied created_ts,
+        so backdated or clock-skewed logs are not expired on arrival.
+        Receive times only move forward, so moving the session to the end
+        keeps the index ordered by last_seen.
+        """
+        seen_at = int(seen_at if seen_at is not None else time.time())
+        session = self._sessions.get(alert.session_id)
+        if session is None:
+            session = SessionSummary(
+                session_id=alert.session_id,
+                user_id=alert.user_id,
+                ip=alert.ip,
+                first_seen=seen_at,
+                last_seen=seen_at
+            )
+            self._sessions[alert.session_id] = session
+            self._by_user.setdefault(alert.user_id, set()).add(alert.session_id)
+        else:
+            self._sessions.move_to_end(alert.session_id)
+
+        session.alerts_count += 1
+        session.event_count += len(alert.events)
+        session.last_seen = max(session.last_seen, seen_at)
+        session.severity_counts[alert.severity] = session.severity_counts.get(alert.severity, 0) + 1
+        session.ip = alert.ip
+        for ip in {alert.ip, *(event.ip for event in alert.events)}:
+            if ip not in session.ips:
+                session.ips.add(ip)
+                self._by_ip.setdefault(ip, set()).add(alert.session_id)
+
+        while len(self._sessions) > self.max_sessions:
+            self._evict_oldest()
+        self.expire()
+
+    def _evict_oldest(self):
+        session_id, session = self._sessions.popitem(last=False)
+        self._discard(self._by_user, session.user_id, session_id)
+        for ip in session.ips:
+            self._discard(self._by_ip, ip, session_id)
+        self.evicted += 1
+
+    @staticmethod
+    def _discard(index: Dict[str, Set[str]], key: str, session_id: str):
+        members = index.get(key)
+        if members is not None:
+            members.discard(session_id)
+            if not members:
+                del index[key]
+
+    def expire(self, now: Optional[float] = None):
+        """Drop sessions idle for longer than the TTL"""
+        cutoff = (now if now is not None else time.time()) - self.ttl_seconds
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest.last_seen >= cutoff:
+                break
+            self._evict_oldest()
+
+    def query(
+        self,
+        limit: int = 100,
+        offset: int = 0,
+        sort_by: str = "last_seen",
+        descending: bool = True,
+        user_id: Optional[str] = None,
+        ip: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        One page of active sessions
+
+        Cost depends on the number of active sessions (or those of the
+        given user / IP), never on how many alerts have been seen.
+        """
+        if sort_by not in SORT_FIELDS:
+            raise ValueError(f"Cannot sort sessions by: {sort_by} (expected one of {', '.join(SORT_FIELDS)})")
+        self.expire()
+
+        if user_id is not None or ip is not None:
+            ids = None
+            if user_id is not None:
+                ids = set(self._by_user.get(user_id, ()))
+            if ip is not None:
+                by_ip = self._by_ip.get(ip, set())
+                ids = by_ip if ids is None else ids & by_ip
+            candidates = [self._sessions[session_id] for session_id in ids]
+        elif sort_by == "last_seen":
+            # Already ordered by recency - walk from the right end
+            values = reversed(self._sessions.values()) if descending else iter(self._sessions.values())
+            page = []
+            for i, session in enumerate(values):
+                if i >= offset + limit:
+                    break
+                if i >= offset:
+                    page.append(session.to_dict())
+            return page
+        else:
+            candidates = self._sessions.values()
+
+        key = lambda session: getattr(session, sort_by)
+        select = heapq.nlargest if descending else heapq.nsmallest
+        return [session.to_dict() for session in select(offset + limit, candidates, key=key)[offset:]]
+
+    def get_stats(self) -> Dict:
+        return {
+            "active_sessions": len(self._sessions),
+            "ttl_seconds": self.ttl_seconds,
+            "max_sessions": self.max_sessions,
+            "evicted": self.evicted
+        }
+
+
+session_index = SessionIndex(
+    ttl_seconds=int(os.getenv("SESSION_TTL_SECONDS", "3600")),
+    max_sessions=int(os.getenv("SESSION_INDEX_MAX", "100000"))
+)
@@ -0,0 +1,441 @@
+"""
+Stream Sketches
+Fixed-memory summaries of the event stream for credential-stuffing
+detection, all mergeable across API workers:
+- HyperLogLog: approximate distinct count (e.g. user_ids tried from one IP)
+  in 2^p one-byte registers; merging takes the register-wise max, so the
+  union of several workers' sketches counts each user once
+- SpaceSaving: the k heaviest items of a stream (top IPs / ASNs) with a
+  per-item overestimate bound; summaries merge by adding counts, charging
+  an item a summary does not hold that summary's minimum count
+
+TopTalkers feeds them from the gateway: events per IP and ASN, alerts and
+blocks per IP (from the decision engine) and distinct users per IP. Top-K
+summaries cover the current and previous window of window_seconds (so
+"right now" is the last one to two windows); per-IP distinct users cover the
+IP's current burst of activity, reset once it has been idle for a window.
+Items are hashed with blake2b rather than hash(), whose per-process seed
+would make sketches from different workers incompatible.
+"""
+
+import base64
+import hashlib
+import heapq
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Per-event features taken from the TopTalkers summaries (the log's "talkers" block)
+TALKER_FEATURE_NAMES = ["ip_distinct_users", "ip_traffic_share", "asn_traffic_share"]
+
+# Traffic shares are of at least this many events, so the first events
+# after startup or a quiet period do not each look like all the traffic
+MIN_SHARE_EVENTS = 100
+
+
+def talker_features(talkers: Optional[Dict]) -> Dict[str, float]:
+    """The TALKER_FEATURE_NAMES values of a log's talkers block (0 when missing)"""
+    talkers = talkers or {}
+    return {name: talkers.get(name) or 0 for name in TALKER_FEATURE_NAMES}
+
+
+def _hash64(item: str) -> int:
+    return int.from_bytes(hashlib.blake2b(item.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "big")
+
+
+def _sigma(x: float) -> float:
+    if x == 1.0:
+        return math.inf
+    y, z = 1.0, x
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if z == previous:
+            return z
+
+
+def _tau(x: float) -> float:
+    if x == 0.0 or x == 1.0:
+        return 0.0
+    y, z = 1.0, 1.0 - x
+    while True:
+        x = math.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1.0 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+
+class HyperLogLog:
+    """Distinct count of a stream of strings; relative error about 1.04 / sqrt(2^p)"""
+
+    __slots__ = ("p", "registers", "_histogram", "_estimate")
+
+    def __init__(self, p: int = 10, registers: Optional[bytes] = None):
+        if not 4 <= p <= 16:
+            raise ValueError(f"HyperLogLog precision must be 4-16, got {p}")
+        self.p = p
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << p)
+        if len(self.registers) != 1 << p:
+            raise ValueError(f"Expected {1 << p} registers, got {len(self.registers)}")
+        self._count_registers()
+
+    def _count_registers(self):
+        # Registers per value, kept up to date by add() so count() never scans the registers
+        self._histogram = [0] * (66 - self.p)
+        for rank in self.registers:
+            self._histogram[rank] += 1
+        self._estimate: Optional[int] = None  # Cached until a register changes
+
+    def add(self, item: str) -> bool:
+        """Add an item; True if the sketch changed"""
+        x = _hash64(item)
+        rest_bits = 64 - self.p
+        index = x >> rest_bits
+        rank = rest_bits - (x & ((1 << rest_bits) - 1)).bit_length() + 1
+        old = self.registers[index]
+        if rank > old:
+            self.registers[index] = rank
+            self._histogram[old] -= 1
+            self._histogram[rank] += 1
+            self._estimate = None
+            return True
+        return False
+
+    def count(self) -> int:
+        """Estimated number of distinct items added (Ertl's improved estimator, no bias tables)"""
+        if self._estimate is None:
+            m = len(self.registers)
+            q = 64 - self.p
+            histogram = self._histogram
+            z = m * _tau(1 - histogram[q + 1] / m)
+            for k in range(q, 0, -1):
+                z = 0.5 * (z + histogram[k])
+            z += m * _sigma(histogram[0] / m)
+            self._estimate = int(round(m * m / (2 * math.log(2) * z)))
+        return self._estimate
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        """Fold other into this sketch (the union of both streams) and return self"""
+        if other.p != self.p:
+            raise ValueError(f"Cannot merge HyperLogLog of precision {other.p} into {self.p}")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        self._count_registers()
+        return self
+
+    def copy(self) -> "HyperLogLog":
+        return HyperLogLog(self.p, self.registers)
+
+    def to_dict(self) -> Dict:
+        return {"p": self.p, "registers": base64.b64encode(bytes(self.registers)).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "HyperLogLog":
+        return cls(int(data["p"]), base64.b64decode(data["registers"]))
+
+
+class SpaceSaving:
+    """
+    Top-k heavy hitters of a stream
+
+    Every item's count is an overestimate by at most its error; any item
+    occurring more than total / k times is guaranteed to be held.
+    """
+
+    def __init__(self, k: int = 100):
+        self.k = k
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.total = 0
+        self._heap: List[Tuple[int, str]] = []  # (count, item); stale entries skipped lazily
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def add(self, item: str, n: int = 1):
+        self.total += n
+        count = self.counts.get(item)
+        if count is None:
+            error = 0
+            if len(self.counts) >= self.k:
+                # Replace the item with the smallest count and inherit it as error
+                error, evicted = self._pop_min()
+                del self.counts[evicted]
+                del self.errors[evicted]
+            count = error
+            self.errors[item] = error
+        count += n
+        self.counts[item] = count
+        heapq.heappush(self._heap, (count, item))
+        if len(self._heap) > 4 * self.k + 64:
+            self._heap = [(c, i) for i, c in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self) -> Tuple[int, str]:
+        heap = self._heap
+        while True:
+            count, item = heapq.heappop(heap)
+            if self.counts.get(item) == count:
+                return count, item
+
+    def min_count(self) -> int:
+        """Count an item not held may have (0 while the summary is not full)"""
+        return min(self.counts.values()) if len(self.counts) >= self.k else 0
+
+    def estimate(self, item: str) -> int:
+        return self.counts.get(item, 0)
+
+    def top(self, n: Optional[int] = None) -> List[Tuple[str, int, int]]:
+        """(item, count, error) of the n heaviest items, heaviest first"""
+        ranked = sorted(self.counts.items(), key=lambda kv: (-kv[1], kv[0]))
+        return [(item, count, self.errors[item]) for item, count in ranked[:n]]
+
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        """Fold other into this summary (the combined stream) and return self"""
+        own_min, other_min = self.min_count(), other.min_count()
+        merged = {}
+        for item in self.counts.keys() | other.counts.keys():
+            count = self.counts.get(item, own_min) + other.counts.get(item, other_min)
+            error = self.errors.get(item, own_min) + other.errors.get(item, other_min)
+            merged[item] = (count, error)
+        kept = sorted(merged.items(), key=lambda kv: (-kv[1][0], kv[0]))[:self.k]
+        self.counts = {item: count for item, (count, _) in kept}
+        self.errors = {item: error for item, (_, error) in kept}
+        self.total += other.total
+        self._heap = [(c, i) for i, c in self.counts.items()]
+        heapq.heapify(self._heap)
+        return self
+
+    def copy(self) -> "SpaceSaving":
+        summary = SpaceSaving(self.k)
+        return summary.merge(self)
+
+    def to_dict(self) -> Dict:
+        return {
+            "k": self.k,
+            "total": self.total,
+            "items": [[item, count, error] for item, count, error in self.top()]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SpaceSaving":
+        summary = cls(int(data["k"]))
+        for item, count, error in data["items"]:
+            summary.counts[item] = int(count)
+            summary.errors[item] = int(error)
+        summary.total = int(data["total"])
+        summary._heap = [(c, i) for i, c in summary.counts.items()]
+        heapq.heapify(summary._heap)
+        return summary
+
+
+class TalkerWindow:
+    """Summaries of one window of traffic"""
+
+    __slots__ = ("ips", "asns", "offenders", "distinct_ips", "distinct_users")
+
+    def __init__(self, k: int, p: int):
+        self.ips = SpaceSaving(k)        # events per IP
+        self.asns = SpaceSaving(k)       # events per ASN
+        self.offenders = SpaceSaving(k)  # alerts and blocks per IP
+        self.distinct_ips = HyperLogLog(p)
+        self.distinct_users = HyperLogLog(p)
+
+
+class TopTalkers:
+    def __init__(
+        self,
+        k: int = 100,
+        window_seconds: float = 300,
+        precision: int = 12,
+        ip_precision: int = 8,
+        max_ips: int = 20000,
+        asn_of: Optional[Callable[[str], str]] = None
+    ):
+        """
+        Track the k top IPs / ASNs / offenders and distinct users per IP
+
+        precision and ip_precision are the HyperLogLog precisions of the
+        global and per-IP distinct counters; at most max_ips per-IP counters
+        are kept (least recently active dropped first). asn_of names the
+        ASN of an IP for logs that carry none.
+        """
+        self.k = k
+        self.window_seconds = window_seconds
+        self.precision = precision
+        self.ip_precision = ip_precision
+        self.max_ips = max_ips
+        self.asn_of = asn_of
+        self._epoch = int(time.time() // window_seconds)
+        self._current = TalkerWindow(k, precision)
+        self._previous = TalkerWindow(k, precision)
+        # ip -> (last seen, distinct users of its current burst)
+        self._ip_users: "OrderedDict[str, Tuple[float, HyperLogLog]]" = OrderedDict()
+        # worker origin -> (received at, exported snapshot)
+        self._peers: Dict[str, Tuple[float, Dict]] = {}
+        self._lock = threading.Lock()
+
+        self.recorded = 0
+        self.actions = 0
+        self.evicted = 0
+
+    def _rotate(self, now: float):
+        epoch = int(now // self.window_seconds)
+        if epoch == self._epoch:
+            return
+        self._previous = self._current if epoch == self._epoch + 1 else TalkerWindow(self.k, self.precision)
+        self._current = TalkerWindow(self.k, self.precision)
+        self._epoch = epoch
+
+    def _share(self, attribute: str, item: str) -> float:
+        current, previous = getattr(self._current, attribute), getattr(self._previous, attribute)
+        events = current.estimate(item) + previous.estimate(item)
+        return round(events / max(current.total + previous.total, MIN_SHARE_EVENTS), 4)
+
+    def record(self, log: Dict, now: Optional[float] = None) -> Dict[str, float]:
+        """Count one event and return its talkers block (values include this event)"""
+        now = time.time() if now is None else now
+        ip = log.get('ip')
+        user_id = log.get('user_id')
+        asn = log.get('asn') or (self.asn_of(ip) if self.asn_of and ip else None)
+        talkers = dict.fromkeys(TALKER_FEATURE_NAMES, 0)
+        with self._lock:
+            self.recorded += 1
+            self._rotate(now)
+            window = self._current
+            if user_id:
+                window.distinct_users.add(str(user_id))
+            if asn:
+                window.asns.add(str(asn))
+                talkers["asn_traffic_share"] = self._share("asns", str(asn))
+            if not ip:
+                return talkers
+            ip = str(ip)
+            window.ips.add(ip)
+            window.distinct_ips.add(ip)
+            talkers["ip_traffic_share"] = self._share("ips", ip)
+
+            seen = self._ip_users.pop(ip, None)
+            if seen is None or now - seen[0] > self.window_seconds:
+                users = HyperLogLog(self.ip_precision)
+            else:
+                users = seen[1]
+            if user_id:
+                users.add(str(user_id))
+            self._ip_users[ip] = (now, users)
+            if len(self._ip_users) > self.max_ips:
+                self._ip_users.popitem(last=False)
+                self.evicted += 1
+            talkers["ip_distinct_users"] = users.count()
+        return talkers
+
+    def record_action(self, ip: Optional[str], action: str, now: Optional[float] = None):
+        """Count an alert or block raised against an IP"""
+        if not ip or action not in ("block_ip", "alert"):
+            return
+        with self._lock:
+            self.actions += 1
+            self._rotate(time.time() if now is None else now)
+            self._current.offenders.add(str(ip))
+
+    def distinct_users(self, ip: str) -> int:
+        """Estimated distinct users of an IP's current burst (0 if untracked)"""
+        with self._lock:
+            seen = self._ip_users.get(ip)
+            return seen[1].count() if seen else 0
+
+    # ===== MERGING ACROSS WORKERS =====
+
+    def export(self, now: Optional[float] = None) -> Dict:
+        """JSON-serialisable snapshot of the last two windows, mergeable with other workers'"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._rotate(now)
+            summaries = {}
+            for attribute in ("ips", "asns", "offenders"):
+                summary = getattr(self._current, attribute).copy()
+                summaries[attribute] = summary.merge(getattr(self._previous, attribute)).to_dict()
+            for attribute in ("distinct_ips", "distinct_users"):
+                sketch = getattr(self._current, attribute).copy()
+                summaries[attribute] = sketch.merge(getattr(self._previous, attribute)).to_dict()
+            # Per-IP distinct users only for the IPs worth reporting
+            summaries["ip_users"] = {
+                ip: self._ip_users[ip][1].to_dict()
+                for ip, _, _ in summaries["ips"]["items"] if ip in self._ip_users
+            }
+        return {"window_seconds": self.window_seconds, "exported_at": now, **summaries}
+
+    def add_peer(self, origin: str, snapshot: Dict, now: Optional[float] = None):
+        """Keep another worker's latest export for report()"""
+        self._peers[origin] = (time.time() if now is None else now, snapshot)
+
+    def report(self, limit: int = 20, max_age: float = 15.0, now: Optional[float] = None) -> Dict:
+        """Top talkers of this worker merged with every peer export younger than max_age seconds"""
+        now = time.time() if now is None else now
+        for origin, (received, _) in list(self._peers.items()):
+            if now - received > max_age:
+                del self._peers[origin]
+        snapshots = [self.export(now)] + [snapshot for _, snapshot in self._peers.values()]
+
+        merged: Dict = {}
+        ip_users: Dict[str, HyperLogLog] = {}
+        for snapshot in snapshots:
+            for attribute in ("ips", "asns", "offenders"):
+                summary = SpaceSaving.from_dict(snapshot[attribute])
+                merged[attribute] = merged[attribute].merge(summary) if attribute in merged else summary
+            for attribute in ("distinct_ips", "distinct_users"):
+                sketch = HyperLogLog.from_dict(snapshot[attribute])
+                merged[attribute] = merged[attribute].merge(sketch) if attribute in merged else sketch
+            for ip, data in snapshot["ip_users"].items():
+                sketch = HyperLogLog.from_dict(data)
+                ip_users[ip] = ip_users[ip].merge(sketch) if ip in ip_users else sketch
+
+        return {
+            "window_seconds": self.window_seconds,
+            "workers": len(snapshots),
+            "events": merged["ips"].total,
+            "distinct_ips": merged["distinct_ips"].count(),
+            "distinct_users": merged["distinct_users"].count(),
+            "top_ips": [
+                {"ip": ip, "events": count, "error": error,
+                 "distinct_users": ip_users[ip].count() if ip in ip_users else None}
+                for ip, count, error in merged["ips"].top(limit)
+            ],
+            "top_asns": [
+                {"asn": asn, "events": count, "error": error}
+                for asn, count, error in merged["asns"].top(limit)
+            ],
+            "top_offenders": [
+                {"ip": ip, "actions": count, "error": error}
+                for ip, count, error in merged["offenders"].top(limit)
+            ]
+        }
+
+    def get_stats(self) -> Dict:
+        return {
+            "k": self.k,
+            "window_seconds": self.window_seconds,
+            "tracked_ips": len(self._ip_users),
+            "max_ips": self.max_ips,
+            "peers": len(self._peers),
+            "recorded": self.recorded,
+            "actions": self.actions,
+            "evicted": self.evicted
+        }
+
+
+def create_top_talkers(asn_of: Optional[Callable[[str], str]] = None) -> TopTalkers:
+    return TopTalkers(
+        k=int(os.getenv("TOPK_SIZE", "100")),
+        window_seconds=float(os.getenv("TOPK_WINDOW_SECONDS", "300")),
+        precision=int(os.getenv("HLL_PRECISION", "12")),
+        ip_precision=int(os.getenv("HLL_IP_PRECISION", "8")),
+        max_ips=int(os.getenv("TALKER_MAX_IPS", "20000")),
+        asn_of=asn_of
+    )
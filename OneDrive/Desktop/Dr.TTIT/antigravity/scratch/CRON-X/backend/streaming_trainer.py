@@ -0,0 +1,221 @@
+"""
+Streaming Trainer
+Keeps the anomaly model tracking drift without bulk /mcp/train uploads:
+- recent low-score (normal) events are kept in a bounded sliding window
+- feature mean/variance are tracked online and refresh the scaler
+- on a schedule a fraction of the forest's trees is rebuilt on the window
+  and swapped in as a new model version, saved as an artifact like a
+  /mcp/train model so version numbers stay unique across workers and
+  sibling workers load it
+
+Each refresh costs the same no matter how much history has been seen:
+it fits a fixed number of trees on at most window_size rows.
+"""
+
+import copy
+import os
+import threading
+from dataclasses import replace
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import StandardScaler
+
+
+class StreamingTrainer:
+    def __init__(
+        self,
+        detector,
+        window_size: int = 5000,
+        score_threshold: float = 0.8,
+        tree_fraction: float = 0.1,
+        min_samples: int = 256
+    ):
+        """
+        Initialize the trainer for an AnomalyDetector
+
+        Only events that were predicted normal with an anomaly score at or
+        below score_threshold enter the window, so attacks do not teach
+        the model that they are normal. Each refresh replaces the oldest
+        tree_fraction of the forest.
+        """
+        self.detector = detector
+        self.window_size = window_size
+        self.score_threshold = score_threshold
+        self.tree_fraction = tree_fraction
+        self.min_samples = min_samples
+
+        self._lock = threading.Lock()
+        self._window: Optional[np.ndarray] = None  # ring buffer (window_size, n_features)
+        self._next = 0
+        self._filled = 0
+
+        # Online feature statistics (Chan et al. parallel update), with the
+        # effective count capped at window_size so old traffic is forgotten
+        self._count = 0.0
+        self._mean: Optional[np.ndarray] = None
+        self._m2: Optional[np.ndarray] = None
+
+        self.observed = 0
+        self.refreshes = 0
+        self.last_refresh: Optional[str] = None
+
+    def observe(self, features: np.ndarray, results: List[Tuple]):
+        """
+        Add the normal-looking events of a scored batch to the window
+
+        features is the matrix the batch was scored on, so nothing is
+        extracted again; pass the results after every later check (entity
+        baselines) so events flagged there stay out of the window.
+        """
+        normal = np.fromiter(
+            (not is_anomaly and confidence <= self.score_threshold
+             for is_anomaly, confidence, *_ in results),
+            dtype=bool, count=len(results)
+        )
+        if normal.any():
+            self.add(features[normal])
+
+    def add(self, rows: np.ndarray):
+        """Append feature rows to the sliding window and update running statistics"""
+        rows = rows[-self.window_size:]
+        n = len(rows)
+        with self._lock:
+            if self._window is None or self._window.shape[1] != rows.shape[1]:
+                self._window = np.empty((self.window_size, rows.shape[1]))
+                self._next = self._filled = 0
+                self._count, self._mean, self._m2 = 0.0, None, None
+
+            # Vectorised ring-buffer write (may wrap once)
+            first = min(n, self.window_size - self._next)
+            self._window[self._next:self._next + first] = rows[:first]
+            self._window[:n - first] = rows[first:]
+            self._next = (self._next + n) % self.window_size
+            self._filled = min(self._filled + n, self.window_size)
+
+            self._update_stats(rows)
+            self.observed += n
+
+    def _update_stats(self, rows: np.ndarray):
+        n = len(rows)
+        batch_mean = rows.mean(axis=0)
+        batch_m2 = ((rows - batch_mean) ** 2).sum(axis=0)
+        if self._mean is None:
+            self._count, self._mean, self._m2 = float(n), batch_mean, batch_m2
+        else:
+            total = self._count + n
+            delta = batch_mean - self._mean
+            self._mean = self._mean + delta * n / total
+            self._m2 = self._m2 + batch_m2 + delta ** 2 * self._count * n / total
+            self._count = total
+
+        if self._count > self.window_size:
+            # Down-weight history: keeps mean/variance, caps their inertia
+            self._m2 = self._m2 * (self.window_size / self._count)
+            self._count = float(self.window_size)
+
+    def _snapshot(self) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], Optional[np.ndarray], float]:
+        with self._lock:
+            if self._window is None:
+                return None, None, None, 0.0
+            return self._window[:self._filled].copy(), self._mean.copy(), self._m2.copy(), self._count
+
+    def _refreshed_scaler(self, mean: np.ndarray, m2: np.ndarray, count: float) -> StandardScaler:
+        """A fitted StandardScaler built from the online statistics"""
+        variance = m2 / max(count, 1.0)
+        scaler = StandardScaler()
+        scaler.mean_ = mean
+        scaler.var_ = variance
+        scale = np.sqrt(variance)
+        scaler.scale_ = np.where(scale == 0, 1.0, scale)
+        scaler.n_features_in_ = len(mean)
+        scaler.n_samples_seen_ = int(count)
+        return scaler
+
+    def _replace_trees(self, base: IsolationForest, X: np.ndarray) -> Tuple[IsolationForest, int]:
+        """Copy of base with its oldest trees replaced by trees fitted on X"""
+        n_new = max(1, int(round(len(base.estimators_) * self.tree_fraction)))
+        fresh = IsolationForest(
+            n_estimators=n_new,
+            max_samples=base._max_samples,  # Keeps path-length normalisation identical
+            contamination=base.contamination,
+            random_state=np.random.randint(0, 2 ** 31 - 1)
+        ).fit(X)
+
+        merged = copy.copy(base)
+        for attr in ("estimators_", "estimators_features_", "_decision_path_lengths",
+                     "_average_path_length_per_tree", "_seeds"):
+            old, new = getattr(base, attr), getattr(fresh, attr)
+            if isinstance(old, np.ndarray):
+                setattr(merged, attr, np.concatenate([old[n_new:], new]))
+            else:
+                setattr(merged, attr, list(old[n_new:]) + list(new))
+
+        # Recalibrate the anomaly threshold on the current window
+        merged.offset_ = np.percentile(merged.score_samples(X), 100.0 * base.contamination)
+        return merged, n_new
+
+    def refresh(self) -> Optional[int]:
+        """
+        Build and swap in a refreshed model version
+
+        Runs off the serving path (call it from a background thread).
+        Returns the new version number (as renumbered when saved), or
+        None if there is no trained base model or not enough data yet.
+        """
+        active = self.detector.registry.active
+        window, mean, m2, count = self._snapshot()
+        if active is None or window is None:
+            return None
+        required = max(self.min_samples, active.model._max_samples)
+        if len(window) < required:
+            return None
+
+        scaler = self._refreshed_scaler(mean, m2, count)
+        model, replaced = self._replace_trees(active.model, scaler.transform(window))
+
+        new_version = replace(
+            active,
+            version=self.detector.registry.next_version(),
+            scaler=scaler,
+            model=model,
+            metadata={
+                'trained_at': datetime.now().isoformat(),
+                'n_samples': len(window),
+                'n_estimators': len(model.estimators_),
+                'contamination': model.contamination,
+                'streaming': True,
+                'base_version': active.version,
+                'trees_replaced': replaced
+            }
+        )
+        new_version, _ = self.detector.save_artifact(new_version)
+        self.detector.registry.register(new_version)
+        self.refreshes += 1
+        self.last_refresh = new_version.metadata['trained_at']
+        return new_version.version
+
+    def get_stats(self) -> Dict:
+        return {
+            "window_size": self.window_size,
+            "window_filled": self._filled,
+            "observed": self.observed,
+            "refreshes": self.refreshes,
+            "last_refresh": self.last_refresh,
+            "tree_fraction": self.tree_fraction
+        }
+
+
+def create_streaming_trainer(detector) -> Optional[StreamingTrainer]:
+    """Build the trainer if STREAMING_TRAINING=true, else None"""
+    if os.getenv("STREAMING_TRAINING", "false").lower() != "true":
+        return None
+    return StreamingTrainer(
+        detector,
+        window_size=int(os.getenv("STREAMING_WINDOW_SIZE", "5000")),
+        score_threshold=float(os.getenv("STREAMING_SCORE_THRESHOLD", "0.8")),
+        tree_fraction=float(os.getenv("STREAMING_TREE_FRACTION", "0.1")),
+        min_samples=int(os.getenv("STREAMING_MIN_SAMPLES", "256"))
+    )
@@ -0,0 +1,225 @@
+"""
+Window Counters
+Server-side velocity per IP, user and session over sliding windows
+(1m / 5m / 1h): events, failed auths and distinct users per IP.
+
+Each window of a key is a ring of time buckets (one count per metric) with
+running totals: recording an event advances the ring (zeroing buckets that
+fell out of the window) and bumps the current bucket, reading returns the
+totals - both O(1) amortised. Only the windows some exposed counter needs
+are kept per scope.
+A window therefore covers between (buckets - 1) and buckets bucket widths.
+
+Distinct users per IP are exact at bucket resolution: each user is counted
+in the bucket of its last sighting, and moving it to a newer bucket takes it
+out of the old one. Memory is bounded: at most max_keys keys per scope and
+max_users users per IP are tracked (least recently active dropped first).
+
+Counts are taken when the gateway receives the event and travel with the
+log as its "velocity" block, so the model and DecisionEngine rules see the
+same numbers.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# name -> (seconds, buckets)
+WINDOWS = {"1m": (60, 12), "5m": (300, 10), "1h": (3600, 12)}
+
+# (scope, metric, window) of every counter exposed as a model feature.
+# Failed auths and distinct users per IP start at 5m: over one minute they
+# are almost always 0 / 1 for normal traffic and add nothing the 5m
+# counters do not.
+VELOCITY_COUNTERS = [
+    *(("ip", "events", window) for window in WINDOWS),
+    *(("ip", metric, window) for metric in ("failed", "users") for window in ("5m", "1h")),
+    ("user", "events", "1m"),
+    ("user", "failed", "1h"),
+    ("session", "events", "1m")
+]
+VELOCITY_FEATURE_NAMES = [f"{scope}_{metric}_{window}" for scope, metric, window in VELOCITY_COUNTERS]
+
+# event_type values counted as failed authentication
+FAILED_EVENT_TYPES = {"failed_auth", "failed_login", "login_failed"}
+
+
+def velocity_features(velocity: Optional[Dict]) -> Dict[str, float]:
+    """The VELOCITY_FEATURE_NAMES values of a log's velocity block (0 when missing)"""
+    velocity = velocity or {}
+    return {name: velocity.get(name) or 0 for name in VELOCITY_FEATURE_NAMES}
+
+
+# Metrics tracked per scope (users = distinct user_ids, IP scope only)
+SCOPE_METRICS = {"ip": ("events", "failed", "users"), "user": ("events", "failed"), "session": ("events",)}
+
+
+class WindowRing:
+    """Per-metric counts of one key over one sliding window"""
+
+    __slots__ = ("width", "buckets", "slot", "totals")
+
+    def __init__(self, seconds: float, buckets: int, metrics: int):
+        self.width = seconds / buckets
+        self.buckets = [[0] * metrics for _ in range(buckets)]
+        self.slot = 0  # Absolute number of the newest bucket
+        self.totals = [0] * metrics
+
+    def advance(self, now: float) -> List[int]:
+        """Move the window forward to now and return the current bucket"""
+        slot = int(now // self.width)
+        gap = slot - self.slot
+        if gap > 0:
+            n = len(self.buckets)
+            metrics = len(self.totals)
+            if gap >= n:
+                self.buckets = [[0] * metrics for _ in range(n)]
+                self.totals = [0] * metrics
+            else:
+                totals = self.totals
+                for s in range(self.slot + 1, slot + 1):
+                    bucket = self.buckets[s % n]
+                    for m in range(metrics):
+                        totals[m] -= bucket[m]
+                        bucket[m] = 0
+            self.slot = slot
+        return self.buckets[self.slot % len(self.buckets)]
+
+    def bucket_at(self, t: float) -> Optional[List[int]]:
+        """The bucket holding time t, or None if t is outside the window (call after advance)"""
+        old = int(t // self.width)
+        if self.slot - len(self.buckets) < old <= self.slot:
+            return self.buckets[old % len(self.buckets)]
+        return None
+
+
+class KeyCounters:
+    """Rings of one key, one per window its scope exposes"""
+
+    __slots__ = ("rings", "users")
+
+    def __init__(self, windows: List[str], metrics: int, track_users: bool):
+        self.rings = [WindowRing(*WINDOWS[window], metrics) for window in windows]
+        self.users: Optional["OrderedDict[str, float]"] = OrderedDict() if track_users else None
+
+
+class ActivityCounters:
+    def __init__(self, max_keys: int = 100000, max_users: int = 1000):
+        """At most max_keys keys per scope and max_users distinct users per IP"""
+        self.max_keys = max_keys
+        self.max_users = max_users
+        self._scopes: Dict[str, "OrderedDict[str, KeyCounters]"] = {scope: OrderedDict() for scope in SCOPE_METRICS}
+        # Only the windows some exposed counter needs are kept per scope
+        self._windows = {
+            scope: [w for w in WINDOWS if any(c[0] == scope and c[2] == w for c in VELOCITY_COUNTERS)]
+            for scope in SCOPE_METRICS
+        }
+        # scope -> [(feature name, ring index, metric index)]
+        self._outputs = {
+            scope: [
+                (f"{scope}_{metric}_{window}", self._windows[scope].index(window), SCOPE_METRICS[scope].index(metric))
+                for c_scope, metric, window in VELOCITY_COUNTERS if c_scope == scope
+            ]
+            for scope in SCOPE_METRICS
+        }
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.evicted = 0
+
+    def _counters(self, scope: str, key: str) -> KeyCounters:
+        table = self._scopes[scope]
+        counters = table.get(key)
+        if counters is None:
+            counters = table[key] = KeyCounters(
+                self._windows[scope], len(SCOPE_METRICS[scope]), track_users=(scope == "ip")
+            )
+            if len(table) > self.max_keys:
+                table.popitem(last=False)
+                self.evicted += 1
+        else:
+            table.move_to_end(key)
+        return counters
+
+    @staticmethod
+    def _is_failure(log: Dict) -> bool:
+        return log.get('event_type') in FAILED_EVENT_TYPES or log.get('success') is False
+
+    def _track_user(self, counters: KeyCounters, user_id: str, now: float):
+        """Count user_id in the current bucket of every ring, moving it from its last one"""
+        users = counters.users
+        previous = users.pop(user_id, None)
+        for ring in counters.rings:
+            current = ring.buckets[ring.slot % len(ring.buckets)]
+            old = ring.bucket_at(previous) if previous is not None else None
+            if old is not None:
+                old[2] -= 1
+                ring.totals[2] -= 1
+            current[2] += 1
+            ring.totals[2] += 1
+        users[user_id] = now
+        if len(users) > self.max_users:
+            _, oldest = users.popitem(last=False)
+            for ring in counters.rings:
+                old = ring.bucket_at(oldest)
+                if old is not None:
+                    old[2] -= 1
+                    ring.totals[2] -= 1
+
+    def record(self, log: Dict, now: Optional[float] = None) -> Dict[str, int]:
+        """Count one event and return its velocity block (counts include this event)"""
+        now = time.time() if now is None else now
+        failed = self._is_failure(log)
+        user_id = log.get('user_id')
+        keys = (("ip", log.get('ip')), ("user", user_id), ("session", log.get('session_id')))
+        velocity = dict.fromkeys(VELOCITY_FEATURE_NAMES, 0)
+        with self._lock:
+            self.recorded += 1
+            for scope, key in keys:
+                if not key:
+                    continue
+                counters = self._counters(scope, str(key))
+                has_failed = len(SCOPE_METRICS[scope]) > 1
+                for ring in counters.rings:
+                    bucket = ring.advance(now)
+                    bucket[0] += 1
+                    ring.totals[0] += 1
+                    if failed and has_failed:
+                        bucket[1] += 1
+                        ring.totals[1] += 1
+                if counters.users is not None and user_id:
+                    self._track_user(counters, str(user_id), now)
+                rings = counters.rings
+                for name, ring_index, metric_index in self._outputs[scope]:
+                    velocity[name] = rings[ring_index].totals[metric_index]
+        return velocity
+
+    def snapshot(self, scope: str, key: str, now: Optional[float] = None) -> Dict[str, int]:
+        """Current counts of one key without recording anything (empty if untracked)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            counters = self._scopes[scope].get(key)
+            if counters is None:
+                return {}
+            snapshot = {}
+            for window, ring in zip(self._windows[scope], counters.rings):
+                ring.advance(now)
+                for metric, total in zip(SCOPE_METRICS[scope], ring.totals):
+                    snapshot[f"{metric}_{window}"] = total
+            return snapshot
+
+    def get_stats(self) -> Dict:
+        return {
+            "tracked": {scope: len(table) for scope, table in self._scopes.items()},
+            "max_keys": self.max_keys,
+            "recorded": self.recorded,
+            "evicted": self.evicted
+        }
+
+
+def create_activity_counters() -> ActivityCounters:
+    return ActivityCounters(
+        max_keys=int(os.getenv("VELOCITY_MAX_KEYS", "100000")),
+        max_users=int(os.getenv("VELOCITY_MAX_USERS_PER_IP", "1000"))
+    )
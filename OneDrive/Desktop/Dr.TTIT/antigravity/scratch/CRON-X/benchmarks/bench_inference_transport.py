@@ -0,0 +1,120 @@
+"""
+Benchmark: p50/p99 latency of the http vs inprocess inference transports
+
+Run from the CRON-X directory:
+    python -m benchmarks.bench_inference_transport [--requests 2000] [--concurrency 1]
+
+The http mode starts `python mcp_server.py` on port 8001 as a subprocess
+(unless one is already answering /health) and talks to it through the
+pooled client, exactly as the Decision Engine does in production.
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from backend.inference_transport import HttpTransport, InProcessTransport
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+MCP_URL = "http://localhost:8001"
+
+
+def sample_log(i: int) -> dict:
+    return {
+        "timestamp": time.time() - (i % 24) * 3600,
+        "user_id": f"user_{i % 50}",
+        "session_id": f"sess_{i % 200}",
+        "ip": f"10.0.{i % 255}.{(i * 7) % 255}",
+        "event_type": "activity_heartbeat",
+        "cursor_speed": (i * 37) % 1500,
+        "keystroke_speed": 100 + (i * 13) % 500,
+        "session_duration": (i * 101) % 7200,
+        "api_calls_count": i % 120,
+        "failed_logins": i % 6
+    }
+
+
+def mcp_is_up() -> bool:
+    try:
+        return httpx.get(f"{MCP_URL}/health", timeout=0.5).status_code == 200
+    except httpx.HTTPError:
+        return False
+
+
+def start_mcp_server():
+    """Start the MCP server unless one is already running; returns the process we started"""
+    if mcp_is_up():
+        return None
+
+    proc = subprocess.Popen(
+        [sys.executable, "mcp_server.py"],
+        cwd=BACKEND_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if mcp_is_up():
+            return proc
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("MCP server did not become healthy within 60s")
+
+
+async def measure(transport, n_requests: int, concurrency: int) -> np.ndarray:
+    """Return per-request latencies in milliseconds"""
+    await transport.start()
+    logs = [sample_log(i) for i in range(n_requests)]
+
+    # Warm up connections / threads
+    for log in logs[:20]:
+        await transport.infer(log)
+
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(log):
+        async with semaphore:
+            started = time.perf_counter()
+            await transport.infer(log)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*[one(log) for log in logs])
+    await transport.close()
+    return np.array(latencies)
+
+
+def report(name: str, latencies: np.ndarray):
+    p50, p99 = np.percentile(latencies, [50, 99])
+    print(f"{name:<10} n={len(latencies):<6} p50={p50:7.3f}ms  p99={p99:7.3f}ms  mean={latencies.mean():7.3f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"Inference transport latency ({args.requests} requests, concurrency={args.concurrency})")
+
+    report("inprocess", await measure(InProcessTransport(), args.requests, args.concurrency))
+
+    proc = start_mcp_server()
+    try:
+        report("http", await measure(HttpTransport(MCP_URL), args.requests, args.concurrency))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    os.chdir(BACKEND_DIR.parent)
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+"""
+Benchmark: MCP model startup time
+
+Run from the CRON-X directory:
+    python -m benchmarks.bench_startup [--runs 5]
+
+Each scenario runs in a fresh interpreter against a temporary MODEL_DIR:
+- import:  `import ai_detector` only (no model work happens at import)
+- cold:    import + initialize_detector() with no artifact (train + save v1)
+- warm:    import + initialize_detector() loading the newest artifact
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+SCRIPT = """
+import json, time
+started = time.perf_counter()
+import ai_detector
+imported = time.perf_counter()
+status = ai_detector.initialize_detector() if {initialize} else "skipped"
+ready = time.perf_counter()
+print(json.dumps({{"import_ms": (imported - started) * 1000,
+                  "total_ms": (ready - started) * 1000,
+                  "status": status}}))
+"""
+
+
+def run_once(model_dir: str, initialize: bool) -> dict:
+    env = dict(os.environ, MODEL_DIR=model_dir)
+    output = subprocess.run(
+        [sys.executable, "-c", SCRIPT.format(initialize=initialize)],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    results = {"import": [], "cold": [], "warm": []}
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as model_dir:
+            results["import"].append(run_once(model_dir, initialize=False))
+            cold = run_once(model_dir, initialize=True)
+            assert cold["status"] == "trained", cold
+            results["cold"].append(cold)
+            warm = run_once(model_dir, initialize=True)
+            assert warm["status"] == "loaded", warm
+            results["warm"].append(warm)
+
+    print(f"MCP model startup time (median of {args.runs} fresh interpreters)")
+    for name, runs in results.items():
+        total = statistics.median(r["total_ms"] for r in runs)
+        imported = statistics.median(r["import_ms"] for r in runs)
+        print(f"{name:<7} import={imported:8.1f}ms  ready={total:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
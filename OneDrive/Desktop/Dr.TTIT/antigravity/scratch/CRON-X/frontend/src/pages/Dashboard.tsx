@@ -5,10 +5,27 @@ import AlertDetail from '../components/AlertDetail';
 import Chatbot from '../components/Chatbot';
 import EmailConfig from '../components/EmailConfig';
 import { useSocket } from '../context/SocketContext';
-import { Alert } from '../types';
+import { Alert, AuditLog, Note } from '../types';
 import axios from 'axios';
 import { Mail, Ban, Shield, Activity, Zap } from 'lucide-react';
 
+interface Appended<T> {
+    from: number;
+    entries: T[];
+}
+
+// alert_update deltas carry only the notes/audit entries appended at index
+// `from`; replacing from there keeps a repeated or already-fetched update idempotent
+const appendAt = <T,>(list: T[] = [], appended?: Appended<T>): T[] =>
+    appended ? [...list.slice(0, appended.from), ...appended.entries] : list;
+
+const applyAlertChanges = (alert: Alert, changes: any): Alert => ({
+    ...alert,
+    status: changes.status ?? alert.status,
+    notes: appendAt<Note>(alert.notes, changes.notes),
+    audit: appendAt<AuditLog>(alert.audit, changes.audit)
+});
+
 const Dashboard: React.FC = () => {
     const { lastMessage, isConnected } = useSocket();
     const [alerts, setAlerts] = useState<Alert[]>([]);
@@ -85,11 +102,12 @@ const Dashboard: React.FC = () => {
                 // Optional: auto-select if it's high severity?
                 // if (newAlert.severity === 'high') setSelectedAlert(newAlert);
             } else if (lastMessage.type === 'alert_update') {
+                const merge = (a: Alert) => applyAlertChanges(a, lastMessage.changes);
                 setAlerts(prev => prev.map(a =>
-                    a.alert_id === lastMessage.alert_id ? { ...a, ...lastMessage.changes } : a
+                    a.alert_id === lastMessage.alert_id ? merge(a) : a
                 ));
                 if (selectedAlert?.alert_id === lastMessage.alert_id) {
-                    setSelectedAlert(prev => prev ? { ...prev, ...lastMessage.changes } : null);
+                    setSelectedAlert(prev => prev ? merge(prev) : null);
                 }
             }
         }